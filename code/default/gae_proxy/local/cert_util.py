@@ -12,6 +12,11 @@ import hashlib
 import threading
 import subprocess
 import datetime
+import calendar
+import collections
+import contextlib
+import ssl
+import Queue
 
 current_path = os.path.dirname(os.path.abspath(__file__))
 python_path = os.path.abspath( os.path.join(current_path, os.pardir, os.pardir, 'python27', '1.0'))
@@ -59,14 +64,27 @@ class CertUtil(object):
     ca_subject = None
     ca_certdir = os.path.join(data_path, 'certs')
     ca_digest = 'sha256'
+    # protect cert_name_locks and key pool thread, not hold when minting cert.
     ca_lock = threading.Lock()
+    # commonname => [lock, user num], mint certs of different names in parallel.
+    cert_name_locks = {}
     ca_validity_years = 10
     ca_validity = 24 * 60 * 60 * 365 * ca_validity_years
     cert_validity_years = 2
     cert_validity = 24 * 60 * 60 * 365 * cert_validity_years
     cert_publickey = None
     cert_keyfile = os.path.join(data_path, 'Certkey.pem')
+    # keys generated ahead, used when no cert_publickey to share.
+    key_pool = Queue.Queue()
+    key_pool_size = 4
+    key_pool_thread = None
     serial_reduce =  3600 * 24 * 365 * 46
+    # host => (ssl context, expire_time, full_name), least recently used first.
+    cert_contexts = collections.OrderedDict()
+    cert_contexts_max = 500
+    cert_context_lock = threading.Lock()
+    # hosts renewing context in background.
+    cert_context_renewing = set()
 
     @staticmethod
     def create_ca():
@@ -143,8 +161,7 @@ class CertUtil(object):
         if CertUtil.cert_publickey:
             pkey = CertUtil.cert_publickey
         else:
-            pkey = OpenSSL.crypto.PKey()
-            pkey.generate_key(OpenSSL.crypto.TYPE_RSA, 2048)
+            pkey = CertUtil._get_key()
         cert.set_pubkey(pkey)
 
         sans = set(sans) if sans else set()
@@ -156,12 +173,72 @@ class CertUtil(object):
         cert.sign(CertUtil.ca_privatekey, CertUtil.ca_digest)
 
         certfile = os.path.join(CertUtil.ca_certdir, commonname + '.crt')
-        with open(certfile, 'wb') as fp:
+        # write to temp file then rename, reader without lock never see a part of cert.
+        tmp_file = certfile + '.tmp'
+        with open(tmp_file, 'wb') as fp:
             fp.write(OpenSSL.crypto.dump_certificate(OpenSSL.crypto.FILETYPE_PEM, cert))
             if CertUtil.cert_publickey is None:
                 fp.write(OpenSSL.crypto.dump_privatekey(OpenSSL.crypto.FILETYPE_PEM, pkey))
+        if sys.platform == "win32" and os.path.exists(certfile):
+            # rename can't overwrite on windows.
+            os.remove(certfile)
+        os.rename(tmp_file, certfile)
         return certfile
 
+    @staticmethod
+    def _generate_key():
+        pkey = OpenSSL.crypto.PKey()
+        pkey.generate_key(OpenSSL.crypto.TYPE_RSA, 2048)
+        return pkey
+
+    @staticmethod
+    def _fill_key_pool():
+        while True:
+            with CertUtil.ca_lock:
+                if CertUtil.key_pool.qsize() >= CertUtil.key_pool_size:
+                    CertUtil.key_pool_thread = None
+                    return
+            CertUtil.key_pool.put(CertUtil._generate_key())
+
+    @staticmethod
+    def _start_fill_key_pool():
+        if not CertUtil.key_pool_size:
+            return
+
+        with CertUtil.ca_lock:
+            if CertUtil.key_pool_thread:
+                return
+            CertUtil.key_pool_thread = threading.Thread(target=CertUtil._fill_key_pool)
+            CertUtil.key_pool_thread.daemon = True
+            CertUtil.key_pool_thread.start()
+
+    @staticmethod
+    def _get_key():
+        try:
+            pkey = CertUtil.key_pool.get_nowait()
+        except Queue.Empty:
+            pkey = CertUtil._generate_key()
+
+        CertUtil._start_fill_key_pool()
+        return pkey
+
+    @staticmethod
+    @contextlib.contextmanager
+    def _lock_name(commonname):
+        with CertUtil.ca_lock:
+            item = CertUtil.cert_name_locks.setdefault(commonname, [threading.Lock(), 0])
+            item[1] += 1
+
+        item[0].acquire()
+        try:
+            yield
+        finally:
+            item[0].release()
+            with CertUtil.ca_lock:
+                item[1] -= 1
+                if not item[1]:
+                    del CertUtil.cert_name_locks[commonname]
+
     @staticmethod
     def _get_old_cert(commonname):
         certfile = os.path.join(CertUtil.ca_certdir, commonname + '.crt')
@@ -172,6 +249,9 @@ class CertUtil(object):
                 try:
                     os.remove(certfile)
                 except OSError as e:
+                    if not os.path.exists(certfile):
+                        # removed by other thread.
+                        return
                     xlog.warning('CertUtil._get_old_cert failed: unable to remove outdated cert, %r', e)
                 else:
                     return
@@ -181,21 +261,82 @@ class CertUtil(object):
     @staticmethod
     def get_cert(commonname, sans=None, full_name=False):
         isip =  check_ip_valid(commonname)
-        with CertUtil.ca_lock:
+        certfile = CertUtil._get_old_cert(commonname)
+        if certfile:
+            return certfile
+
+        # some site need full name cert
+        # like https://about.twitter.com in Google Chrome
+        if not isip and not full_name and commonname.count('.') >= 2 and [len(x) for x in reversed(commonname.split('.'))] > [2, 4]:
+            commonname = commonname.partition('.')[-1]
             certfile = CertUtil._get_old_cert(commonname)
             if certfile:
                 return certfile
 
-            # some site need full name cert
-            # like https://about.twitter.com in Google Chrome
-            if not isip and not full_name and commonname.count('.') >= 2 and [len(x) for x in reversed(commonname.split('.'))] > [2, 4]:
-                commonname = commonname.partition('.')[-1]
-                certfile = CertUtil._get_old_cert(commonname)
-                if certfile:
-                    return certfile
+        # only wait for the same name, which is minted once.
+        with CertUtil._lock_name(commonname):
+            certfile = CertUtil._get_old_cert(commonname)
+            if certfile:
+                return certfile
 
             return CertUtil._get_cert(commonname, isip, sans)
 
+    @staticmethod
+    def _create_context(host, full_name=False):
+        certfile = CertUtil.get_cert(host, full_name=full_name)
+        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+        context.load_cert_chain(certfile, CertUtil.cert_keyfile)
+
+        with open(certfile, 'rb') as fp:
+            cert = OpenSSL.crypto.load_certificate(OpenSSL.crypto.FILETYPE_PEM, fp.read())
+        not_after = calendar.timegm(time.strptime(cert.get_notAfter(), '%Y%m%d%H%M%SZ'))
+        # same as _get_old_cert, renew 30 days before cert outdated.
+        expire_time = not_after - 30 * 24 * 3600
+
+        with CertUtil.cert_context_lock:
+            CertUtil.cert_contexts.pop(host, None)
+            CertUtil.cert_contexts[host] = (context, expire_time, full_name)
+            while len(CertUtil.cert_contexts) > CertUtil.cert_contexts_max:
+                CertUtil.cert_contexts.popitem(last=False)
+        return context
+
+    @staticmethod
+    def _renew_context(host, full_name=False):
+        try:
+            CertUtil._create_context(host, full_name)
+        except Exception as e:
+            xlog.warning('CertUtil renew context for %s failed: %r', host, e)
+        finally:
+            with CertUtil.cert_context_lock:
+                CertUtil.cert_context_renewing.discard(host)
+
+    @staticmethod
+    def get_context(host, full_name=False):
+        # ssl context with cert of host, kept in memory,
+        # handshake of cached host don't read cert file or wait ca_lock.
+        if full_name:
+            return CertUtil._create_context(host, full_name)
+
+        with CertUtil.cert_context_lock:
+            item = CertUtil.cert_contexts.pop(host, None)
+            if not item:
+                renew = False
+            else:
+                CertUtil.cert_contexts[host] = item
+                context, expire_time, cached_full_name = item
+                renew = expire_time < time.time() and host not in CertUtil.cert_context_renewing
+                if renew:
+                    CertUtil.cert_context_renewing.add(host)
+
+        if not item:
+            return CertUtil._create_context(host)
+
+        if renew:
+            # cert is still valid for 30 days, hot host use it until new one ready.
+            # keep the full name cert if it replaced the wildcard one after ssl error.
+            threading.Thread(target=CertUtil._renew_context, args=(host, cached_full_name)).start()
+        return context
+
     @staticmethod
     def win32_notify( msg="msg", title="Title"):
         import ctypes
@@ -516,6 +657,8 @@ class CertUtil(object):
                 CertUtil.generate_cert_keyfile()
         else:
             CertUtil.cert_keyfile = None
+            # every cert need a new key.
+            CertUtil._start_fill_key_pool()
 
         # Check exist site cert buffer with CA
         certfiles = glob.glob(os.path.join(CertUtil.ca_certdir, '*.crt')) + glob.glob(os.path.join(CertUtil.ca_certdir, '.*.crt'))
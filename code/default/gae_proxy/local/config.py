@@ -19,8 +19,24 @@ class Config(ConfigBase):
         # auto range
         self.set_var("AUTORANGE_THREADS", 20)
         self.set_var("AUTORANGE_MAXSIZE", 548576)
+        self.set_var("AUTORANGE_MINSIZE", 131072)
+        # chunk size of a worker is its speed * AUTORANGE_CHUNK_TIME, in MINSIZE - MAXSIZE.
+        self.set_var("AUTORANGE_CHUNK_TIME", 3)
+        # request again the slowest chunk near the end, or the one blocking a full buffer,
+        # if it is expected to take longer than this.
+        self.set_var("AUTORANGE_HEDGE_TIME", 1)
+        # data wait for the browser more than this is kept in a temp file.
+        self.set_var("AUTORANGE_MEMORY_SIZE", 4 * 1024 * 1024)
         self.set_var("JS_MAXSIZE", 2097152)
 
+        # local cache of GET responses, sent without request to GAE when fresh.
+        self.set_var("http_cache_enable", 0)
+        self.set_var("http_cache_max_size", 200 * 1024 * 1024)
+        self.set_var("http_cache_max_entry_size", 4 * 1024 * 1024)
+
+        # the same GET requests on the way share one request to GAE.
+        self.set_var("coalesce_requests", 1)
+
         # gae
         self.set_var("GAE_PASSWORD", "")
         self.set_var("GAE_VALIDATE", 0)
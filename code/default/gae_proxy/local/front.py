@@ -17,6 +17,7 @@ from front_base.connect_manager import ConnectManager
 from check_ip import CheckIp
 
 from appid_manager import AppidManager
+from http_cache import HttpCache
 
 current_path = os.path.dirname(os.path.abspath(__file__))
 root_path = os.path.abspath(os.path.join(current_path, os.pardir, os.pardir))
@@ -81,6 +82,8 @@ class Front(object):
             logger, self.config, self.ip_manager, self.connect_manager
         )
 
+        self.http_cache = HttpCache(logger, self.config, os.path.join(module_data_path, "http_cache"))
+
     def check_ip(self, ip):
         sni = self.host_manager.sni_manager.get()
         host = "xxnet-1.appspot.com"
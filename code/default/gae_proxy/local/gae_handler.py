@@ -64,6 +64,8 @@ import urlparse
 import threading
 import zlib
 import traceback
+import mmap
+import tempfile
 from mimetypes import guess_type
 
 from front import front
@@ -81,6 +83,73 @@ def deflate(data):
     return zlib.compress(data)[2:-4]
 
 
+# deflate request body only if content is not compressed already.
+compressed_content_types = ('image/', 'video/', 'audio/', 'font/woff',
+                            'application/zip', 'application/gzip', 'application/x-gzip',
+                            'application/x-7z', 'application/x-rar', 'application/x-bzip',
+                            'application/x-xz', 'application/pdf')
+deflate_block_size = 65536
+
+
+def is_compressed_content_type(content_type):
+    content_type = content_type.lower()
+    return content_type.startswith(compressed_content_types) and \
+        'xml' not in content_type and 'svg' not in content_type
+
+
+def deflate_body(body, content_type=""):
+    # return list of deflated blocks, or None if not smaller.
+    # compress stop at the first block if it's not compressible,
+    # so random data cost one block, not the whole body.
+    if is_compressed_content_type(content_type):
+        return None
+
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    blocks = []
+    blocks_len = 0
+    for pos in range(0, len(body), deflate_block_size):
+        data = compressor.compress(buffer(body, pos, deflate_block_size))
+        if pos == 0:
+            # compressor keep data until its window is full, get output of the first block.
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            if len(data) > min(len(body), deflate_block_size) * 0.9:
+                return None
+        blocks.append(data)
+        blocks_len += len(data)
+
+    blocks.append(compressor.flush())
+    blocks_len += len(blocks[-1])
+    if blocks_len >= len(body):
+        return None
+    return blocks
+
+
+class DecodeStream(object):
+    # Decode body of task by a chain of zlib decompressors while it's received.
+    # Body is read into a reused buffer and decoded from it,
+    # no copy or allocation for each frame.
+    def __init__(self, task, body_length, decompressors, buf_size=65536):
+        self.task = task
+        self.body_length = body_length
+        self.decompressors = decompressors
+        self.buf = bytearray(max(1, min(body_length, buf_size)))
+
+    def decode(self, data):
+        for decompressor in self.decompressors:
+            data = decompressor.decompress(data)
+        return data
+
+    def __iter__(self):
+        while self.task.body_readed < self.body_length:
+            data_len = self.task.readinto(self.buf)
+            if not data_len:
+                raise GAE_Exception(600, "get body fail, until:%d" % (self.body_length - self.task.body_readed))
+
+            data = self.decode(buffer(self.buf, 0, data_len))
+            if data:
+                yield data
+
+
 class GAE_Exception(Exception):
     def __init__(self, error_code, message):
         xlog.debug("GAE_Exception %r %r", error_code, message)
@@ -197,16 +266,18 @@ def return_fail_message(wfile):
 
 def pack_request(method, url, headers, body, timeout):
     headers = dict(headers)
+    body_blocks = [body]
     if isinstance(body, basestring) and body:
         if len(body) < 10 * 1024 * 1024 and 'Content-Encoding' not in headers:
             # 可以压缩
-            zbody = deflate(body)
-            if len(zbody) < len(body):
-                body = zbody
+            zbody_blocks = deflate_body(body, headers.get('Content-Type', ''))
+            if zbody_blocks:
+                body_blocks = zbody_blocks
                 headers['Content-Encoding'] = 'deflate'
-        if len(body) > 10 * 1024 * 1024:
-            xlog.warn("body len:%d %s %s", len(body), method, url)
-        headers['Content-Length'] = str(len(body))
+        body_len = sum(len(block) for block in body_blocks)
+        if body_len > 10 * 1024 * 1024:
+            xlog.warn("body len:%d %s %s", body_len, method, url)
+        headers['Content-Length'] = str(body_len)
 
     # GAE don't allow set `Host` header
     if 'Host' in headers:
@@ -236,7 +307,8 @@ def pack_request(method, url, headers, body, timeout):
 
     payload = deflate(payload)
 
-    body = '%s%s%s' % (struct.pack('!h', len(payload)), payload, body)
+    # one copy of the body blocks to the request.
+    body = ''.join([struct.pack('!h', len(payload)), payload] + body_blocks)
     request_headers = {}
     request_headers['Content-Length'] = str(len(body))
     # request_headers 只有上面一项
@@ -437,7 +509,99 @@ def request_gae_proxy(method, url, headers, body, timeout=None):
     raise GAE_Exception(600, b"".join(error_msg))
 
 
+# request headers the response may depend on,
+# requests are coalesced only if url and these headers are the same.
+coalesce_headers = ('Range', 'If-Range', 'If-None-Match', 'If-Modified-Since',
+                    'Accept', 'Accept-Encoding', 'Accept-Language',
+                    'Cookie', 'Authorization', 'Origin')
+coalesced_requests = {}
+coalesce_lock = threading.Lock()
+
+
+class CoalescedRequest(object):
+    # Response of the first request is sent to all the same requests
+    # came before its first byte is sent, by the wfile interface used by handler.
+    def __init__(self, key, wfile):
+        self.key = key
+        self.wfiles = [wfile]
+        self.failed = []
+        self.error = None
+        self.started = False
+        self.done = threading.Event()
+        # body is sent by wfile._sock.sendall
+        self._sock = self
+
+    def start(self):
+        if self.started:
+            return
+
+        with coalesce_lock:
+            self.started = True
+            if coalesced_requests.get(self.key) is self:
+                del coalesced_requests[self.key]
+
+    def send(self, send_fn):
+        # a browser closed don't break the others,
+        # fail only if all of them failed, like a single wfile.
+        for wfile in self.wfiles:
+            if wfile in self.failed:
+                continue
+            try:
+                send_fn(wfile)
+            except Exception as e:
+                self.error = e
+                self.failed.append(wfile)
+
+        if len(self.failed) == len(self.wfiles):
+            raise self.error
+
+    def write(self, data):
+        self.start()
+        self.send(lambda wfile: wfile.write(data))
+
+    def sendall(self, data):
+        self.start()
+        self.send(lambda wfile: wfile._sock.sendall(data))
+
+    def flush(self):
+        self.send(lambda wfile: wfile.flush())
+
+    def finish(self):
+        self.start()
+        try:
+            self.flush()
+        except Exception:
+            pass
+        self.done.set()
+
+
 def handler(method, host, url, headers, body, wfile):
+    if method != "GET" or body or not front.config.coalesce_requests:
+        return handle_request(method, host, url, headers, body, wfile)
+
+    key = (url,) + tuple(headers.get(name) for name in coalesce_headers)
+    with coalesce_lock:
+        request = coalesced_requests.get(key)
+        if request:
+            request.wfiles.append(wfile)
+        else:
+            request = coalesced_requests[key] = CoalescedRequest(key, wfile)
+
+    if request.wfiles[0] is not wfile:
+        xlog.debug("GAE coalesced %s", url)
+        # response is sent by the thread of first request.
+        request.done.wait()
+        return
+
+    try:
+        return handle_request(method, host, url, headers, body, request)
+    finally:
+        if len(request.wfiles) > 1:
+            xlog.info("GAE coalesced %d requests %s", len(request.wfiles), url)
+        request.finish()
+
+
+def handle_request(method, host, url, headers, body, wfile):
     if not url.startswith("http") and not url.startswith("HTTP"):
         xlog.error("gae:%s", url)
         return
@@ -492,8 +656,29 @@ def handler(method, host, url, headers, body, wfile):
             # headers["Range"] = "bytes=0-%d" % config.AUTORANGE_MAXSIZE
             pass
 
+    cacheable = front.http_cache.is_cacheable_request(method, headers)
+    cache_entry = None
+    # headers sent to GAE, with validators of stale entry.
+    # headers of browser are kept for the response from cache.
+    gae_headers = headers
+    if cacheable:
+        cache_entry = front.http_cache.get(url, headers)
+        if cache_entry and cache_entry.is_fresh(headers):
+            if front.http_cache.send_entry(wfile, cache_entry, headers):
+                xlog.info("GAE cache hit t:%d s:%d %s %s", (time.time() - request_time) * 1000,
+                          cache_entry.size, method, url)
+                return
+            cache_entry = None
+        elif cache_entry and "If-None-Match" not in headers and "If-Modified-Since" not in headers:
+            # revalidate stale entry
+            gae_headers = dict(headers)
+            gae_headers.update(cache_entry.conditional_headers())
+        else:
+            cache_entry = None
+
+    gae_request_time = time.time()
     try:
-        response = request_gae_proxy(method, url, headers, body)
+        response = request_gae_proxy(method, url, gae_headers, body)
         # gae代理请求
     except GAE_Exception as e:
         xlog.warn("GAE %s %s request fail:%r", method, url, e)
@@ -506,12 +691,22 @@ def handler(method, host, url, headers, body, wfile):
     else:
         response.status = response.app_status
 
+    if cache_entry and response.status == 304:
+        front.http_cache.refresh(cache_entry, response.headers)
+        if front.http_cache.send_entry(wfile, cache_entry, headers, revalidated=True):
+            xlog.info("GAE cache revalidated t:%d s:%d %s %s", (time.time() - request_time) * 1000,
+                      cache_entry.size, method, url)
+            return
+
+        # entry file is removed, request again without validators.
+        return handle_request(method, host, url, headers, body, wfile)
+
     if response.status == 206:
         # use org_headers
         # RangeFetch need to known the real range end
         # 需要分片
         return RangeFetch2(method, url, org_headers,
-                           body, response, wfile).run()
+                           body, response, wfile, gae_request_time).run()
 
     response_headers = {}
     #　初始化给客户端的headers
@@ -627,61 +822,66 @@ def handler(method, host, url, headers, body, wfile):
                     if "deflate" in headers.get("Accept-Encoding", ""):
                         # return deflate data if accept deflate
                         response_headers["Content-Encoding"] = "deflate"
-
-                        send_response_headers()
-                        while True:
-                            wfile._sock.sendall(decoded_data0)
-                            if response.task.body_readed >= body_length:
-                                break
-                            data = response.task.read().tobytes()
-                            decoded_data0 = gzip_decompressor.decompress(data)
-                        xlog.info("GAE send ungziped deflate data to browser t:%d s:%d %s %s %s", (time.time() - request_time) * 1000, content_length, method,
-                                  url, response.task.get_trace())
-
+                        data = decoded_data0
+                        stream = DecodeStream(response.task, body_length, [gzip_decompressor])
+                        encoding = "ungziped deflate"
                     else:
                         # inflate data and send
                         del response_headers["Content-Encoding"]
-
-                        send_response_headers()
-                        while True:
-                            wfile._sock.sendall(decoded_data1)
-                            if response.task.body_readed >= body_length:
-                                break
-                            data = response.task.read().tobytes()
-                            decoded_data0 = gzip_decompressor.decompress(data)
-                            decoded_data1 = deflate_decompressor.decompress(decoded_data0)
-                        xlog.info("GAE send ungziped data to browser t:%d s:%d %s %s %s", (time.time() - request_time) * 1000, content_length, method,
-                                  url, response.task.get_trace())
+                        data = decoded_data1
+                        stream = DecodeStream(response.task, body_length,
+                                              [gzip_decompressor, deflate_decompressor])
+                        encoding = "ungziped"
+
+                    send_response_headers()
+                    wfile._sock.sendall(data)
+                    for data in stream:
+                        wfile._sock.sendall(data)
+                    xlog.info("GAE send %s data to browser t:%d s:%d %s %s %s", encoding,
+                              (time.time() - request_time) * 1000, content_length, method,
+                              url, response.task.get_trace())
 
                     return
                 except Exception as e:
                     xlog.info("gae_handler.handler try decode and send response fail. e:%r %s", e, url)
                     return
 
+    cache_writer = None
+    if cacheable:
+        cache_writer = front.http_cache.create_writer(url, headers, response.status, response.reason,
+                                                      response_headers, body_length)
+
     try:
         send_response_headers()
 
         if data0:
             wfile._sock.sendall(data0)
             body_sended = len(data0)
+            if cache_writer:
+                cache_writer.write(data0)
         else:
             body_sended = 0
     except Exception as e:
         xlog.info("gae_handler.handler send response fail. e:%r %s", e, url)
+        if cache_writer:
+            cache_writer.abort()
         return
 
+    # merge small frames received to one send, less ssl record and syscall.
+    send_buf = memoryview(bytearray(max(1, min(body_length - body_sended, 65536))))
     while True:
         # 可能分片发给客户端
         if body_sended >= body_length:
             break
 
-        data = response.task.read()
-        if not data:
+        data_len = response.task.readinto(send_buf)
+        if not data_len:
             xlog.warn("get body fail, until:%d %s",
                       body_length - body_sended, url)
             break
 
-        body_sended += len(data)
+        data = send_buf[:data_len]
+        body_sended += data_len
         try:
             # https 包装
             ret = wfile._sock.sendall(data)
@@ -695,51 +895,188 @@ def handler(method, host, url, headers, body, wfile):
                 xlog.info('gae_handler send to browser return %r %r, len:%d, sended:%d', e_b, url, body_length, body_sended)
             else:
                 xlog.info('gae_handler send to browser return %r %r', e_b, url)
+            if cache_writer:
+                cache_writer.abort()
             return
 
+        if cache_writer:
+            cache_writer.write(data)
+
+    if cache_writer:
+        # stored only if the whole body is received.
+        cache_writer.finish()
+
     # 完整一次https请求
     xlog.info("GAE t:%d s:%d %s %s %s", (time.time() - request_time) * 1000, content_length, method, url,
               response.task.get_trace())
 
 
+class RangeChunk(object):
+    # range [begin, end] in fetching, data received up to pos.
+    def __init__(self, begin, end):
+        self.begin = begin
+        self.end = end
+        self.pos = begin
+        self.start_time = time.time()
+        # requested by another worker as the slowest near the end.
+        self.hedged = False
+
+        # request sent before the worker finish its current chunk.
+        self.response = None
+        self.request_time = None
+        self.requested = None
+
+    def left_time(self, time_now):
+        # expected time to finish at the speed received so far.
+        received = self.pos - self.begin
+        cost = time_now - self.start_time
+        if not received:
+            return cost
+        return (self.end - self.pos + 1) * cost / received
+
+
+class RangeSpillFile(object):
+    # ring buffer in a temp file, data of range offset is at offset % size.
+    # ranges in the file must be in [wait_begin, wait_begin + size).
+    def __init__(self, size):
+        self.size = size
+        self.fd = tempfile.TemporaryFile()
+        self.fd.truncate(size)
+        self.mmap = mmap.mmap(self.fd.fileno(), size)
+
+    def write(self, begin, data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+
+        pos = begin % self.size
+        first_len = min(len(data), self.size - pos)
+        self.mmap[pos:pos + first_len] = data[:first_len]
+        if first_len < len(data):
+            self.mmap[:len(data) - first_len] = data[first_len:]
+
+    def read(self, begin, size):
+        pos = begin % self.size
+        first_len = min(size, self.size - pos)
+        data = self.mmap[pos:pos + first_len]
+        if first_len < size:
+            data += self.mmap[:size - first_len]
+        return data
+
+    def close(self):
+        self.mmap.close()
+        self.fd.close()
+
+
+class RangeFetchStat(object):
+    # measured by each fetch worker, for chunk size and pipelining.
+    def __init__(self):
+        self.speed = 0
+        self.rtt = 1.0
+
+
 class RangeFetch2(object):
     max_buffer_size = int(front.config.AUTORANGE_MAXSIZE *
                           front.config.AUTORANGE_THREADS * 1.3)
-    # max buffer size before browser receive: 20M
+    # max buffer size before browser receive: 20M,
+    # only AUTORANGE_MEMORY_SIZE of it in memory, the rest in spill file.
+    # range fetched ahead is limited to spill_file_size, the size of the ring buffer file.
+    spill_file_size = max_buffer_size * 2
 
-    def __init__(self, method, url, headers, body, response, wfile):
+    def __init__(self, method, url, headers, body, response, wfile, request_time=None):
         self.method = method
         self.wfile = wfile
         self.url = url
         self.headers = headers
         self.body = body
         self.response = response
+        # time the first response was requested, for rtt of the first chunk.
+        self.request_time = request_time or time.time()
 
         self.keep_running = True
-        self.blocked = False
 
         self.lock = threading.Lock()
+        # notify run when data of wait_begin arrive.
         self.waiter = threading.Condition(self.lock)
+        # notify fetch workers when buffer drained or a chunk done.
+        self.fetch_waiter = threading.Condition(self.lock)
 
         self.data_list = {}
-        # begin => payload
+        # begin => payload, or length of payload in spill file
         self.data_size = 0
+        # size of payload in data_list kept in memory
+        self.memory_size = 0
+        # created when data wait in buffer exceed AUTORANGE_MEMORY_SIZE
+        self.spill_file = None
+
+        # chunks in fetching
+        self.chunks = []
 
         self.req_begin = 0
         self.req_end = 0
         self.wait_begin = 0
 
-    def put_data(self, range_begin, payload):
+    def put_data(self, chunk, begin, payload):
+        # payload of chunk from begin, by the worker of chunk or the hedge of it.
+        # return False if the chunk is done.
         with self.lock:
-            if range_begin < self.wait_begin:
-                raise Exception("range_begin:%d expect:%d" %
-                                (range_begin, self.wait_begin))
+            if not self.keep_running:
+                return False
+
+            if begin + len(payload) > chunk.end + 1:
+                xlog.warn("RangeFetch expect end:%d, get:%d",
+                          chunk.end, begin + len(payload) - 1)
+                payload = payload[:chunk.end + 1 - begin]
+
+            # skip data received already by the other request.
+            skip = chunk.pos - begin
+            if skip < len(payload):
+                if skip > 0:
+                    payload = payload[skip:]
+
+                self.buffer_data(chunk.pos, payload)
+                self.data_size += len(payload)
+                chunk.pos += len(payload)
+
+                if self.wait_begin in self.data_list:
+                    self.waiter.notify()
+
+            if chunk.pos <= chunk.end:
+                return True
+
+            if chunk in self.chunks:
+                self.chunks.remove(chunk)
+                self.fetch_waiter.notify_all()
+            return False
+
+    def buffer_data(self, begin, payload):
+        # data can't be sent now is written to spill file when memory buffer is full.
+        if begin == self.wait_begin or \
+                self.memory_size + len(payload) <= front.config.AUTORANGE_MEMORY_SIZE:
+            if begin != self.wait_begin and isinstance(payload, memoryview):
+                # view of the shared http2 recv buffer pin the whole buffer,
+                # copy it if not sent soon.
+                payload = payload.tobytes()
+            self.data_list[begin] = payload
+            self.memory_size += len(payload)
+            return
 
-            self.data_list[range_begin] = payload
-            self.data_size += len(payload)
+        if not self.spill_file:
+            self.spill_file = RangeSpillFile(self.spill_file_size)
+            xlog.debug("RangeFetch spill to file, buffer:%d %s", self.data_size, self.url)
 
-            if self.wait_begin in self.data_list:
-                self.waiter.notify()
+        self.spill_file.write(begin, payload)
+        self.data_list[begin] = len(payload)
+
+    def pop_data(self):
+        data = self.data_list.pop(self.wait_begin)
+        if isinstance(data, int):
+            data = self.spill_file.read(self.wait_begin, data)
+        else:
+            self.memory_size -= len(data)
+
+        self.wait_begin += len(data)
+        self.data_size -= len(data)
+        return data
 
     def run(self):
         req_range_begin = None
@@ -804,11 +1141,15 @@ class RangeFetch2(object):
         fetch_times = int(
             (data_left_to_fetch + front.config.AUTORANGE_MAXSIZE - 1) / front.config.AUTORANGE_MAXSIZE)
         thread_num = min(front.config.AUTORANGE_THREADS, fetch_times)
-        for i in xrange(0, thread_num):
+        # worker of the first response is one of the workers when it's done.
+        for i in xrange(1, thread_num):
             threading.Thread(target=self.fetch_worker).start()
 
-        threading.Thread(target=self.fetch, args=(
-            res_begin, res_end, self.response)).start()
+        first_chunk = RangeChunk(res_begin, res_end)
+        first_chunk.request_time = self.request_time
+        self.chunks.append(first_chunk)
+        threading.Thread(target=self.fetch_worker, args=(
+            first_chunk, self.response)).start()
 
         while self.keep_running and self.wait_begin < self.req_end + 1:
             with self.lock:
@@ -819,10 +1160,9 @@ class RangeFetch2(object):
                     xlog.error("get notify but no data")
                     continue
                 else:
-                    data = self.data_list[self.wait_begin]
-                    del self.data_list[self.wait_begin]
-                    self.wait_begin += len(data)
-                    self.data_size -= len(data)
+                    data = self.pop_data()
+                    # buffer window moved.
+                    self.fetch_waiter.notify_all()
 
             try:
                 ret = self.wfile._sock.sendall(data)
@@ -835,47 +1175,140 @@ class RangeFetch2(object):
             except Exception as e:
                 xlog.info('RangeFetch client closed(%s). %s', e, self.url)
                 break
-        self.keep_running = False
+        self.close()
 
-    def fetch_worker(self):
-        self.blocked = False
+    def fetch_worker(self, chunk=None, response=None):
+        stat = RangeFetchStat()
         while self.keep_running:
-            if self.data_size > self.max_buffer_size:
-                if not self.blocked:
+            if not chunk:
+                chunk = self.get_chunk(stat)
+                if not chunk:
+                    break
+
+            # next chunk is returned if requested before this one done.
+            chunk = self.fetch(chunk, stat, response)
+            response = None
+
+    def get_chunk(self, stat, block=True):
+        # new range sized by the worker speed,
+        # or the slowest chunk in fetching if all range requested.
+        with self.lock:
+            while self.keep_running:
+                left = self.req_end - self.req_begin + 1
+                if left <= 0 and not self.chunks:
+                    return None
+
+                if left > 0:
+                    size = min(self.get_chunk_size(stat, left), left)
+                    # range from wait_begin to the chunk end must fit in the spill file.
+                    if self.data_size <= self.max_buffer_size and \
+                            self.req_begin + size - self.wait_begin <= self.spill_file_size:
+                        chunk = RangeChunk(self.req_begin, self.req_begin + size - 1)
+                        self.req_begin += size
+                        self.chunks.append(chunk)
+                        return chunk
+
+                    if not block:
+                        return None
+
+                    # buffer is full and waiting for the first chunk, request it again if slow.
+                    if self.chunks:
+                        chunk = self.get_hedge_chunk(stat, [min(self.chunks, key=lambda c: c.begin)])
+                        if chunk:
+                            return chunk
+
                     xlog.debug("fetch_worker blocked, buffer:%d %s",
                                self.data_size, self.url)
-                self.blocked = True
-                time.sleep(0.5)
+                    self.fetch_waiter.wait(0.2)
+                    continue
+
+                if not block:
+                    return None
+
+                chunk = self.get_hedge_chunk(stat, self.chunks)
+                if chunk:
+                    return chunk
+
+                # wake up to check the slowest again, or exit when all chunks done.
+                self.fetch_waiter.wait(1)
+
+    def get_chunk_size(self, stat, left):
+        size = front.config.AUTORANGE_MAXSIZE
+        if stat.speed:
+            size = min(size, int(stat.speed * front.config.AUTORANGE_CHUNK_TIME))
+
+        # spread the tail on all workers.
+        size = min(size, left // front.config.AUTORANGE_THREADS)
+        return max(size, front.config.AUTORANGE_MINSIZE)
+
+    def get_hedge_chunk(self, stat, chunks):
+        # the slowest of chunks, if this worker is expected to get it faster.
+        time_now = time.time()
+        slowest = None
+        slowest_time = front.config.AUTORANGE_HEDGE_TIME
+        for chunk in chunks:
+            if chunk.hedged:
                 continue
 
-            self.blocked = False
+            left_time = chunk.left_time(time_now)
+            if stat.speed and left_time < stat.rtt + (chunk.end - chunk.pos + 1) / stat.speed:
+                continue
 
-            with self.lock:
-                if self.req_begin >= self.req_end + 1:
-                    break
+            if left_time > slowest_time:
+                slowest = chunk
+                slowest_time = left_time
+
+        if slowest:
+            slowest.hedged = True
+            xlog.debug("RangeFetch hedge %d-%d pos:%d left time:%d %s",
+                       slowest.begin, slowest.end, slowest.pos, slowest_time, self.url)
+        return slowest
 
-                begin = self.req_begin
-                end = min(begin + front.config.AUTORANGE_MAXSIZE - 1, self.req_end)
-                self.req_begin = end + 1
+    def request_chunk(self, chunk, headers):
+        try:
+            chunk.response = request_gae_proxy(
+                self.method, self.url, headers, self.body)
+        except GAE_Exception as e:
+            xlog.warning('RangeFetch %s request fail:%r',
+                         headers['Range'], e)
+        finally:
+            chunk.requested.set()
 
-            self.fetch(begin, end, None)
+    def prefetch(self, chunk):
+        # send request of next chunk before current done, keep worker pipelined.
+        headers = dict((k.title(), v) for k, v in self.headers.items())
+        headers['Range'] = 'bytes=%d-%d' % (chunk.pos, chunk.end)
+        chunk.request_time = time.time()
+        chunk.requested = threading.Event()
+        threading.Thread(target=self.request_chunk, args=(chunk, headers)).start()
 
-    def fetch(self, begin, end, first_response):
+    def fetch(self, chunk, stat, first_response=None):
+        # fetch chunk, return next chunk of the worker if requested in advance.
         headers = dict((k.title(), v) for k, v in self.headers.items())
+        next_chunk = None
+        response = first_response
+        # first chunk carry the request time of first_response.
+        request_time = chunk.request_time or time.time()
+        if chunk.requested:
+            # requested in advance by prefetch.
+            chunk.requested.wait()
+            with self.lock:
+                response, chunk.response = chunk.response, None
+            request_time = chunk.request_time
+
         retry_num = 0
-        while self.keep_running:
+        while self.keep_running and chunk.pos <= chunk.end:
             retry_num += 1
             if retry_num > 20:
                 xlog.warn("RangeFetch try max times, exit. %s", self.url)
                 self.close()
                 break
 
-            expect_len = end - begin + 1
-            headers['Range'] = 'bytes=%d-%d' % (begin, end)
+            begin = chunk.pos
+            headers['Range'] = 'bytes=%d-%d' % (begin, chunk.end)
 
-            if first_response:
-                response = first_response
-            else:
+            if not response:
+                request_time = time.time()
                 try:
                     response = request_gae_proxy(
                         self.method, self.url, headers, self.body)
@@ -887,6 +1320,7 @@ class RangeFetch2(object):
             if response.app_msg:
                 response.worker.close(
                     "range get gae status:%d" % response.app_status)
+                response = None
                 continue
 
             response.status = response.app_status
@@ -895,23 +1329,28 @@ class RangeFetch2(object):
                     self.url, response.headers.get('Location'))
                 xlog.warn('RangeFetch Redirect(%r) status:%s',
                           self.url, response.status)
+                response = None
                 continue
 
             if response.status >= 300:
                 #xlog.error('RangeFetch %r return %s :%s', self.url, response.status, cgi.escape(response.body))
                 response.worker.close("range status:%s" % response.status)
+                response = None
                 continue
 
             content_range = response.headers.get('Content-Range', "")
             if not content_range:
                 xlog.warning('RangeFetch "%s %s" return headers=%r, retry %s-%s',
-                             self.method, self.url, response.headers, begin, end)
+                             self.method, self.url, response.headers, begin, chunk.end)
                 # if len(response.body) < 2048:
                 #xlog.warn('body:%s', cgi.escape(response.body))
                 # response.worker.close("no range")
+                response = None
                 continue
 
             content_length = int(response.headers.get('Content-Length', 0))
+            head_time = time.time()
+            stat.rtt = head_time - request_time
 
             data_readed = 0
             while True:
@@ -929,25 +1368,37 @@ class RangeFetch2(object):
                               response.ssl_sock.ip, begin, self.url)
                     break
 
-                data_len = len(data)
-                data_readed += data_len
-                if data_len > expect_len:
-                    xlog.warn("RangeFetch expect:%d, get:%d",
-                              expect_len, data_len)
-                    data = data[:expect_len]
-                    data_len = expect_len
+                data_readed += len(data)
+                if not self.put_data(chunk, begin, data):
+                    # done, maybe by the hedge request.
+                    break
+                begin += len(data)
 
-                self.put_data(begin, data)
+                if not next_chunk and stat.speed and \
+                        (chunk.end + 1 - begin) < stat.speed * stat.rtt:
+                    # left data arrive in less than a request round trip.
+                    next_chunk = self.get_chunk(stat, block=False)
+                    if next_chunk:
+                        self.prefetch(next_chunk)
 
-                expect_len -= data_len
-                begin += data_len
+            if data_readed:
+                stat.speed = data_readed / max(time.time() - head_time, 0.01)
+            response = None
 
-            if begin >= end + 1:
+            if chunk.pos > chunk.end:
                 break
 
-            xlog.warn("RangeFetch get left, begin:%d end:%d", begin, end)
+            xlog.warn("RangeFetch get left, begin:%d end:%d", chunk.pos, chunk.end)
+
+        return next_chunk
 
     def close(self):
         self.keep_running = False
         with self.lock:
             self.waiter.notify()
+            self.fetch_waiter.notify_all()
+
+            if self.spill_file:
+                self.spill_file.close()
+                self.spill_file = None
+            self.data_list = {}
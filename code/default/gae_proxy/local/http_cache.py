@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Local HTTP cache of GAE proxy, for GET responses like static resources.
+
+Entry is a file in cache dir, named by sha1 of the url:
+  first line: json of url, vary, status, reason, headers, time
+  then body
+Index of entries is kept in memory in LRU order,
+loaded from the first line of the files when used first time.
+
+Fresh entry is sent without request, from Cache-Control max-age, Expires,
+or 10% of the time since Last-Modified.
+Stale entry with ETag or Last-Modified is revalidated by conditional request,
+304 response refresh the entry and send it.
+"""
+
+import os
+import time
+import json
+import hashlib
+import threading
+import collections
+from email.utils import parsedate_tz, mktime_tz
+
+from utils import replace_file
+
+
+# response headers not stored, or set on send.
+skip_headers = frozenset(['Connection', 'Persist', 'Keep-Alive', 'Proxy-Connection',
+                          'Transfer-Encoding', 'Age', 'Content-Length'])
+# response headers of 304 to refresh the entry.
+refresh_headers = frozenset(['Cache-Control', 'Expires', 'Date', 'Etag', 'Last-Modified', 'Vary'])
+
+# heuristic freshness is at most one day.
+max_heuristic_time = 24 * 3600
+
+
+def parse_cache_control(value):
+    directives = {}
+    for item in value.split(","):
+        item = item.strip().lower()
+        if not item:
+            continue
+        if "=" in item:
+            name, arg = item.split("=", 1)
+            directives[name.strip()] = arg.strip().strip('"')
+        else:
+            directives[item] = None
+    return directives
+
+
+def parse_http_date(value):
+    try:
+        return mktime_tz(parsedate_tz(value))
+    except Exception:
+        return None
+
+
+def get_header(headers, name):
+    # headers of request are not title case.
+    name = name.lower()
+    for key, value in headers.items():
+        if key.lower() == name:
+            return value
+    return None
+
+
+def to_str(value):
+    # json load text as unicode.
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+    elif isinstance(value, dict):
+        return dict((to_str(k), to_str(v)) for k, v in value.items())
+    return value
+
+
+class CacheEntry(object):
+    def __init__(self, url, vary, status, reason, headers, stored_time, file_name, header_len, size):
+        self.url = url
+        # request header values of the Vary fields.
+        self.vary = vary
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.stored_time = stored_time
+        self.file_name = file_name
+        self.header_len = header_len
+        # body size
+        self.size = size
+
+    @property
+    def file_size(self):
+        return self.header_len + self.size
+
+    def match_vary(self, request_headers):
+        for name, value in self.vary.items():
+            if get_header(request_headers, name) != value:
+                return False
+        return True
+
+    def freshness_lifetime(self):
+        cc = parse_cache_control(self.headers.get("Cache-Control", ""))
+        if "no-cache" in cc:
+            return 0
+
+        if "max-age" in cc:
+            try:
+                return int(cc["max-age"])
+            except ValueError:
+                return 0
+
+        date = parse_http_date(self.headers.get("Date", "")) or self.stored_time
+        expires = self.headers.get("Expires")
+        if expires:
+            expires = parse_http_date(expires)
+            if expires is None:
+                return 0
+            return expires - date
+
+        last_modified = parse_http_date(self.headers.get("Last-Modified", ""))
+        if last_modified and last_modified < date:
+            return min((date - last_modified) / 10, max_heuristic_time)
+
+        return 0
+
+    def age(self):
+        try:
+            initial_age = int(self.headers.get("Age", 0))
+        except ValueError:
+            initial_age = 0
+        date = parse_http_date(self.headers.get("Date", ""))
+        if date:
+            # time passed before stored
+            initial_age = max(initial_age, self.stored_time - date)
+        return initial_age + max(0, time.time() - self.stored_time)
+
+    def is_fresh(self, request_headers):
+        cc = parse_cache_control(get_header(request_headers, "Cache-Control") or "")
+        if "no-cache" in cc or (get_header(request_headers, "Pragma") or "").lower() == "no-cache":
+            return False
+
+        if "max-age" in cc:
+            try:
+                if self.age() > int(cc["max-age"]):
+                    return False
+            except ValueError:
+                pass
+
+        return self.freshness_lifetime() > self.age()
+
+    def conditional_headers(self):
+        headers = {}
+        if "Etag" in self.headers:
+            headers["If-None-Match"] = self.headers["Etag"]
+        if "Last-Modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["Last-Modified"]
+        return headers
+
+    def not_modified(self, request_headers):
+        # conditional request of browser match the entry.
+        etag = self.headers.get("Etag")
+        if_none_match = get_header(request_headers, "If-None-Match")
+        if if_none_match:
+            return bool(etag) and (if_none_match.strip() == "*" or
+                                   etag in [t.strip() for t in if_none_match.split(",")])
+
+        if_modified_since = get_header(request_headers, "If-Modified-Since")
+        last_modified = self.headers.get("Last-Modified")
+        if if_modified_since and last_modified:
+            since = parse_http_date(if_modified_since)
+            modified = parse_http_date(last_modified)
+            return since is not None and modified is not None and modified <= since
+        return False
+
+
+class CacheWriter(object):
+    # write response to a temp file while it's sent to browser.
+    def __init__(self, cache, entry, tmp_path, fd):
+        self.cache = cache
+        self.entry = entry
+        self.tmp_path = tmp_path
+        self.fd = fd
+        self.body_len = 0
+
+    def write(self, data):
+        if not self.fd:
+            return
+
+        try:
+            self.fd.write(data)
+            self.body_len += len(data)
+        except Exception as e:
+            self.cache.logger.warn("http cache write %s fail:%r", self.entry.url, e)
+            self.abort()
+
+    def finish(self):
+        if not self.fd:
+            return
+
+        if self.body_len != self.entry.size:
+            self.abort()
+            return
+
+        try:
+            self.fd.close()
+            self.fd = None
+            self.cache.add(self.entry, self.tmp_path)
+        except Exception as e:
+            self.cache.logger.warn("http cache save %s fail:%r", self.entry.url, e)
+            self.abort()
+
+    def abort(self):
+        if self.fd:
+            self.fd.close()
+            self.fd = None
+        try:
+            os.remove(self.tmp_path)
+        except Exception:
+            pass
+
+
+class HttpCache(object):
+    def __init__(self, logger, config, cache_dir):
+        self.logger = logger
+        self.config = config
+        self.cache_dir = cache_dir
+
+        self.lock = threading.Lock()
+        # key => CacheEntry, least recently used first.
+        self.entries = collections.OrderedDict()
+        self.total_size = 0
+        self.loaded = False
+
+        self.lookup_num = 0
+        self.hit_num = 0
+        self.revalidated_num = 0
+        self.stored_num = 0
+        self.bytes_saved = 0
+
+    @property
+    def enable(self):
+        return self.config.http_cache_enable
+
+    def load(self):
+        # call with lock
+        self.loaded = True
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+            return
+
+        entries = []
+        for file_name in os.listdir(self.cache_dir):
+            file_path = os.path.join(self.cache_dir, file_name)
+            if file_name.endswith(".tmp"):
+                self.remove_file(file_path)
+                continue
+
+            try:
+                with open(file_path, "rb") as fd:
+                    line = fd.readline()
+                info = to_str(json.loads(line))
+                size = os.path.getsize(file_path) - len(line)
+                entry = CacheEntry(info["url"], info["vary"], info["status"], info["reason"],
+                                   info["headers"], info["time"], file_name, len(line), size)
+                entries.append((os.path.getmtime(file_path), entry))
+            except Exception as e:
+                self.logger.warn("http cache load %s fail:%r", file_name, e)
+                self.remove_file(file_path)
+
+        for _, entry in sorted(entries, key=lambda x: x[0]):
+            self.entries[entry.url] = entry
+            self.total_size += entry.file_size
+
+        self.logger.info("http cache loaded %d entries, size:%d", len(self.entries), self.total_size)
+        self.evict()
+
+    def remove_file(self, file_path):
+        try:
+            os.remove(file_path)
+        except Exception as e:
+            self.logger.warn("http cache remove %s fail:%r", file_path, e)
+
+    def evict(self):
+        # call with lock
+        while self.total_size > self.config.http_cache_max_size and self.entries:
+            _, entry = self.entries.popitem(last=False)
+            self.total_size -= entry.file_size
+            self.remove_file(os.path.join(self.cache_dir, entry.file_name))
+
+    def is_cacheable_request(self, method, headers):
+        if not self.enable or method != "GET":
+            return False
+
+        if get_header(headers, "Range") or get_header(headers, "Authorization"):
+            return False
+
+        cc = parse_cache_control(get_header(headers, "Cache-Control") or "")
+        return "no-store" not in cc
+
+    def get(self, url, request_headers):
+        with self.lock:
+            if not self.loaded:
+                self.load()
+
+            self.lookup_num += 1
+            entry = self.entries.get(url)
+            if not entry or not entry.match_vary(request_headers):
+                return None
+
+            # most recently used
+            del self.entries[url]
+            self.entries[url] = entry
+            return entry
+
+    def create_writer(self, url, request_headers, status, reason, response_headers, body_length):
+        # return CacheWriter if the response can be stored.
+        if status != 200 or body_length > self.config.http_cache_max_entry_size:
+            return None
+
+        cc = parse_cache_control(response_headers.get("Cache-Control", ""))
+        if "no-store" in cc or "private" in cc or "Set-Cookie" in response_headers:
+            return None
+
+        # cache is shared by all clients, page for the cookie of one is not for others.
+        if get_header(request_headers, "Cookie") and "public" not in cc:
+            return None
+
+        vary_names = [v.strip() for v in response_headers.get("Vary", "").split(",") if v.strip()]
+        if "*" in vary_names:
+            return None
+        vary = dict((name, get_header(request_headers, name)) for name in vary_names)
+
+        headers = dict((k, v) for k, v in response_headers.items() if k not in skip_headers)
+        entry = CacheEntry(url, vary, status, reason, headers, time.time(),
+                           hashlib.sha1(url).hexdigest(), 0, body_length)
+        if not entry.conditional_headers() and (not entry.freshness_lifetime() or "no-cache" in cc):
+            # no-cache need revalidate on every use.
+            return None
+
+        try:
+            line = json.dumps({"url": url, "vary": vary, "status": status, "reason": reason,
+                               "headers": headers, "time": entry.stored_time}) + "\n"
+        except Exception:
+            # header not utf-8
+            return None
+        entry.header_len = len(line)
+
+        with self.lock:
+            if not self.loaded:
+                self.load()
+
+        tmp_path = os.path.join(self.cache_dir, "%s.%d.tmp" % (entry.file_name, threading.current_thread().ident))
+        try:
+            fd = open(tmp_path, "wb")
+            fd.write(line)
+        except Exception as e:
+            self.logger.warn("http cache create %s fail:%r", url, e)
+            return None
+
+        return CacheWriter(self, entry, tmp_path, fd)
+
+    def add(self, entry, tmp_path):
+        file_path = os.path.join(self.cache_dir, entry.file_name)
+        with self.lock:
+            # old entry is kept if replace fail.
+            replace_file(tmp_path, file_path)
+            old_entry = self.entries.pop(entry.url, None)
+            if old_entry:
+                self.total_size -= old_entry.file_size
+
+            self.entries[entry.url] = entry
+            self.total_size += entry.file_size
+            self.stored_num += 1
+            self.evict()
+
+    def refresh(self, entry, response_headers):
+        # revalidated by 304, update headers and time in index.
+        # file keep the old headers, refreshed again after restart.
+        with self.lock:
+            self.revalidated_num += 1
+            entry.headers.pop("Date", None)
+            entry.headers.pop("Age", None)
+            for key, value in response_headers.items():
+                key = key.title()
+                if key in refresh_headers:
+                    entry.headers[key] = value
+            entry.stored_time = time.time()
+
+    def send_entry(self, wfile, entry, request_headers, revalidated=False):
+        # return False if entry file is gone, the request should go to GAE.
+        if entry.not_modified(request_headers):
+            status, reason, body_len = 304, "Not Modified", 0
+        else:
+            status, reason, body_len = entry.status, entry.reason, entry.size
+
+        try:
+            fd = open(os.path.join(self.cache_dir, entry.file_name), "rb")
+        except IOError:
+            with self.lock:
+                if self.entries.get(entry.url) is entry:
+                    del self.entries[entry.url]
+                    self.total_size -= entry.file_size
+            return False
+
+        with self.lock:
+            if not revalidated:
+                self.hit_num += 1
+            self.bytes_saved += body_len
+
+        with fd:
+            wfile.write("HTTP/1.1 %d %s\r\n" % (status, reason))
+            for key, value in entry.headers.items():
+                wfile.write("%s: %s\r\n" % (key, value))
+            wfile.write("Age: %d\r\n" % entry.age())
+            if status == 200:
+                wfile.write("Content-Length: %d\r\n" % body_len)
+            wfile.write("Persist: \r\nConnection: Persist\r\n\r\n")
+            wfile.flush()
+
+            fd.seek(entry.header_len)
+            while body_len:
+                data = fd.read(min(body_len, 65536))
+                if not data:
+                    break
+                wfile._sock.sendall(data)
+                body_len -= len(data)
+        return True
+
+    def get_stat(self):
+        with self.lock:
+            if self.lookup_num:
+                hit_ratio = (self.hit_num + self.revalidated_num) * 100 / self.lookup_num
+            else:
+                hit_ratio = 0
+            return {
+                "enable": self.enable,
+                "entries": len(self.entries),
+                "size": self.total_size,
+                "lookup": self.lookup_num,
+                "hit": self.hit_num,
+                "revalidated": self.revalidated_num,
+                "hit_ratio": hit_ratio,
+                "bytes_saved": self.bytes_saved
+            }
@@ -169,14 +169,14 @@ class GAEProxyHandler(simple_http_server.HttpServerHandler):
             xlog.warn("CONNECT %s port:%d not support", host, port)
             return
 
-        certfile = CertUtil.get_cert(host)
+        context = CertUtil.get_context(host)
         self.wfile.write(b'HTTP/1.1 200 OK\r\n\r\n')
 
         try:
-            ssl_sock = ssl.wrap_socket(self.connection, keyfile=CertUtil.cert_keyfile, certfile=certfile, server_side=True)
+            ssl_sock = context.wrap_socket(self.connection, server_side=True)
         except ssl.SSLError as e:
             xlog.info('ssl error: %s, create full domain cert for host:%s', e, host)
-            certfile = CertUtil.get_cert(host, full_name=True)
+            CertUtil.get_context(host, full_name=True)
             return
         except Exception as e:
             if e.args[0] not in (errno.ECONNABORTED, errno.ECONNRESET):
@@ -326,8 +326,7 @@ class GAEProxyHandler(simple_http_server.HttpServerHandler):
 
 # called by smart_router
 def wrap_ssl(sock, host, port, client_address):
-    certfile = CertUtil.get_cert(host or 'www.google.com')
-    ssl_sock = ssl.wrap_socket(sock, keyfile=CertUtil.cert_keyfile,
-                               certfile=certfile, server_side=True)
+    context = CertUtil.get_context(host or 'www.google.com')
+    ssl_sock = context.wrap_socket(sock, server_side=True)
     return ssl_sock
 
@@ -0,0 +1,170 @@
+#!/usr/bin/env python2
+# coding:utf-8
+
+# benchmark RangeFetch2 with a local range server in place of GAE:
+# per request rtt, per stream bandwidth, some slow streams, shared link.
+
+import os
+import sys
+import re
+import time
+import random
+import threading
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.abspath(os.path.join(current_path, os.pardir, os.pardir))
+python_path = os.path.abspath(os.path.join(root_path, 'python27', '1.0'))
+
+sys.path.append(root_path)
+
+noarch_lib = os.path.abspath(os.path.join(python_path, 'lib', 'noarch'))
+sys.path.append(noarch_lib)
+
+if sys.platform == "win32":
+    win32_lib = os.path.abspath(os.path.join(python_path, 'lib', 'win32'))
+    sys.path.append(win32_lib)
+elif sys.platform.startswith("linux"):
+    linux_lib = os.path.abspath(os.path.join(python_path, 'lib', 'linux'))
+    sys.path.append(linux_lib)
+elif sys.platform == "darwin":
+    darwin_lib = os.path.abspath(os.path.join(python_path, 'lib', 'darwin'))
+    sys.path.append(darwin_lib)
+    extra_lib = "/System/Library/Frameworks/Python.framework/Versions/2.7/Extras/lib/python"
+    sys.path.append(extra_lib)
+
+
+from front import front
+import gae_handler
+from xlog import getLogger
+xlog = getLogger("gae_proxy")
+
+
+rtt = 0.25
+stream_speed = 2 * 1024 * 1024
+slow_stream_speed = 300 * 1024
+slow_stream_rate = 0.15
+link_speed = 40 * 1024 * 1024
+file_size = 100 * 1024 * 1024
+
+
+class Link(object):
+    # bandwidth shared by all streams.
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.next_free = time.time()
+
+    def take(self, size):
+        with self.lock:
+            t = max(self.next_free, time.time()) + float(size) / link_speed
+            self.next_free = t
+        wait = t - time.time()
+        if wait > 0:
+            time.sleep(wait)
+
+
+class Task(object):
+    def __init__(self, size, speed, link):
+        self.left = size
+        self.speed = speed
+        self.link = link
+
+    def read(self):
+        if not self.left:
+            return memoryview(b'')
+        size = min(self.left, 65536)
+        time.sleep(float(size) / self.speed)
+        self.link.take(size)
+        self.left -= size
+        return memoryview(b'x' * size)
+
+    def get_trace(self):
+        return ""
+
+
+class Worker(object):
+    def close(self, reason=""):
+        pass
+
+
+class SslSock(object):
+    ip = "127.0.0.1"
+
+
+class Response(object):
+    def __init__(self, begin, end, speed, link):
+        self.app_msg = ""
+        self.app_status = 206
+        self.status = 206
+        self.headers = {
+            "Content-Range": "bytes %d-%d/%d" % (begin, end, file_size),
+            "Content-Length": str(end - begin + 1)
+        }
+        self.task = Task(end - begin + 1, speed, link)
+        self.worker = Worker()
+        self.ssl_sock = SslSock()
+
+
+class RangeServer(object):
+    def __init__(self):
+        self.link = Link()
+        self.lock = threading.Lock()
+        self.random = random.Random(1)
+        self.request_num = 0
+
+    def request(self, method, url, headers, body, timeout=None):
+        begin, end = re.search(r'bytes=(\d*)-(\d*)', headers['Range']).group(1, 2)
+        begin = int(begin)
+        end = min(int(end), begin + front.config.AUTORANGE_MAXSIZE - 1, file_size - 1)
+        with self.lock:
+            self.request_num += 1
+            slow = self.random.random() < slow_stream_rate
+        time.sleep(rtt)
+        return Response(begin, end, slow_stream_speed if slow else stream_speed, self.link)
+
+
+class Sock(object):
+    def __init__(self):
+        self.size = 0
+
+    def sendall(self, data):
+        self.size += len(data)
+
+
+class WFile(object):
+    def __init__(self):
+        self._sock = Sock()
+
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+def test():
+    server = RangeServer()
+    gae_handler.request_gae_proxy = server.request
+
+    wfile = WFile()
+    start_time = time.time()
+    headers = {"Range": "bytes=0-%d" % (front.config.AUTORANGE_MAXSIZE - 1)}
+    response = server.request("GET", "http://127.0.0.1/file", headers, "")
+    gae_handler.RangeFetch2("GET", "http://127.0.0.1/file", {}, "",
+                            response, wfile, start_time).run()
+    time_cost = time.time() - start_time
+
+    xlog.info("RangeFetch size:%d cost:%f speed:%dKB/s requests:%d",
+              wfile._sock.size, time_cost, wfile._sock.size / time_cost / 1024, server.request_num)
+    if wfile._sock.size != file_size:
+        xlog.error("RangeFetch size:%d expect:%d", wfile._sock.size, file_size)
+
+
+if __name__ == '__main__':
+    import traceback
+
+    try:
+        test()
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    except KeyboardInterrupt:
+        sys.exit()
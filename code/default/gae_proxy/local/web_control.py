@@ -358,6 +358,7 @@ class ControlHandler(simple_http_server.HttpServerHandler):
             "is_idle": int(front.http_dispatcher.is_idle()),
             "scan_ip_thread_num": front.ip_manager.scan_thread_count,
             "ip_quality": front.ip_manager.ip_quality(),
+            "http_cache": front.http_cache.get_stat(),
 
             "fake_host": get_fake_host()
         }
@@ -520,7 +521,9 @@ class ControlHandler(simple_http_server.HttpServerHandler):
     def req_ip_list_handler(self):
         time_now = time.time()
         data = "<html><body><div  style='float: left; white-space:nowrap;font-family: monospace;'>"
-        data += "time:%d  pointer:%d<br>\r\n" % (time_now, front.ip_manager.ip_pointer)
+        data += "time:%d  ready:%d<br>\r\n" % (time_now, front.ip_manager.ip_index.ready_num())
+        data += "handshake %s<br>\r\n" % front.connect_creator.get_handshake_stat()
+        data += "cert_cache %s<br>\r\n" % front.connect_creator.cert_cache.get_stat()
         data += "<table><tr><th>N</th><th>IP</th><th>HS</th><th>Fails</th>"
         data += "<th>down_fail</th><th>links</th>"
         data += "<th>get_time</th><th>success_time</th><th>fail_time</th><th>down_fail_time</th>"
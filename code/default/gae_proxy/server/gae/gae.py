@@ -83,31 +83,85 @@ try:
 except ImportError:
     logging.warn('Load Crypto.Cipher.ARC4 Failed, Use Pure Python Instead.')
 
+    import threading
+    from binascii import hexlify, unhexlify
+
     class RC4Cipher(object):
+        # Keystream is generated in blocks, the first 1MB of the password's
+        # keystream is shared by all requests, xor is done on long integer.
+        block_size = 65536
+        shared_size = 16 * block_size
+        shared_streams = {}
+        lock = threading.Lock()
+
         def __init__(self, key):
+            self.__key = key
+            self.__pos = 0
+            self.__state = None
+
+        @staticmethod
+        def _init_state(key):
             x = 0
             box = range(256)
             for i, y in enumerate(box):
                 x = (x + y + ord(key[i % len(key)])) & 0xff
                 box[i], box[x] = box[x], y
-            self.__box = box
-            self.__x = 0
-            self.__y = 0
+            return [box, 0, 0]
 
-        def encrypt(self, data):
-            out = []
-            out_append = out.append
-            x = self.__x
-            y = self.__y
-            box = self.__box
-            for char in data:
+        @staticmethod
+        def _generate(state, size):
+            box, x, y = state
+            out = bytearray(size)
+            for i in xrange(size):
                 x = (x + 1) & 0xff
-                y = (y + box[x]) & 0xff
-                box[x], box[y] = box[y], box[x]
-                out_append(chr(ord(char) ^ box[(box[x] + box[y]) & 0xff]))
-            self.__x = x
-            self.__y = y
-            return ''.join(out)
+                a = box[x]
+                y = (y + a) & 0xff
+                b = box[y]
+                box[x] = b
+                box[y] = a
+                out[i] = box[(a + b) & 0xff]
+            state[1] = x
+            state[2] = y
+            return bytes(out)
+
+        def _shared_stream(self, end):
+            cls = RC4Cipher
+            end = min(end, cls.shared_size)
+            stream = cls.shared_streams.get(self.__key)
+            if stream and len(stream[1]) >= end:
+                return stream
+            with cls.lock:
+                stream = cls.shared_streams.get(self.__key)
+                if stream is None:
+                    stream = (self._init_state(self.__key), '')
+                state, data = stream
+                blocks = [data]
+                while len(data) < end:
+                    blocks.append(self._generate(state, cls.block_size))
+                    data = ''.join(blocks)
+                    blocks = [data]
+                stream = cls.shared_streams[self.__key] = (state, data)
+                return stream
+
+        def encrypt(self, data):
+            start = self.__pos
+            end = self.__pos = start + len(data)
+            if not data:
+                return ''
+
+            shared_size = RC4Cipher.shared_size
+            keystream = ''
+            if start < shared_size:
+                keystream = self._shared_stream(end)[1][start:end]
+            if end > shared_size:
+                if self.__state is None:
+                    state = self._shared_stream(shared_size)[0]
+                    with RC4Cipher.lock:
+                        self.__state = [list(state[0]), state[1], state[2]]
+                keystream += self._generate(self.__state, end - max(start, shared_size))
+
+            r = int(hexlify(data), 16) ^ int(hexlify(keystream), 16)
+            return unhexlify('%0*x' % (len(data) * 2, r))
 
 
 def inflate(data):
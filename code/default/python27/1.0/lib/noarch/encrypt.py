@@ -26,6 +26,7 @@ from __future__ import absolute_import, division, print_function, \
 import os
 import sys
 import hashlib
+import threading
 import logging as xlog
 
 
@@ -165,31 +166,113 @@ def encrypt_all(password, method, op, data):
     return b''.join(result)
 
 
+class MessageCipher(object):
+    # Encrypt/decrypt independent messages, each message is iv + data,
+    # same as the output of a new Encryptor for every message.
+    # Key is derived once, ctypes_openssl contexts are kept per thread
+    # and restarted with the iv of the message instead of created again.
+    def __init__(self, password, method):
+        method = method.lower()
+        m = method_supported.get(method)
+        if not m:
+            raise ValueError('method %s not supported' % method)
+
+        self.password = password
+        if hasattr(password, 'encode'):
+            password = password.encode('utf-8')
+        self.method = method
+        self.key_len, self.iv_len, self.create_cipher = m
+        if self.key_len > 0:
+            self.key, _ = EVP_BytesToKey(password, self.key_len, self.iv_len)
+        else:
+            # key_length == 0 indicates we should use the key directly
+            self.key, self.iv_len = password, 0
+
+        self.reuse_cipher = self.create_cipher is ctypes_openssl.CtypesCrypto
+        self.local = threading.local()
+
+    def get_cipher(self, op, iv):
+        if not self.reuse_cipher:
+            return self.create_cipher(self.method, self.key, iv, op)
+
+        name = "cipher_%d" % op
+        cipher = getattr(self.local, name, None)
+        if cipher is None:
+            cipher = self.create_cipher(self.method, self.key, iv, op)
+            setattr(self.local, name, cipher)
+        else:
+            cipher.reset(iv)
+        return cipher
+
+    def encrypt(self, data):
+        if len(data) == 0:
+            return data
+
+        iv = random_string(self.iv_len)
+        cipher = self.get_cipher(1, iv)
+        if not self.reuse_cipher and isinstance(data, memoryview):
+            data = data.tobytes()
+        return iv + cipher.update(data)
+
+    def encrypt_buffers(self, buffers):
+        # encrypt list of str/bytearray/memoryview as one message, return bytearray of iv + cipher text.
+        # pieces are gathered after the iv and encrypted in place by one update,
+        # a call per piece cost more than the copy for small pieces.
+        data_len = sum(len(buf) for buf in buffers)
+        if data_len == 0:
+            return bytearray()
+
+        iv = random_string(self.iv_len)
+        out = bytearray(self.iv_len + data_len)
+        out_view = memoryview(out)
+        out_view[:self.iv_len] = iv
+        pos = self.iv_len
+        for buf in buffers:
+            out_view[pos:pos + len(buf)] = buf
+            pos += len(buf)
+
+        cipher = self.get_cipher(1, iv)
+        data = out_view[self.iv_len:]
+        if self.reuse_cipher:
+            cipher.update_into(data, data)
+        else:
+            data[:] = cipher.update(data.tobytes())
+        return out
+
+    def decrypt(self, data):
+        if len(data) == 0:
+            return data
+
+        iv = data[:self.iv_len]
+        data = data[self.iv_len:]
+        if isinstance(iv, memoryview):
+            iv = iv.tobytes()
+            if not self.reuse_cipher:
+                data = data.tobytes()
+        cipher = self.get_cipher(0, iv)
+        if len(data) == 0:
+            return b''
+        return cipher.update(data)
+
+    def decrypt_into(self, data, out):
+        # decrypt message to writable buffer out, return length of the plain data.
+        iv = data[:self.iv_len]
+        data = data[self.iv_len:]
+        if isinstance(iv, memoryview):
+            iv = iv.tobytes()
+        cipher = self.get_cipher(0, iv)
+        if self.reuse_cipher:
+            return cipher.update_into(data, out)
+
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        plain = cipher.update(data)
+        out[:len(plain)] = plain
+        return len(plain)
+
+
 try:
     from Crypto.Cipher.ARC4 import new as RC4Cipher
 except ImportError:
     xlog.warn('Load Crypto.Cipher.ARC4 Failed, Use Pure Python Instead.')
-    class RC4Cipher(object):
-        def __init__(self, key):
-            x = 0
-            box = range(256)
-            for i, y in enumerate(box):
-                x = (x + y + ord(key[i % len(key)])) & 0xff
-                box[i], box[x] = box[x], y
-            self.__box = box
-            self.__x = 0
-            self.__y = 0
-        def encrypt(self, data):
-            out = []
-            out_append = out.append
-            x = self.__x
-            y = self.__y
-            box = self.__box
-            for char in data:
-                x = (x + 1) & 0xff
-                y = (y + box[x]) & 0xff
-                box[x], box[y] = box[y], box[x]
-                out_append(chr(ord(char) ^ box[(box[x] + box[y]) & 0xff]))
-            self.__x = x
-            self.__y = y
-            return ''.join(out)
\ No newline at end of file
+    from scrypto.py_cipher import RC4Cipher
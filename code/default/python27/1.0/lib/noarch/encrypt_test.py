@@ -0,0 +1,21 @@
+#!/usr/bin/env python2
+# coding:utf-8
+
+# encrypt and decrypt speed of every method in encrypt.method_supported.
+
+import os
+import sys
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_path)
+
+import encrypt
+from scrypto.util import bench_methods, bench_message_cipher
+
+
+if __name__ == '__main__':
+    print("cipher update, encrypt + decrypt:")
+    bench_methods(encrypt.method_supported)
+    print("")
+    print("MessageCipher:")
+    bench_message_cipher(encrypt.MessageCipher, encrypt.method_supported)
@@ -20,6 +20,7 @@ class ConfigBase(xconfig.Config):
         self.set_var("dispather_max_workers", 60)
         self.set_var("dispather_score_factor", 1)
         self.set_var("dispather_max_idle_workers", 30)
+        self.set_var("dispather_thread_num", 4)
 
         self.set_var("max_task_num", 100)
 
@@ -65,6 +66,9 @@ class ConfigBase(xconfig.Config):
         self.set_var("check_commonname", "")
         self.set_var("check_sni", 0) # 0, 1, string
         self.set_var("min_intermediate_CA", 0)
+        self.set_var("ssl_session_cache_size", 1000)
+        self.set_var("ssl_session_timeout", 3600)
+        self.set_var("cert_cache_size", 100)
 
         # ip manager
         self.set_var("check_exist_ip_on_startup", 0)
@@ -1,6 +1,8 @@
 
+import collections
 import socket
 import struct
+import threading
 import time
 
 import OpenSSL
@@ -12,6 +14,69 @@ from subj_alt_name import SubjectAltName
 import openssl_wrap
 
 
+class CertInfo(object):
+    # Values of peer cert chain used by check_cert, parsed once per chain.
+
+    def __init__(self, cert_chain, check_pkp, check_sni):
+        self.domain = openssl_wrap.SSLCert(cert_chain[0]).cn
+        self.issuers = [next((v for k, v in cert.get_issuer().get_components() if k == 'CN'), '')
+                        for cert in cert_chain]
+        self.issuer_commonname = self.issuers[0]
+
+        self.pub_key = None
+        if check_pkp and len(cert_chain) > 1 and hasattr(OpenSSL.crypto, "dump_publickey"):
+            self.pub_key = OpenSSL.crypto.dump_publickey(OpenSSL.crypto.FILETYPE_PEM,
+                                                         cert_chain[1].get_pubkey())
+
+        self.alt_names = None
+        if check_sni:
+            # get_subj_alt_name cost near 100ms. be careful.
+            try:
+                self.alt_names = ConnectCreator.get_subj_alt_name(cert_chain[0])
+            except Exception as e:
+                # self.logger.warn("get_subj_alt_name fail:%r", e)
+                self.alt_names = [""]
+
+
+class CertCache(object):
+    # CertInfo by digest of leaf and intermediate cert.
+    # Front serve the same few certs on many ips.
+
+    def __init__(self, max_size=100):
+        self.max_size = max_size
+        self.lock = threading.Lock()
+        self.infos = collections.OrderedDict()
+        self.hit = 0
+        self.miss = 0
+        # time cost of parse, to estimate time saved by hit.
+        self.parse_time = 0.0
+
+    def get_info(self, cert_chain, check_pkp, check_sni):
+        key = tuple(cert.digest("sha256") for cert in cert_chain[:2]) + (bool(check_pkp), bool(check_sni))
+        with self.lock:
+            info = self.infos.pop(key, None)
+            if info:
+                self.infos[key] = info
+                self.hit += 1
+                return info
+
+        time_begin = time.time()
+        info = CertInfo(cert_chain, check_pkp, check_sni)
+        with self.lock:
+            self.miss += 1
+            self.parse_time += time.time() - time_begin
+            self.infos[key] = info
+            while len(self.infos) > self.max_size:
+                self.infos.popitem(last=False)
+        return info
+
+    def get_stat(self):
+        total = self.hit + self.miss
+        hit_rate = self.hit * 100 / total if total else 0
+        saved_time = self.parse_time / self.miss * self.hit if self.miss else 0
+        return "hit:%d miss:%d rate:%d%% saved:%dms" % (self.hit, self.miss, hit_rate, saved_time * 1000)
+
+
 class ConnectCreator(object):
     def __init__(self, logger, config, openssl_context, host_manager,
                  timeout=5, debug=False,
@@ -29,6 +94,15 @@ class ConnectCreator(object):
         self.connect_force_http1 = self.config.connect_force_http1
         self.connect_force_http2 = self.config.connect_force_http2
 
+        self.session_cache = openssl_wrap.SSLSessionCache(self.config.ssl_session_cache_size,
+                                                          self.config.ssl_session_timeout)
+        self.cert_cache = CertCache(self.config.cert_cache_size)
+        # resumed handshake is faster, count apart from full handshake.
+        self.full_handshake_num = 0
+        self.full_handshake_time = 0
+        self.resumed_handshake_num = 0
+        self.resumed_handshake_time = 0
+
     def update_config(self):
         if int(self.config.PROXY_ENABLE):
 
@@ -117,41 +191,72 @@ class ConnectCreator(object):
             except:
                 pass
 
+        session = None
+        cached = self.session_cache.get(ip, sni)
+        if cached:
+            session, session_domain = cached
+            try:
+                ssl_sock.set_session(session)
+            except Exception as e:
+                self.logger.debug("set_session fail:%r", e)
+                session = None
+
         time_begin = time.time()
         ip_port = (ip, port)
 
         try:
-            ssl_sock.connect(ip_port)
-            time_connected = time.time()
-            ssl_sock.do_handshake()
-        except Exception as e:
-            raise socket.error('conn fail, sni:%s, top:%s e:%r' % (sni, host, e))
-
-        if self.connect_force_http1:
-            ssl_sock.h2 = False
-        elif self.connect_force_http2:
-            ssl_sock.h2 = True
-        else:
             try:
-                h2 = ssl_sock.get_alpn_proto_negotiated()
-                if h2 == "h2":
-                    ssl_sock.h2 = True
-                else:
-                    ssl_sock.h2 = False
+                ssl_sock.connect(ip_port)
+                time_connected = time.time()
+                ssl_sock.do_handshake()
             except Exception as e:
-                # xlog.exception("alpn:%r", e)
-                if hasattr(ssl_sock._connection, "protos") and ssl_sock._connection.protos == "h2":
-                    ssl_sock.h2 = True
-                else:
-                    ssl_sock.h2 = False
+                raise socket.error('conn fail, sni:%s, top:%s e:%r' % (sni, host, e))
 
-        time_handshaked = time.time()
-
-        ssl_sock.sni = sni
-        self.check_cert(ssl_sock)
+            if self.connect_force_http1:
+                ssl_sock.h2 = False
+            elif self.connect_force_http2:
+                ssl_sock.h2 = True
+            else:
+                try:
+                    h2 = ssl_sock.get_alpn_proto_negotiated()
+                    if h2 == "h2":
+                        ssl_sock.h2 = True
+                    else:
+                        ssl_sock.h2 = False
+                except Exception as e:
+                    # xlog.exception("alpn:%r", e)
+                    if hasattr(ssl_sock._connection, "protos") and ssl_sock._connection.protos == "h2":
+                        ssl_sock.h2 = True
+                    else:
+                        ssl_sock.h2 = False
+
+            time_handshaked = time.time()
+
+            ssl_sock.sni = sni
+            ssl_sock.resumed = bool(session) and ssl_sock.session_reused()
+            if ssl_sock.resumed:
+                # cert of the session is checked in the full handshake,
+                # chain may be none in abbreviated handshake of OpenSSL 1.0.x.
+                ssl_sock.domain = session_domain
+            else:
+                self.check_cert(ssl_sock)
+        except Exception:
+            # a bad session make every connection of the ip fail.
+            if session:
+                self.session_cache.remove(ip, sni)
+            raise
 
         connect_time = int((time_connected - time_begin) * 1000)
         handshake_time = int((time_handshaked - time_begin) * 1000)
+
+        if ssl_sock.resumed:
+            self.resumed_handshake_num += 1
+            self.resumed_handshake_time += handshake_time
+        else:
+            self.full_handshake_num += 1
+            self.full_handshake_time += handshake_time
+            self.session_cache.put(ip, sni, ssl_sock.get_session(), getattr(ssl_sock, "domain", None))
+
         # sometimes, we want to use raw tcp socket directly(select/epoll), so setattr it to ssl socket.
         ssl_sock.ip = ip
         ssl_sock._sock = sock
@@ -165,6 +270,15 @@ class ConnectCreator(object):
 
         return ssl_sock
 
+    def get_handshake_stat(self):
+        def avg(total, num):
+            return total / num if num else 0
+
+        return "full:%d(%dms) resumed:%d(%dms) sessions:%d" % (
+            self.full_handshake_num, avg(self.full_handshake_time, self.full_handshake_num),
+            self.resumed_handshake_num, avg(self.resumed_handshake_time, self.resumed_handshake_num),
+            len(self.session_cache))
+
     def check_cert(self, ssl_sock):
         cert_chain = ssl_sock.get_peer_cert_chain()
         if not cert_chain:
@@ -173,22 +287,18 @@ class ConnectCreator(object):
         if len(cert_chain) < self.config.min_intermediate_CA:
             raise socket.error('No intermediate CA was found.')
 
+        info = self.cert_cache.get_info(cert_chain, self.config.check_pkp, self.config.check_sni)
         if self.config.check_pkp and hasattr(OpenSSL.crypto, "dump_publickey"):
             # old OpenSSL not support this function.
-            pub_key = OpenSSL.crypto.dump_publickey(OpenSSL.crypto.FILETYPE_PEM,
-                                             cert_chain[1].get_pubkey())
-            if pub_key not in self.config.CHECK_PKP:
+            if info.pub_key not in self.config.CHECK_PKP:
                 # google_ip.report_connect_fail(ip, force_remove=True)
                 raise socket.error('The intermediate CA is mismatching.')
-        self.get_ssl_cert_domain(ssl_sock)
-        issuer_commonname = next((v for k, v in cert_chain[0].get_issuer().get_components() if k == 'CN'), '')
+
+        ssl_sock.domain = info.domain
+        issuer_commonname = info.issuer_commonname
         if self.debug:
-            for cert in cert_chain:
-                for k, v in cert.get_issuer().get_components():
-                    if k != "CN":
-                        continue
-                    cn = v
-                    self.logger.debug("cn:%s", cn)
+            for cn in info.issuers:
+                self.logger.debug("cn:%s", cn)
 
             self.logger.debug("issued by:%s", issuer_commonname)
             self.logger.debug("Common Name:%s", ssl_sock.domain)
@@ -196,17 +306,8 @@ class ConnectCreator(object):
         if self.config.check_commonname and not issuer_commonname.startswith(self.config.check_commonname):
             raise socket.error(' certificate is issued by %r' % (issuer_commonname))
 
-        cert = ssl_sock.get_peer_certificate()
-        if not cert:
-            raise socket.error('certificate is none')
-
         if self.config.check_sni:
-            # get_subj_alt_name cost near 100ms. be careful.
-            try:
-                alt_names = ConnectCreator.get_subj_alt_name(cert)
-            except Exception as e:
-                # self.logger.warn("get_subj_alt_name fail:%r", e)
-                alt_names = [""]
+            alt_names = info.alt_names
 
             if self.debug:
                 self.logger.debug('alt names: "%s"', '", "'.join(alt_names))
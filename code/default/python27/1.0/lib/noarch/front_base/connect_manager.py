@@ -17,14 +17,23 @@ every ssl connect can't change host after request.
 
 import time
 import threading
-import operator
+
+from sortedcontainers import SortedList
 
 
 class ConnectPool():
+    # pool:            sock => (handshake_time, last_use_time, seq)
+    # handshake_order: (handshake_time, seq, sock), get fastest/slowest from both ends.
+    # last_use_order:  (last_use_time, seq, sock), get idle socks from front.
+    # seq is unique, so sock itself is never compared.
+
     def __init__(self):
         self.pool_lock = threading.Lock()
         self.not_empty = threading.Condition(self.pool_lock)
         self.pool = {}
+        self.handshake_order = SortedList()
+        self.last_use_order = SortedList()
+        self.seq = 0
 
     def qsize(self):
         return len(self.pool)
@@ -33,11 +42,23 @@ class ConnectPool():
         handshake_time, sock = item
         self.not_empty.acquire()
         try:
-            self.pool[sock] = handshake_time
+            if sock in self.pool:
+                self._remove(sock)
+
+            self.seq += 1
+            self.pool[sock] = (handshake_time, sock.last_use_time, self.seq)
+            self.handshake_order.add((handshake_time, self.seq, sock))
+            self.last_use_order.add((sock.last_use_time, self.seq, sock))
             self.not_empty.notify()
         finally:
             self.not_empty.release()
 
+    def _remove(self, sock):
+        handshake_time, last_use_time, seq = self.pool.pop(sock)
+        self.handshake_order.remove((handshake_time, seq, sock))
+        self.last_use_order.remove((last_use_time, seq, sock))
+        return handshake_time
+
     def get(self, block=True, timeout=None):
         self.not_empty.acquire()
         try:
@@ -66,16 +87,8 @@ class ConnectPool():
         return self.get(block=False)
 
     def _get(self):
-        fastest_time = 9999
-        fastest_sock = None
-        for sock in self.pool:
-            hs_time = self.pool[sock]
-            if hs_time < fastest_time or not fastest_sock:
-                fastest_time = hs_time
-                fastest_sock = sock
-
-        self.pool.pop(fastest_sock)
-        return fastest_time, fastest_sock
+        fastest_sock = self.handshake_order[0][2]
+        return self._remove(fastest_sock), fastest_sock
 
     def get_slowest(self):
         self.not_empty.acquire()
@@ -83,16 +96,8 @@ class ConnectPool():
             if not self.qsize():
                 raise ValueError("no item")
 
-            slowest_handshake_time = 0
-            slowest_sock = None
-            for sock in self.pool:
-                handshake_time = self.pool[sock]
-                if handshake_time > slowest_handshake_time:
-                    slowest_handshake_time = handshake_time
-                    slowest_sock = sock
-
-            self.pool.pop(slowest_sock)
-            return slowest_handshake_time, slowest_sock
+            slowest_sock = self.handshake_order[-1][2]
+            return self._remove(slowest_sock), slowest_sock
         finally:
             self.not_empty.release()
 
@@ -100,14 +105,12 @@ class ConnectPool():
         return_list = []
         self.pool_lock.acquire()
         try:
-            pool = tuple(self.pool)
-            for sock in pool:
-                inactive_time = time.time() - sock.last_use_time
+            last_use_limit = time.time() - maxtime
+            while self.last_use_order and self.last_use_order[0][0] <= last_use_limit:
+                sock = self.last_use_order[0][2]
                 # self.logger.debug("inactive_time:%d", inactive_time * 1000)
-                if inactive_time >= maxtime:
-                    return_list.append(sock)
-
-                    del self.pool[sock]
+                self._remove(sock)
+                return_list.append(sock)
 
             return return_list
         finally:
@@ -120,6 +123,8 @@ class ConnectPool():
                 sock.close()
 
             self.pool = {}
+            self.handshake_order.clear()
+            self.last_use_order.clear()
         finally:
             self.pool_lock.release()
 
@@ -127,11 +132,10 @@ class ConnectPool():
         out_str = ''
         self.pool_lock.acquire()
         try:
-            pool = sorted(self.pool.items(), key=operator.itemgetter(1))
+            time_now = time.time()
             i = 0
-            for item in pool:
-                sock,t = item
-                out_str += "%d \t %s handshake:%d not_active_time:%d \r\n" % (i, sock.ip, t, time.time() - sock.last_use_time)
+            for t, _, sock in self.handshake_order:
+                out_str += "%d \t %s handshake:%d not_active_time:%d \r\n" % (i, sock.ip, t, time_now - sock.last_use_time)
                 i += 1
         finally:
             self.pool_lock.release()
@@ -280,9 +284,9 @@ class ConnectManager(object):
             ssl_sock = self.connect_creator.connect_ssl(ip, port=443,
                                             close_cb=self.ip_manager.ssl_closed)
 
-            self.ip_manager.update_ip(ip, ssl_sock.handshake_time)
-            self.logger.debug("create_ssl update ip:%s time:%d h2:%d sni:%s, host:%s",
-                              ip, ssl_sock.handshake_time, ssl_sock.h2, ssl_sock.sni, ssl_sock.host)
+            self.ip_manager.update_ip(ip, ssl_sock.handshake_time, ssl_sock.resumed)
+            self.logger.debug("create_ssl update ip:%s time:%d resumed:%d h2:%d sni:%s, host:%s",
+                              ip, ssl_sock.handshake_time, ssl_sock.resumed, ssl_sock.h2, ssl_sock.sni, ssl_sock.host)
 
             return ssl_sock
         except Exception as e:
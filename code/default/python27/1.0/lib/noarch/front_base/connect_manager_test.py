@@ -0,0 +1,143 @@
+#!/usr/bin/env python2
+# coding:utf-8
+
+# benchmark ConnectPool and ConnectManager.get_ssl_connection with concurrent callers.
+# ssl connections are simulated, handshake is a sleep.
+
+import os
+import sys
+import time
+import random
+import threading
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+noarch_lib = os.path.abspath(os.path.join(current_path, os.pardir))
+sys.path.append(noarch_lib)
+
+from front_base.connect_manager import ConnectPool, ConnectManager
+from xlog import getLogger
+xlog = getLogger("connect_manager_test")
+
+
+thread_num = 16
+pool_size = 500
+
+
+class Logger(object):
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class Config(object):
+    connection_pool_min = 0
+    https_connection_pool_min = 0
+    https_connection_pool_max = pool_size
+    https_max_connect_thread = 32
+    https_keep_alive = 60
+
+
+class SslSock(object):
+    def __init__(self, ip, handshake_time):
+        self.ip = ip
+        self.handshake_time = handshake_time
+        self.last_use_time = time.time()
+        self.resumed = False
+        self.h2 = True
+        self.sni = ""
+        self.host = ""
+
+    def close(self):
+        pass
+
+
+class ConnectCreator(object):
+    def connect_ssl(self, ip, port=443, close_cb=None):
+        handshake_time = random.randint(100, 600)
+        time.sleep(handshake_time / 1000.0)
+        return SslSock(ip, handshake_time)
+
+
+class IpManager(object):
+    def get_ip(self):
+        return "10.0.%d.%d" % (random.randint(0, 255), random.randint(0, 255))
+
+    def update_ip(self, ip, handshake_time, resumed=False):
+        pass
+
+    def report_connect_fail(self, ip, reason=""):
+        pass
+
+    def report_connect_closed(self, ip, reason=""):
+        pass
+
+    def ssl_closed(self, ip, reason=""):
+        pass
+
+
+class CheckLocalNetwork(object):
+    def is_ok(self, ip):
+        return True
+
+
+def run_threads(target):
+    start_time = time.time()
+    threads = [threading.Thread(target=target) for _ in range(thread_num)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    return time.time() - start_time
+
+
+def test_pool(op_num=5000):
+    # get and put back from a full pool.
+    pool = ConnectPool()
+    for i in range(pool_size):
+        ssl_sock = SslSock("10.0.%d.%d" % (i >> 8, i & 255), random.randint(100, 1000))
+        ssl_sock.last_use_time = time.time() - random.random() * 100
+        pool.put((ssl_sock.handshake_time, ssl_sock))
+
+    def worker():
+        for _ in range(op_num):
+            ret = pool.get(timeout=1)
+            if ret:
+                pool.put(ret)
+
+    time_cost = run_threads(worker)
+    xlog.info("pool socks:%d threads:%d get/put:%d time:%.2fs per op:%.1fus", pool_size, thread_num,
+              thread_num * op_num, time_cost, time_cost / (thread_num * op_num) * 1000000)
+
+
+def test_get_ssl_connection(get_num=200):
+    # callers get a connection, use it and put it back, new ones are created on need.
+    connect_manager = ConnectManager(Logger(), Config(), ConnectCreator(), IpManager(), CheckLocalNetwork())
+    get_times = []
+
+    def worker():
+        for _ in range(get_num):
+            start_time = time.time()
+            ssl_sock = connect_manager.get_ssl_connection()
+            get_times.append(time.time() - start_time)
+            if not ssl_sock:
+                continue
+
+            time.sleep(0.001)
+            ssl_sock.last_use_time = time.time()
+            connect_manager.new_conn_pool.put((ssl_sock.handshake_time, ssl_sock))
+
+    time_cost = run_threads(worker)
+    connect_manager.stop()
+
+    get_times.sort()
+    # first callers wait for handshake, the rest get from pool.
+    xlog.info("get_ssl_connection threads:%d get:%d time:%.2fs avg:%.2fms p99:%.2fms max:%.2fms pooled:%d",
+              thread_num, len(get_times), time_cost,
+              sum(get_times) / len(get_times) * 1000, get_times[int(len(get_times) * 0.99)] * 1000,
+              get_times[-1] * 1000, connect_manager.new_conn_pool.qsize())
+
+
+if __name__ == '__main__':
+    test_pool()
+    test_get_ssl_connection()
+    # connect threads of ConnectManager are not daemon.
+    os._exit(0)
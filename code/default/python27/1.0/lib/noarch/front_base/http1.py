@@ -51,6 +51,7 @@ class Http1Worker(HttpWorker):
 
     def request(self, task):
         self.accept_task = False
+        self.score_changed()
         self.task = task
         self.task_queue.put(task)
 
@@ -135,11 +136,15 @@ class Http1Worker(HttpWorker):
 
         try:
             self.ssl_sock.send(request_data.encode())
-            payload_len = len(task.body)
+            body = task.body
+            if isinstance(body, (bytes, bytearray)):
+                # slice by memoryview, no copy.
+                body = memoryview(body)
+            payload_len = len(body)
             start = 0
             while start < payload_len:
                 send_size = min(payload_len - start, 65535)
-                sended = self.ssl_sock.send(task.body[start:start+send_size])
+                sended = self.ssl_sock.send(body[start:start+send_size])
                 start += sended
 
             task.set_state("h1_req_sended")
@@ -208,6 +213,7 @@ class Http1Worker(HttpWorker):
         self.transfered_size += len(request_data) + data_len
         self.task = None
         self.accept_task = True
+        self.score_changed()
         self.idle_cb()
         self.processed_tasks += 1
         self.last_recv_time = time.time()
@@ -243,6 +249,7 @@ class Http1Worker(HttpWorker):
             content = response.readall(timeout=5)
             self.record_active("head end")
             self.rtt = (time.time() - start_time) * 1000
+            self.score_changed()
             #self.ip_manager.update_ip(self.ip, self.rtt)
             return True
         except Exception as e:
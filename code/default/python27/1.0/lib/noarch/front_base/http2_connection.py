@@ -4,11 +4,13 @@ import threading
 import socket
 import errno
 import struct
+import sys
 
 from http_common import *
 
 
 from hyper.common.bufsocket import BufferedSocket
+from hyper.common.exceptions import ConnectionResetError
 
 from hyper.packages.hyperframe.frame import (
     FRAMES, DataFrame, HeadersFrame, PushPromiseFrame, RstStreamFrame,
@@ -63,6 +65,9 @@ class RawFrame(object):
     def serialize(self):
         return self.dat
 
+    def serialize_list(self):
+        return [self.dat]
+
     def __repr__(self):
         out_str = "{type}".format(type=type(self).__name__)
         return out_str
@@ -101,6 +106,8 @@ class Http2Worker(HttpWorker):
         # every frame put to this queue must allowed by stream window and connection window
         # any data frame blocked by connection window should put to self.blocked_send_frames
         self.send_queue = Queue.Queue()
+        # max time to wait for body frame after header frame before flush.
+        self.body_follow_wait = 0.002
         self.encoder = Encoder()
         self.decoder = Decoder()
 
@@ -118,6 +125,13 @@ class Http2Worker(HttpWorker):
         self.local_connection_initial_windows = 32 * 1024 * 1024
         self.local_window_manager = FlowControlManager(self.local_connection_initial_windows)
 
+        # frames are read in large chunk to this buffer and parsed from it.
+        # payload returned is memoryview slice of the buffer.
+        self.recv_buffer_size = self.local_settings[SettingsFrame.SETTINGS_MAX_FRAME_SIZE] + self.network_buffer_size
+        self._new_recv_buffer(self.recv_buffer_size)
+        # ref count of buffer when no slice is in use.
+        self.recv_buffer_refs = sys.getrefcount(self.recv_bytes)
+
         # changed by server, with SettingFrame
         self.remote_settings = {
             SettingsFrame.INITIAL_WINDOW_SIZE: DEFAULT_WINDOW_SIZE,
@@ -146,6 +160,7 @@ class Http2Worker(HttpWorker):
 
         task.set_state("h2_req")
         self.request_task(task)
+        self.score_changed()
 
     def encode_header(self, headers):
         return self.encoder.encode(headers)
@@ -173,23 +188,16 @@ class Http2Worker(HttpWorker):
                 # None frame means exist
                 break
 
-            if self.config.http2_show_debug:
-                self.logger.debug("%s Send:%s", self.ip, str(frame))
-            data = frame.serialize()
             try:
-                self._sock.send(data, flush=False)
-                # don't flush for small package
-                # reduce send api call
-
-                if self.send_queue._qsize():
-                    continue
-
-                # wait for payload frame
-                time.sleep(0.01)
-                # combine header and payload in one tcp package.
-                if not self.send_queue._qsize():
-                    self._sock.flush()
-
+                # buffer all frames in queue, flush once when queue is empty.
+                while frame:
+                    if self.config.http2_show_debug:
+                        self.logger.debug("%s Send:%s", self.ip, str(frame))
+                    for buf in frame.serialize_list():
+                        self._sock.send(buf, flush=False)
+                    frame = self._get_pending_frame(frame)
+
+                self._sock.flush()
                 self.last_send_time = time.time()
             except socket.error as e:
                 if e.errno not in (errno.EPIPE, errno.ECONNRESET):
@@ -202,6 +210,26 @@ class Http2Worker(HttpWorker):
                 self.logger.debug("http2 %s send error:%r", self.ip, e)
                 self.close("send fail:%r" % e)
 
+            if frame is None:
+                break
+
+    def _get_pending_frame(self, last_frame):
+        # return next frame in queue, False if queue is empty, None means exist.
+        try:
+            return self.send_queue.get_nowait()
+        except Queue.Empty:
+            pass
+
+        if not isinstance(last_frame, HeadersFrame) or 'END_STREAM' in last_frame.flags:
+            return False
+
+        # body frame follow the header soon,
+        # wait a moment to combine header and payload in one tcp package.
+        try:
+            return self.send_queue.get(True, self.body_follow_wait)
+        except Queue.Empty:
+            return False
+
     def recv_loop(self):
         while self.keep_running:
             try:
@@ -270,6 +298,7 @@ class Http2Worker(HttpWorker):
                 len(self.streams) < self.config.http2_max_concurrent and \
                 self.remote_window_size > 10000:
             self.accept_task = True
+            self.score_changed()
             self.idle_cb()
 
     def _send_cb(self, frame):
@@ -279,6 +308,7 @@ class Http2Worker(HttpWorker):
             if len(frame.data) > self.remote_window_size:
                 self.blocked_send_frames.append(frame)
                 self.accept_task = False
+                self.score_changed()
                 return
             else:
                 self.remote_window_size -= len(frame.data)
@@ -298,13 +328,16 @@ class Http2Worker(HttpWorker):
                 len(self.streams) < self.config.http2_max_concurrent and \
                 self.remote_window_size > 10000:
             self.accept_task = True
+            self.score_changed()
             self.idle_cb()
+        else:
+            self.score_changed()
 
         self.processed_tasks += 1
 
     def _consume_single_frame(self):
         try:
-            header = self._sock.recv(9)
+            header = self._recv_payload(9)
         except Exception as e:
             self.logger.debug("%s _consume_single_frame:%r, inactive time:%d", self.ip, e, time.time() - self.last_recv_time)
             self.close("ConnectionReset:%r" % e)
@@ -313,6 +346,8 @@ class Http2Worker(HttpWorker):
 
         # Parse the header. We can use the returned memoryview directly here.
         frame, length = Frame.parse_frame_header(header)
+        # release the slice, so recv buffer can be reused.
+        del header
 
         if length > FRAME_MAX_ALLOWED_LEN:
             self.logger.error("%s Frame size exceeded on stream %d (received: %d, max: %d)",
@@ -327,27 +362,45 @@ class Http2Worker(HttpWorker):
 
         self._consume_frame_payload(frame, data)
 
+    def _new_recv_buffer(self, size):
+        self.recv_bytes = bytearray(size)
+        self.recv_buffer = memoryview(self.recv_bytes)
+        # data not parsed is recv_buffer[recv_start:recv_end]
+        self.recv_start = 0
+        self.recv_end = 0
+
+    def _make_recv_room(self, length):
+        # move data not parsed to buffer head,
+        # to a new buffer if slice of old one is still used by streams.
+        left_data = self.recv_buffer[self.recv_start:self.recv_end].tobytes()
+        if sys.getrefcount(self.recv_bytes) > self.recv_buffer_refs or length > len(self.recv_buffer):
+            self._new_recv_buffer(max(length, self.recv_buffer_size))
+        else:
+            self.recv_start = self.recv_end = 0
+
+        self.recv_buffer[:len(left_data)] = left_data
+        self.recv_end = len(left_data)
+
     def _recv_payload(self, length):
         if not length:
             return memoryview(b'')
 
-        buffer = bytearray(length)
-        buffer_view = memoryview(buffer)
-        index = 0
-        data_length = -1
+        if self.recv_start + length > len(self.recv_buffer):
+            self._make_recv_room(length)
+
+        # read as much as the buffer can hold,
+        # following frames can be parsed without recv.
+        while self.recv_end - self.recv_start < length:
+            data_length = self.ssl_sock.recv_into(self.recv_buffer[self.recv_end:])
+            if not data_length:
+                raise ConnectionResetError()
 
-        # _sock.recv(length) might not read out all data if the given length
-        # is very large. So it should be to retrieve from socket repeatedly.
-        while length and data_length:
-            data = self._sock.recv(length)
+            self.recv_end += data_length
             self.last_recv_time = time.time()
-            data_length = len(data)
-            end = index + data_length
-            buffer_view[index:end] = data[:]
-            length -= data_length
-            index = end
 
-        return buffer_view[:end]
+        data = self.recv_buffer[self.recv_start:self.recv_start + length]
+        self.recv_start += length
+        return data
 
     def _consume_frame_payload(self, frame, data):
         frame.parse_body(data)
@@ -402,6 +455,7 @@ class Http2Worker(HttpWorker):
                 #self.logger.debug("RTT:%d, on_way:%d", self.rtt, self.ping_on_way)
                 if self.keep_running and self.ping_on_way == 0:
                     self.accept_task = True
+                self.score_changed()
             else:
                 # The spec requires us to reply with PING+ACK and identical data.
                 p = PingFrame(0)
@@ -420,6 +474,7 @@ class Http2Worker(HttpWorker):
                 self._update_settings(frame)
             else:
                 self.accept_task = True
+                self.score_changed()
                 self.idle_cb()
 
         elif frame.type == GoAwayFrame.type:
@@ -0,0 +1,216 @@
+#!/usr/bin/env python2
+# coding:utf-8
+
+# benchmark Http2Worker against a local stand-in of http/2 server.
+
+import os
+import sys
+import ssl
+import time
+import socket
+import shutil
+import tempfile
+import threading
+import subprocess
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+noarch_lib = os.path.abspath(os.path.join(current_path, os.pardir))
+sys.path.append(noarch_lib)
+
+import http_common
+import http2_connection
+from hyper.packages.hyperframe.frame import DataFrame, PingFrame
+from xlog import getLogger
+xlog = getLogger("http2_connection_test")
+
+
+class Logger(object):
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class Config(object):
+    show_state_debug = False
+    http2_show_debug = False
+    http2_max_concurrent = 60
+    http2_ping_min_interval = 100
+    http2_status_to_close = []
+    http2_max_timeout_tasks = 1
+    http2_timeout_active = 0
+
+
+class IpManager(object):
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class SslSock(object):
+    # socket with the attributes of ssl_sock created by connect_creator.
+    def __init__(self, sock):
+        self._sock = sock
+        self.handshake_time = 30
+        self.ip = "127.0.0.1"
+        self.create_time = time.time()
+        self.host = "localhost"
+        self.sni = "localhost"
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+
+class CountWorker(http2_connection.Http2Worker):
+    # count parsed frames instead of pass them to streams.
+    frame_num = 0
+    frame_size = 0
+    frame_target = 0
+    done = None
+
+    def _consume_frame_payload(self, frame, data):
+        frame.parse_body(data)
+        self.frame_num += 1
+        self.frame_size += len(data)
+        if self.frame_num == self.frame_target:
+            self.done.set()
+
+
+def create_cert(cert_path):
+    # self signed cert and key in one file, for ssl server.
+    try:
+        from OpenSSL import crypto
+    except ImportError:
+        with open(os.devnull, "w") as null:
+            subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+                                   "-subj", "/CN=localhost", "-days", "1",
+                                   "-keyout", cert_path, "-out", cert_path],
+                                  stdout=null, stderr=null)
+        return
+
+    key = crypto.PKey()
+    key.generate_key(crypto.TYPE_RSA, 2048)
+    cert = crypto.X509()
+    cert.get_subject().CN = "localhost"
+    cert.set_serial_number(1)
+    cert.gmtime_adj_notBefore(0)
+    cert.gmtime_adj_notAfter(24 * 3600)
+    cert.set_issuer(cert.get_subject())
+    cert.set_pubkey(key)
+    cert.sign(key, "sha256")
+    with open(cert_path, "wb") as fd:
+        fd.write(crypto.dump_privatekey(crypto.FILETYPE_PEM, key))
+        fd.write(crypto.dump_certificate(crypto.FILETYPE_PEM, cert))
+
+
+def create_worker(sock, worker_class=http2_connection.Http2Worker):
+    none_cb = lambda *args: None
+    worker = worker_class(Logger(), IpManager(), Config(), SslSock(sock),
+                          none_cb, none_cb, none_cb, none_cb)
+    worker.get_host = lambda host: host
+    return worker
+
+
+def test_send_latency(request_num=200):
+    # time from request_task to the HEADERS frame arrived at server, GET and POST.
+    sock, server_sock = socket.socketpair()
+    headers_times = []
+
+    def server():
+        buf = ""
+        while True:
+            data = server_sock.recv(65536)
+            if not data:
+                break
+
+            time_now = time.time()
+            buf += data
+            while len(buf) >= 9:
+                if buf.startswith("PRI * HTTP/2.0"):
+                    # connection preface
+                    buf = buf[24:]
+                    continue
+
+                length = (ord(buf[0]) << 16) + (ord(buf[1]) << 8) + ord(buf[2])
+                if len(buf) < 9 + length:
+                    break
+                if ord(buf[3]) == 1:
+                    # HEADERS
+                    headers_times.append(time_now)
+                buf = buf[9 + length:]
+
+    th = threading.Thread(target=server)
+    th.daemon = True
+    th.start()
+
+    worker = create_worker(sock)
+    time.sleep(0.2)
+
+    latency = []
+    for i in range(request_num):
+        body = "x" * 100 if i % 2 else ""
+        task = http_common.Task(Logger(), Config(), "POST" if body else "GET", "localhost", "/",
+                                {"Accept": "*/*"}, body, None, "http://localhost/", 5)
+        headers_num = len(headers_times)
+        start_time = time.time()
+        worker.request_task(task)
+        while len(headers_times) == headers_num:
+            time.sleep(0.0001)
+        latency.append(headers_times[-1] - start_time)
+        time.sleep(0.003)
+
+    latency.sort()
+    xlog.info("send latency requests:%d median:%.2fms p90:%.2fms max:%.2fms", request_num,
+              latency[request_num / 2] * 1000, latency[request_num * 9 / 10] * 1000, latency[-1] * 1000)
+
+    worker.keep_running = False
+    worker.send_queue.put(None)
+    sock.shutdown(socket.SHUT_RDWR)
+    server_sock.close()
+
+
+def test_recv_frames(cert_path, frame_size, frame_num=20000):
+    # frames parsed per second from a loopback ssl pair, DATA frames mixed with PING.
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+
+    def server():
+        sock, _ = listener.accept()
+        sock = ssl.wrap_socket(sock, server_side=True, certfile=cert_path)
+        data_frame = DataFrame(1)
+        data_frame.data = os.urandom(frame_size)
+        ping_frame = PingFrame(0)
+        ping_frame.opaque_data = "12345678"
+        data = (data_frame.serialize() + ping_frame.serialize()) * 16
+        for i in range(frame_num / 32 + 1):
+            sock.sendall(data)
+        time.sleep(30)
+
+    th = threading.Thread(target=server)
+    th.daemon = True
+    th.start()
+
+    sock = ssl.wrap_socket(socket.create_connection(listener.getsockname()))
+    CountWorker.frame_target = frame_num
+    CountWorker.done = threading.Event()
+    start_time = time.time()
+    worker = create_worker(sock, CountWorker)
+    CountWorker.done.wait(60)
+    time_cost = time.time() - start_time
+
+    xlog.info("recv frame size:%d frames:%d %d frames/s %.1f MB/s", frame_size, worker.frame_num,
+              worker.frame_num / time_cost, worker.frame_size / time_cost / 1024 / 1024)
+    worker.keep_running = False
+
+
+if __name__ == '__main__':
+    test_send_latency()
+
+    cert_dir = tempfile.mkdtemp()
+    try:
+        cert_path = os.path.join(cert_dir, "cert.pem")
+        create_cert(cert_path)
+        test_recv_frames(cert_path, 16 * 1024)
+        test_recv_frames(cert_path, 1024)
+    finally:
+        shutil.rmtree(cert_dir, ignore_errors=True)
+    # threads of worker are not daemon.
+    os._exit(0)
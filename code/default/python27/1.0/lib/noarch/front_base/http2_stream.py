@@ -92,8 +92,14 @@ class Stream(object):
 
         self.request_headers = HTTPHeaderMap()
 
-        # Convert the body to bytes if needed.
-        self.request_body = to_bytestring(self.task.body)
+        # Convert the body to bytes if needed,
+        # body is held as memoryview, DataFrame payloads are slices without copy.
+        body = self.task.body
+        if isinstance(body, bytearray):
+            body = memoryview(body)
+        elif not isinstance(body, memoryview):
+            body = memoryview(to_bytestring(body))
+        self.request_body = body
 
         # request body not send blocked by send window
         # the left body will send when send window opened.
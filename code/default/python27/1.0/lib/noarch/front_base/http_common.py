@@ -1,3 +1,4 @@
+import collections
 import time
 
 import simple_queue
@@ -24,8 +25,12 @@ class Task(object):
         self.body_readed = 0
         self.content_length = None
         self.worker = None
-        self.read_buffers = []
+        # when put to dispatcher request queue, for queue wait time.
+        self.queue_time = 0
+        # memoryview chunks received but not read, first one may be partly read.
+        self.read_buffers = collections.deque()
         self.read_buffer_len = 0
+        self.read_eof = False
 
         self.responsed = False
         self.finished = False
@@ -45,81 +50,106 @@ class Task(object):
         self.body_queue.put(data)
         self.body_len += len(data)
 
+    def _get_chunk(self, timeout):
+        # return memoryview of next body chunk, None if closed or no data in time.
+        if self.read_eof:
+            return None
+
+        data = self.body_queue.get(timeout)
+        if data is None:
+            return None
+        elif not data:
+            self.read_eof = True
+            return None
+
+        if not isinstance(data, memoryview):
+            data = memoryview(data)
+        self.read_buffers.append(data)
+        self.read_buffer_len += len(data)
+        return data
+
+    def _pop_chunk(self, size):
+        # pop at most size bytes from first buffered chunk, no copy.
+        data = self.read_buffers[0]
+        if len(data) > size:
+            self.read_buffers[0] = data[size:]
+            data = data[:size]
+        else:
+            self.read_buffers.popleft()
+        self.read_buffer_len -= len(data)
+        self.body_readed += len(data)
+        return data
+
     def read(self, size=None):
         # fail or cloe if return ""
         if self.body_readed == self.content_length:
             return memoryview(b'')
 
-        if size:
-            while self.read_buffer_len < size:
-                data = self.body_queue.get(self.timeout)
-                if not data:
-                    return memoryview(b'')
-
-                self.read_buffers.append(data)
-                self.read_buffer_len += len(data)
-
-            if len(self.read_buffers[0]) == size:
-                data = self.read_buffers[0]
-                self.read_buffers.pop(0)
-                self.read_buffer_len -= size
-            elif len(self.read_buffers[0]) > size:
-                data = self.read_buffers[0][:size]
-                self.read_buffers[0] = self.read_buffers[0][size:]
-                self.read_buffer_len -= size
-            else:
-                buff = bytearray(self.read_buffer_len)
-                buff_view = memoryview(buff)
-                p = 0
-                for data in self.read_buffers:
-                    buff_view[p:p+len(data)] = data
-                    p += len(data)
-
-                if self.read_buffer_len == size:
-                    self.read_buffers = []
-                    self.read_buffer_len = 0
-                    data = buff_view
-                else:
-                    data = buff_view[:size]
-
-                    self.read_buffers = [buff_view[size:]]
-                    self.read_buffer_len -= size
+        if not self.read_buffers and not self._get_chunk(self.timeout):
+            return memoryview(b'')
 
-        else:
-            if self.read_buffers:
-                data = self.read_buffers.pop(0)
-                self.read_buffer_len -= len(data)
-            else:
-                data = self.body_queue.get(self.timeout)
-                if not data:
-                    return memoryview(b'')
+        if not size:
+            return self._pop_chunk(len(self.read_buffers[0]))
 
-        self.body_readed += len(data)
-        return data
+        while self.read_buffer_len < size:
+            if not self._get_chunk(self.timeout):
+                return memoryview(b'')
+
+        if len(self.read_buffers[0]) >= size:
+            return self._pop_chunk(size)
+
+        # only copy when read cross chunks.
+        buff = bytearray(size)
+        self.readinto(buff)
+        return memoryview(buff)
+
+    def readinto(self, buffer):
+        # copy body to buffer, wait only if no data buffered.
+        # return length filled, 0 if fail or close.
+        buff_view = memoryview(buffer)
+        size = len(buff_view)
+        if self.content_length is not None:
+            size = min(size, int(self.content_length) - self.body_readed)
+
+        if size <= 0:
+            return 0
+
+        if not self.read_buffers and not self._get_chunk(self.timeout):
+            return 0
+
+        p = 0
+        while p < size:
+            if not self.read_buffers and not self._get_chunk(None):
+                break
+
+            data = self._pop_chunk(size - p)
+            buff_view[p:p + len(data)] = data
+            p += len(data)
+
+        return p
 
     def read_all(self):
         if self.content_length:
             left_body = int(self.content_length) - self.body_readed
+            if left_body <= 0:
+                return memoryview(b'')
+
+            if not self.read_buffers:
+                self._get_chunk(self.timeout)
+
+            if self.read_buffers and len(self.read_buffers[0]) >= left_body:
+                # whole body in one chunk, return it without copy.
+                return self._pop_chunk(left_body)
 
             buff = bytearray(left_body)
             buff_view = memoryview(buff)
             p = 0
-            for data in self.read_buffers:
-                buff_view[p:p+len(data)] = data
-                p += len(data)
-
-            self.read_buffers = []
-            self.read_buffer_len = 0
-
             while p < left_body:
-                data = self.read()
-                if not data:
+                n = self.readinto(buff_view[p:])
+                if not n:
                     break
+                p += n
 
-                buff_view[p:p + len(data)] = data[0:len(data)]
-                p += len(data)
-
-            self.body_readed += p
             return buff_view[:p]
         else:
             out = list()
@@ -127,9 +157,7 @@ class Task(object):
                 data = self.read()
                 if not data:
                     break
-                if isinstance(data, memoryview):
-                    data = data.tobytes()
-                out.append(data)
+                out.append(data.tobytes())
             out_buf = "".join(out)
             return memoryview(out_buf)
 
@@ -188,6 +216,8 @@ class HttpWorker(object):
         self.retry_task_cb = retry_task_cb
         self.idle_cb = idle_cb
         self.log_debug_data = log_debug_data
+        # set by dispatcher, called when accept_task, rtt or streams changed.
+        self.score_changed_cb = None
         self.accept_task = True
         self.keep_running = True
         self.processed_tasks = 0
@@ -200,6 +230,7 @@ class HttpWorker(object):
         self.speed = speed
         self.speed_history.append(speed)
         self.log_debug_data(rtt, sent, received)
+        self.score_changed()
 
     def close(self, reason):
         self.accept_task = False
@@ -210,6 +241,19 @@ class HttpWorker(object):
         self.ip_manager.report_connect_closed(self.ssl_sock.ip, reason)
         self.close_cb(self)
 
+    def score_changed(self):
+        if self.score_changed_cb:
+            self.score_changed_cb(self)
+
+    def get_min_score(self):
+        # get_score never return less than this,
+        # it only add penalty for recent active and limit rtt for long inactive.
+        rtt = min(self.rtt, 1000)
+        if self.version == "1.1":
+            return rtt + 100
+        else:
+            return rtt + len(self.streams) * 500
+
     def get_score(self):
         now = time.time()
         inactive_time = now - self.last_recv_time
@@ -24,6 +24,8 @@ import threading
 import time
 import traceback
 
+from sortedcontainers import SortedList
+
 from utils import SimpleCondition
 import simple_queue
 
@@ -49,6 +51,17 @@ class HttpsDispatcher(object):
 
         self.request_queue = Queue.Queue()
         self.workers = []
+        # workers accept task, updated by worker score_changed_cb.
+        # worker_order: (min_score, seq, worker), get_worker check from front.
+        # worker_keys:  worker => (min_score, seq)
+        # idle_workers: h1 workers and h2 workers without stream.
+        self.worker_lock = threading.Lock()
+        self.worker_order = SortedList()
+        self.worker_keys = {}
+        self.idle_workers = set()
+        # h2 worker => streams got by dispatcher threads, not created by request yet.
+        self.reserved_streams = {}
+        self.worker_seq = 0
         self.working_tasks = {}
         self.h1_num = 0
         self.h2_num = 0
@@ -63,17 +76,20 @@ class HttpsDispatcher(object):
         self.continue_fail_num = 0
         self.last_fail_time = 0
         self.rtts = []
+        self.queue_waits = []
         self.last_sent = self.total_sent = 0
         self.last_received = self.total_received = 0
         self.second_stats = Queue.deque()
         self.last_statistic_time = time.time()
         self.second_stat = {
             "rtt": 0,
+            "queue_wait": 0,
             "sent": 0,
             "received": 0
         }
         self.minute_stat = {
             "rtt": 0,
+            "queue_wait": 0,
             "sent": 0,
             "received": 0
         }
@@ -81,13 +97,17 @@ class HttpsDispatcher(object):
         self.trigger_create_worker_cv = SimpleCondition()
         self.wait_a_worker_cv = simple_queue.Queue()
 
-        threading.Thread(target=self.dispatcher).start()
+        # multi dispatcher threads, a slow get_worker don't block other tasks.
+        self.dispatcher_thread_num = max(1, self.config.dispather_thread_num)
+        for i in range(self.dispatcher_thread_num):
+            threading.Thread(target=self.dispatcher).start()
         threading.Thread(target=self.create_worker_thread).start()
         threading.Thread(target=self.connection_checker).start()
 
     def stop(self):
         self.running = False
-        self.request_queue.put(None)
+        for i in range(self.dispatcher_thread_num):
+            self.request_queue.put(None)
         self.close_all_worker("stop")
 
     def on_ssl_created_cb(self, ssl_sock, check_free_work=True):
@@ -111,6 +131,9 @@ class HttpsDispatcher(object):
             self.h1_num += 1
 
         self.workers.append(worker)
+        worker.score_changed_cb = self._on_worker_score_changed
+        # worker may changed before callback set.
+        self._on_worker_score_changed(worker)
 
         if check_free_work:
             self.check_free_worker()
@@ -118,6 +141,77 @@ class HttpsDispatcher(object):
     def _on_worker_idle_cb(self):
         self.wait_a_worker_cv.notify()
 
+    def _remove_worker_order(self, worker):
+        # must hold worker_lock
+        key = self.worker_keys.pop(worker, None)
+        if key:
+            self.worker_order.remove(key + (worker,))
+        self.idle_workers.discard(worker)
+
+    def _on_worker_score_changed(self, worker):
+        with self.worker_lock:
+            self._remove_worker_order(worker)
+
+            accept = worker.accept_task and worker.keep_running
+            if accept:
+                self.worker_seq += 1
+                key = (worker.get_min_score(), self.worker_seq)
+                self.worker_keys[worker] = key
+                self.worker_order.add(key + (worker,))
+
+                if worker.version == "1.1" or len(worker.streams) == 0:
+                    self.idle_workers.add(worker)
+
+        if accept:
+            self.wait_a_worker_cv.notify()
+
+    def _get_best_worker(self):
+        # get_score >= min_score, so stop when no better worker possible.
+        best_score = 99999999
+        best_worker = None
+        with self.worker_lock:
+            for min_score, _, worker in self.worker_order:
+                if min_score >= best_score:
+                    break
+
+                if worker.version == "2" and len(worker.streams) + self.reserved_streams.get(worker, 0) >= \
+                        self.config.http2_max_concurrent:
+                    continue
+
+                score = worker.get_score()
+                if best_score > score:
+                    best_score = score
+                    best_worker = worker
+
+        return best_score, best_worker
+
+    def _reserve_worker(self, worker):
+        # other dispatcher threads may get the same worker before its request is called.
+        with self.worker_lock:
+            if worker not in self.worker_keys:
+                return False
+
+            if worker.version == "2":
+                reserved = self.reserved_streams.get(worker, 0) + 1
+                if len(worker.streams) + reserved > self.config.http2_max_concurrent:
+                    return False
+                self.reserved_streams[worker] = reserved
+                self.idle_workers.discard(worker)
+            else:
+                worker.accept_task = False
+                self._remove_worker_order(worker)
+            return True
+
+    def _release_worker(self, worker):
+        # the stream is in worker.streams after request.
+        if worker.version != "2":
+            return
+
+        with self.worker_lock:
+            reserved = self.reserved_streams.pop(worker, 0) - 1
+            if reserved > 0:
+                self.reserved_streams[worker] = reserved
+
     def create_worker_thread(self):
         while self.running:
             self.trigger_create_worker_cv.wait()
@@ -136,41 +230,12 @@ class HttpsDispatcher(object):
             except:
                 time.sleep(10)
 
-            idle_num = 0
-            acceptable_num = 0
-            for worker in self.workers:
-                if worker.accept_task:
-                    acceptable_num += 1
-
-                if worker.version == "1.1":
-                    if worker.accept_task:
-                        idle_num += 1
-                else:
-                    if len(worker.streams) == 0:
-                        idle_num += 1
-
     def get_worker(self, nowait=False):
         while self.running:
-            best_score = 99999999
-            best_worker = None
-            idle_num = 0
+            update_seq = self.worker_seq
+            best_score, best_worker = self._get_best_worker()
+            idle_num = len(self.idle_workers)
             now = time.time()
-            for worker in self.workers:
-                if not worker.accept_task:
-                    # self.logger.debug("not accept")
-                    continue
-
-                if worker.version == "1.1":
-                    idle_num += 1
-                else:
-                    if len(worker.streams) == 0:
-                        idle_num += 1
-
-                score = worker.get_score()
-
-                if best_score > score:
-                    best_score = score
-                    best_worker = worker
 
             if len(self.workers) < self.config.dispather_max_workers and \
                     (best_worker is None or
@@ -184,27 +249,36 @@ class HttpsDispatcher(object):
 
             if nowait or \
                     (best_worker and (now - best_worker.last_recv_time) >= self.config.dispather_work_min_idle_time):
+                # nowait only peek the best worker for score.
+                if best_worker and not nowait and not self._reserve_worker(best_worker):
+                    # got by other dispatcher thread.
+                    continue
                 # self.logger.debug("return worker")
                 return best_worker
 
-            self.wait_a_worker_cv.wait(time.time() + 1)
+            if update_seq != self.worker_seq:
+                # worker changed when checking, don't miss it.
+                continue
+
+            if best_worker:
+                end_time = best_worker.last_recv_time + self.config.dispather_work_min_idle_time
+            else:
+                # worker score change will wake up, timeout is for safe.
+                end_time = now + 1
+            self.wait_a_worker_cv.wait(end_time)
             # self.logger.debug("get wait_a_worker_cv")
-            #time.sleep(0.1)
 
     def check_free_worker(self):
         # close slowest worker,
         # give change for better worker
-        while True:
+        while len(self.workers) >= self.config.dispather_max_workers:
             slowest_score = 9999
             slowest_worker = None
             idle_num = 0
-            for worker in self.workers:
-                if not worker.accept_task:
-                    continue
-
-                if worker.version == "2" and len(worker.streams) > 0:
-                    continue
+            with self.worker_lock:
+                idle_workers = list(self.idle_workers)
 
+            for worker in idle_workers:
                 score = worker.get_score()
                 if score < 1000:
                     idle_num += 1
@@ -214,8 +288,7 @@ class HttpsDispatcher(object):
                     slowest_worker = worker
 
             if idle_num < self.config.dispather_max_idle_workers or \
-                    idle_num < int(len(self.workers) * 0.3) or \
-                    len(self.workers) < self.config.dispather_max_workers:
+                    idle_num < int(len(self.workers) * 0.3):
                 return
 
             if slowest_worker is None:
@@ -238,7 +311,7 @@ class HttpsDispatcher(object):
             self.last_request_time = time.time()
             q = simple_queue.Queue()
             task = http_common.Task(self.logger, self.config, method, host, path, headers, body, q, url, timeout)
-            task.set_state("start_request")
+            task.queue_time = task.set_state("start_request")
             self.request_queue.put(task)
 
             response = q.get(timeout=timeout)
@@ -283,13 +356,12 @@ class HttpsDispatcher(object):
             task.response_fail("retry but stopped.")
             return
 
-        task.set_state("retry(%s)" % reason)
+        task.queue_time = task.set_state("retry(%s)" % reason)
         task.retry_count += 1
         self.request_queue.put(task)
 
     def dispatcher(self):
         while self.running:
-            start_time = time.time()
             try:
                 task = self.request_queue.get(True)
                 if task is None:
@@ -299,7 +371,9 @@ class HttpsDispatcher(object):
                 self.logger.exception("http_dispatcher dispatcher request_queue.get fail:%r", e)
                 continue
             get_time = time.time()
-            get_cost = get_time - start_time
+            # time waited in request_queue, show head-of-line blocking.
+            get_cost = get_time - task.queue_time
+            self.queue_waits.append(get_cost * 1000)
 
             task.set_state("get_task(%d)" % get_cost)
             try:
@@ -323,6 +397,8 @@ class HttpsDispatcher(object):
                 worker.request(task)
             except Exception as e:
                 self.logger.exception("dispatch request:%r", e)
+            finally:
+                self._release_worker(worker)
 
         # wait up threads to exit.
         self.wait_a_worker_cv.notify()
@@ -346,6 +422,11 @@ class HttpsDispatcher(object):
         return time.time() - self.last_request_time > self.idle_time
 
     def close_cb(self, worker):
+        worker.score_changed_cb = None
+        with self.worker_lock:
+            self._remove_worker_order(worker)
+            self.reserved_streams.pop(worker, None)
+
         try:
             self.workers.remove(worker)
             if worker.version == "2":
@@ -360,6 +441,11 @@ class HttpsDispatcher(object):
             w.close(reason)
 
         self.workers = []
+        with self.worker_lock:
+            self.worker_order.clear()
+            self.worker_keys = {}
+            self.idle_workers = set()
+            self.reserved_streams = {}
         self.h1_num = 0
         self.h2_num = 0
 
@@ -372,14 +458,17 @@ class HttpsDispatcher(object):
         now = time.time()
         if now > self.last_statistic_time + 60:
             rtt = 0
+            queue_wait = 0
             sent = 0
             received = 0
             for stat in self.second_stats:
                 rtt = max(rtt, stat["rtt"])
+                queue_wait = max(queue_wait, stat["queue_wait"])
                 sent += stat["sent"]
                 received += stat["received"]
             self.minute_stat = {
                 "rtt": rtt,
+                "queue_wait": queue_wait,
                 "sent": sent,
                 "received": received
             }
@@ -391,8 +480,15 @@ class HttpsDispatcher(object):
         else:
             rtt = 0
 
+        queue_waits, self.queue_waits = self.queue_waits, []
+        if queue_waits:
+            queue_wait = max(queue_waits)
+        else:
+            queue_wait = 0
+
         self.second_stat = {
             "rtt": rtt,
+            "queue_wait": queue_wait,
             "sent": self.total_sent - self.last_sent,
             "received": self.total_received - self.last_received
         }
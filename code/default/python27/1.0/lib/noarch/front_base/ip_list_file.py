@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Read and write the ip list file of IpManager.
+
+Record: (ip, domain, server, handshake_time, fail_times, down_fail)
+
+Binary format, little endian:
+  header: magic, version(H), ip num(I), string num(I), crc32 of body(i)
+  body:
+    string table: length(H) + string, for domain, server and not ip address.
+    family:         B   * ip_num,  4, 6, or 0 for string in table
+    address:        16s * ip_num,  ipv4 use first 4 bytes, string use id(I)
+    domain id:      I   * ip_num
+    server id:      I   * ip_num
+    handshake_time: I   * ip_num
+    fail_times:     H   * ip_num
+    down_fail:      H   * ip_num
+
+Columns are loaded by array in bulk, not by line parse.
+File is written to a temp file then renamed, a crash in saving keeps old file.
+
+Text format, one ip per line, for default ip list, export and edit by user:
+  ip domain server handshake_time fail_times down_fail
+"""
+
+import array
+import os
+import socket
+import struct
+import sys
+import zlib
+
+import ipaddress
+
+from utils import replace_file
+
+
+MAGIC = "XIPL"
+VERSION = 1
+header_struct = struct.Struct("<4sHIIi")
+string_len_struct = struct.Struct("<H")
+string_id_struct = struct.Struct("<I")
+columns = [("I", 0xFFFFFFFF), ("I", 0xFFFFFFFF), ("I", 0xFFFFFFFF), ("H", 0xFFFF), ("H", 0xFFFF)]
+
+
+def _pack_ip(ip):
+    # only pack ip if it can be restored to the same string.
+    try:
+        if "." in ip:
+            packed = socket.inet_aton(ip)
+            if socket.inet_ntoa(packed) == ip:
+                return 4, packed
+        elif ":" in ip:
+            packed = ipaddress.IPv6Address(unicode(ip)).packed
+            if str(ipaddress.IPv6Address(packed)) == ip:
+                return 6, packed
+    except Exception:
+        pass
+
+    return 0, None
+
+
+def _unpack_ip(family, address, strings):
+    if family == 4:
+        return socket.inet_ntoa(address[:4])
+    elif family == 6:
+        return str(ipaddress.IPv6Address(address))
+    else:
+        string_id, = string_id_struct.unpack_from(address)
+        return strings[string_id]
+
+
+def _to_str(value):
+    if isinstance(value, unicode):
+        # from json or web_control, mixed with binary data.
+        return value.encode("utf-8")
+    return "%s" % value
+
+
+def save(file_path, records):
+    strings = []
+    string_ids = {}
+
+    def get_string_id(value):
+        value = _to_str(value)
+        if value not in string_ids:
+            string_ids[value] = len(strings)
+            strings.append(value)
+        return string_ids[value]
+
+    families = array.array("B")
+    addresses = []
+    values = [array.array(typecode) for typecode, _ in columns]
+    for ip, domain, server, handshake_time, fail_times, down_fail in records:
+        family, packed = _pack_ip(ip)
+        if not packed:
+            packed = string_id_struct.pack(get_string_id(ip))
+        families.append(family)
+        addresses.append(packed.ljust(16, "\0"))
+
+        row = (get_string_id(domain), get_string_id(server), handshake_time, fail_times, down_fail)
+        for i, value in enumerate(row):
+            values[i].append(max(0, min(int(value), columns[i][1])))
+
+    if sys.byteorder == "big":
+        for column in values:
+            column.byteswap()
+
+    body = [string_len_struct.pack(len(s)) + s for s in strings]
+    body.append(families.tostring())
+    body.extend(addresses)
+    body.extend(column.tostring() for column in values)
+    body = "".join(body)
+
+    data = header_struct.pack(MAGIC, VERSION, len(families), len(strings), zlib.crc32(body)) + body
+
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "wb") as fd:
+        fd.write(data)
+        fd.flush()
+        os.fsync(fd.fileno())
+
+    replace_file(tmp_path, file_path)
+
+
+def load(file_path):
+    with open(file_path, "rb") as fd:
+        data = fd.read()
+
+    magic, version, ip_num, string_num, crc = header_struct.unpack_from(data)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError("unknown format")
+
+    body = data[header_struct.size:]
+    if zlib.crc32(body) != crc:
+        raise ValueError("crc check fail")
+
+    pos = 0
+    strings = []
+    for _ in range(string_num):
+        length, = string_len_struct.unpack_from(body, pos)
+        pos += string_len_struct.size
+        strings.append(body[pos:pos + length])
+        pos += length
+
+    families = array.array("B")
+    families.fromstring(body[pos:pos + ip_num])
+    pos += ip_num
+
+    address_pos = pos
+    pos += 16 * ip_num
+
+    values = []
+    for typecode, _ in columns:
+        column = array.array(typecode)
+        size = column.itemsize * ip_num
+        column.fromstring(body[pos:pos + size])
+        pos += size
+        if sys.byteorder == "big":
+            column.byteswap()
+        values.append(column)
+
+    domain_ids, server_ids, handshake_times, fail_times, down_fails = values
+    records = []
+    for i in range(ip_num):
+        address = body[address_pos + 16 * i:address_pos + 16 * (i + 1)]
+        ip = _unpack_ip(families[i], address, strings)
+        records.append((ip, strings[domain_ids[i]], strings[server_ids[i]],
+                        handshake_times[i], fail_times[i], down_fails[i]))
+    return records
+
+
+def save_text(file_path, records):
+    tmp_path = file_path + ".tmp"
+    with open(tmp_path, "w") as fd:
+        for ip, domain, server, handshake_time, fail_times, down_fail in records:
+            fd.write("%s %s %s %d %d %d\n" % (_to_str(ip), _to_str(domain), _to_str(server),
+                                              handshake_time, fail_times, down_fail))
+        fd.flush()
+        os.fsync(fd.fileno())
+
+    replace_file(tmp_path, file_path)
+
+
+def load_text(file_path, logger):
+    records = []
+    with open(file_path, "r") as fd:
+        lines = fd.readlines()
+
+    for line in lines:
+        try:
+            if line.startswith("#"):
+                continue
+
+            str_l = line.split(' ')
+
+            if len(str_l) < 4:
+                logger.warning("line err: %s", line)
+                continue
+            ip = str_l[0]
+            domain = str_l[1]
+            server = str_l[2]
+            handshake_time = int(str_l[3])
+            if len(str_l) > 4:
+                fail_times = int(str_l[4])
+            else:
+                fail_times = 0
+
+            if len(str_l) > 5:
+                down_fail = int(str_l[5])
+            else:
+                down_fail = 0
+
+            records.append((ip, domain, server, handshake_time, fail_times, down_fail))
+        except Exception as e:
+            logger.exception("load_ip line:%s err:%s", line, e)
+
+    return records
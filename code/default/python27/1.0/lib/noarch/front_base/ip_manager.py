@@ -2,13 +2,17 @@
 # -*- coding: utf-8 -*-
 
 import Queue
-import operator
+import heapq
 import os
 import sys
 import threading
 import time
 import random
 
+from sortedcontainers import SortedListWithKey
+
+import ip_list_file
+
 
 class IpManagerBase():
     def __init__(self, config, ip_source, logger):
@@ -31,7 +35,7 @@ class IpManagerBase():
             return ""
         return random.choice(self.ips)
 
-    def update_ip(self, ip, handshake_time):
+    def update_ip(self, ip, handshake_time, resumed=False):
         pass
 
     def report_connect_fail(self, ip, reason=""):
@@ -44,6 +48,78 @@ class IpManagerBase():
         pass
     
 
+class IpReadyIndex(object):
+    # Index ips for get_ip, avoid scan all ip list on every call.
+    #
+    # ready:   heap of (rate, seq, ip), ips can connect now, fastest first.
+    # waiting: heap of (ready_time, seq, ip), ips in connect/fail interval.
+    # parked:  ips reached max links, wait for a link closed.
+    #
+    # Every ip only have one valid entry, identified by seq[ip].
+    # Old entries are left in heap and dropped when popped.
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.ready = []
+        self.waiting = []
+        self.parked = set()
+        self.seq = {}
+        self.last_seq = 0
+
+    def __len__(self):
+        return len(self.seq)
+
+    def _new_seq(self, ip):
+        if len(self.ready) + len(self.waiting) > 4 * len(self.seq) + 64:
+            self._compact()
+
+        self.last_seq += 1
+        self.seq[ip] = self.last_seq
+        self.parked.discard(ip)
+        return self.last_seq
+
+    def _compact(self):
+        self.ready = [item for item in self.ready if self.seq.get(item[2]) == item[1]]
+        self.waiting = [item for item in self.waiting if self.seq.get(item[2]) == item[1]]
+        heapq.heapify(self.ready)
+        heapq.heapify(self.waiting)
+
+    def push_ready(self, ip, rate):
+        heapq.heappush(self.ready, (rate, self._new_seq(ip), ip))
+
+    def push_waiting(self, ip, ready_time):
+        heapq.heappush(self.waiting, (ready_time, self._new_seq(ip), ip))
+
+    def park(self, ip):
+        self._new_seq(ip)
+        self.parked.add(ip)
+
+    def discard(self, ip):
+        self.seq.pop(ip, None)
+        self.parked.discard(ip)
+
+    def pop(self, time_now, get_rate):
+        # return the fastest ready ip and remove it from index,
+        # caller should put it back after update it's status.
+        while self.waiting and self.waiting[0][0] <= time_now:
+            ready_time, seq, ip = heapq.heappop(self.waiting)
+            if self.seq.get(ip) == seq:
+                self.push_ready(ip, get_rate(ip))
+
+        while self.ready:
+            rate, seq, ip = heapq.heappop(self.ready)
+            if self.seq.get(ip) == seq:
+                del self.seq[ip]
+                return ip
+
+        return None
+
+    def ready_num(self):
+        return len([item for item in self.ready if self.seq.get(item[2]) == item[1]])
+
+
 ######################################
 # about ip connect time and handshake time
 # handshake time is double of connect time in common case.
@@ -78,6 +154,11 @@ class IpManager():
 
         self.default_ip_list_fn = default_ip_list_fn
         self.ip_list_fn = ip_list_fn
+        # binary ip list, text ip_list_fn is only loaded if it not exist or is newer.
+        # text ip_list_fn is exported from the same snapshot in a longer interval.
+        self.ip_list_bin_fn = os.path.splitext(ip_list_fn)[0] + ".bin"
+        self.text_save_interval = 600
+        self.save_lock = threading.Lock()
 
         self.scan_thread_lock = threading.Lock()
         self.ip_lock = threading.Lock()
@@ -92,12 +173,12 @@ class IpManager():
 
     def reset(self):
         self.ip_lock.acquire()
-        self.ip_pointer = 0
-        self.ip_pointer_reset_time = 0
         self.scan_thread_count = 0
         self.iplist_need_save = False
         self.iplist_saved_time = 0
+        self.iplist_text_saved_time = 0
         self.last_sort_time = 0 # keep status for avoid wast too many cpu
+        self.sorted_use_ipv6 = None
         self.good_ip_num = 0 # only success ip num
         self.good_ipv4_num = 0
         self.good_ipv6_num = 0
@@ -120,8 +201,14 @@ class IpManager():
                  # }
         self.ip_dict = {}
 
-        # gererate from ip_dict, sort by handshake_time, when get_batch_ip
-        self.ip_list = []
+        # ip => rate when put in ip_list, the sort key of ip_list
+        self.ip_rate = {}
+        # ips counted in good_ip_num
+        self.good_ips = set()
+        # gererate from ip_dict, sorted by rate, updated on every ip status change
+        self.ip_list = SortedListWithKey(key=self._sorted_ip_rate)
+        # ips in ip_list, indexed by rate and ready time, for get_ip
+        self.ip_index = IpReadyIndex()
         self.to_check_ip_queue = Queue.Queue()
         self.scan_exist_ip_queue = Queue.Queue()
         self.ip_lock.release()
@@ -147,51 +234,50 @@ class IpManager():
         self.record_ip_history = self.config.record_ip_history
 
     def load_ip(self):
-        if os.path.isfile(self.ip_list_fn):
-            file_path = self.ip_list_fn
-        elif self.default_ip_list_fn and os.path.isfile(self.default_ip_list_fn):
-            file_path = self.default_ip_list_fn
-        else:
-            return
-
-        with open(file_path, "r") as fd:
-            lines = fd.readlines()
-
-        for line in lines:
+        records = None
+        if os.path.isfile(self.ip_list_bin_fn) and not (
+                os.path.isfile(self.ip_list_fn) and
+                os.path.getmtime(self.ip_list_fn) > os.path.getmtime(self.ip_list_bin_fn)):
+            # text file edited by user after last save is loaded instead.
             try:
-                if line.startswith("#"):
-                    continue
-
-                str_l = line.split(' ')
-
-                if len(str_l) < 4:
-                    self.logger.warning("line err: %s", line)
-                    continue
-                ip = str_l[0]
-                domain = str_l[1]
-                server = str_l[2]
-                handshake_time = int(str_l[3])
-                if len(str_l) > 4:
-                    fail_times = int(str_l[4])
-                else:
-                    fail_times = 0
+                records = ip_list_file.load(self.ip_list_bin_fn)
+            except Exception as e:
+                self.logger.warn("load %s fail:%r", self.ip_list_bin_fn, e)
 
-                if len(str_l) > 5:
-                    down_fail = int(str_l[5])
-                else:
-                    down_fail = 0
+        if records is None:
+            if os.path.isfile(self.ip_list_fn):
+                file_path = self.ip_list_fn
+            elif self.default_ip_list_fn and os.path.isfile(self.default_ip_list_fn):
+                file_path = self.default_ip_list_fn
+            else:
+                return
 
-                #self.logger.info("load ip: %s time:%d domain:%s server:%s", ip, handshake_time, domain, server)
-                self.add_ip(ip, handshake_time, domain, server, fail_times, down_fail)
-            except Exception as e:
-                self.logger.exception("load_ip line:%s err:%s", line, e)
+            records = ip_list_file.load_text(file_path, self.logger)
 
+        self._add_records(records)
         self.logger.info("load ip_list num:%d, target num:%d", len(self.ip_dict), len(self.ip_list))
         self.try_sort_ip(force=True)
         # if file_path == self.default_good_ip_file:
         #    self.logger.info("first run, rescan all exist ip")
         #    self.start_scan_all_exist_ip()
 
+    def _add_records(self, records):
+        for ip, domain, server, handshake_time, fail_times, down_fail in records:
+            try:
+                #self.logger.info("load ip: %s time:%d domain:%s server:%s", ip, handshake_time, domain, server)
+                self.add_ip(ip, handshake_time, domain, server, fail_times, down_fail)
+            except Exception as e:
+                self.logger.exception("load_ip %s err:%s", ip, e)
+
+    def _get_records(self):
+        self.ip_lock.acquire()
+        try:
+            return [(ip, info['domain'], info['server'], info['handshake_time'],
+                     info['fail_times'], info['down_fail'])
+                    for ip, info in self.ip_dict.items()]
+        finally:
+            self.ip_lock.release()
+
     def save(self, force=False):
         if not force:
             if not self.iplist_need_save:
@@ -199,26 +285,31 @@ class IpManager():
             if time.time() - self.iplist_saved_time < 10:
                 return
 
-        self.iplist_saved_time = time.time()
+        if not self.save_lock.acquire(force):
+            # other thread is saving.
+            return
 
+        self.iplist_saved_time = time.time()
         try:
-            self.ip_lock.acquire()
-            ip_dict = sorted(self.ip_dict.items(),  key=lambda x: (x[1]['handshake_time'] + x[1]['fail_times'] * 1000))
-            with open(self.ip_list_fn, "w") as fd:
-                for ip, property in ip_dict:
-                    fd.write( "%s %s %s %d %d %d\n" %
-                        (ip, property['domain'],
-                            property['server'],
-                            property['handshake_time'],
-                            property['fail_times'],
-                            property['down_fail']) )
-                fd.flush()
-
+            # write from a snapshot, don't block get_ip when writing file.
             self.iplist_need_save = False
+            records = self._get_records()
+            if force or time.time() - self.iplist_text_saved_time > self.text_save_interval:
+                # before the binary file, text file newer than it is loaded as user edited.
+                self.iplist_text_saved_time = time.time()
+                self.export_text(self.ip_list_fn, records)
+            ip_list_file.save(self.ip_list_bin_fn, records)
         except Exception as e:
-            self.logger.error("save %s fail %s", self.ip_list_fn, e)
+            self.iplist_need_save = True
+            self.logger.error("save %s fail %s", self.ip_list_bin_fn, e)
         finally:
-            self.ip_lock.release()
+            self.save_lock.release()
+
+    def export_text(self, file_path, records=None):
+        if records is None:
+            records = self._get_records()
+        records = sorted(records, key=lambda x: (x[3] + x[4] * 1000))
+        ip_list_file.save_text(file_path, records)
 
     def _ip_rate(self, ip_info):
         return ip_info['handshake_time'] + \
@@ -232,42 +323,67 @@ class IpManager():
             self.good_ipv6_num += num
         self.good_ip_num += num
 
+    def _sorted_ip_rate(self, ip):
+        return self.ip_rate.get(ip, -1)
+
+    def _update_ip_order(self, ip, time_now=None):
+        # update ip position in ip_list, ip_index and good ip num
+        # after it's rate changed or removed, must hold ip_lock.
+        if ip in self.ip_rate:
+            self.ip_list.discard(ip)
+            del self.ip_rate[ip]
+
+        if ip in self.good_ips:
+            self.good_ips.remove(ip)
+            self._add_ip_num(ip, -1)
+
+        if ip in self.ip_dict and self._ip_allowed(ip):
+            self.ip_rate[ip] = self._ip_rate(self.ip_dict[ip])
+            self.ip_list.add(ip)
+
+            if self.ip_dict[ip]['fail_times'] == 0:
+                self.good_ips.add(ip)
+                self._add_ip_num(ip, 1)
+
+        self._index_ip(ip, time_now)
+
     def try_sort_ip(self, force=False):
+        # ip_list is kept in order on every ip change,
+        # full rebuild only when forced or ipv6 config changed.
         if time.time() - self.last_sort_time < 10 and not force:
             return
 
-        self.ip_lock.acquire()
         self.last_sort_time = time.time()
+        if force or self.sorted_use_ipv6 != self.config.use_ipv6:
+            self.rebuild_ip_list()
+
+        self.adjust_scan_thread_num()
+
+    def rebuild_ip_list(self):
+        start_time = time.time()
+        self.ip_lock.acquire()
         try:
+            self.sorted_use_ipv6 = self.config.use_ipv6
             self.good_ip_num = 0
             self.good_ipv4_num = 0
             self.good_ipv6_num = 0
-            ip_rate = {}
-            for ip in self.ip_dict:
-                if "." in ip and self.config.use_ipv6 == "force_ipv6":
-                    continue
-                elif ":" in ip and self.config.use_ipv6 == "force_ipv4":
-                    continue
+            self.good_ips.clear()
+            self.ip_rate.clear()
+            self.ip_list.clear()
+            self.ip_index.clear()
 
-                if 'gws' not in self.ip_dict[ip]['server']:
-                    continue
-                ip_rate[ip] = self._ip_rate(self.ip_dict[ip])
-                if self.ip_dict[ip]['fail_times'] == 0:
-                    self._add_ip_num(ip, 1)
-
-            ip_time = sorted(ip_rate.items(), key=operator.itemgetter(1))
-            self.ip_list = [ip for ip, rate in ip_time]
+            time_now = time.time()
+            for ip in self.ip_dict:
+                self._update_ip_order(ip, time_now)
 
         except Exception as e:
-            self.logger.error("try_sort_ip_by_handshake_time:%s", e)
+            self.logger.error("rebuild_ip_list:%s", e)
         finally:
             self.ip_lock.release()
 
-        time_cost = ((time.time() - self.last_sort_time) * 1000)
+        time_cost = ((time.time() - start_time) * 1000)
         if time_cost > 30:
-            self.logger.debug("sort ip time:%dms", time_cost) # 5ms for 1000 ip. 70~150ms for 30000 ip.
-
-        self.adjust_scan_thread_num()
+            self.logger.debug("sort ip time:%dms", time_cost)
 
     def adjust_scan_thread_num(self):
         if not self.config.auto_adjust_scan_ip_thread_num:
@@ -316,77 +432,89 @@ class IpManager():
         if self.record_ip_history:
             self.ip_dict[ip]['history'].append([time.time(), info])
 
-    # algorithm to get ip:
-    # scan start from fastest ip
-    # always use the fastest ip.
-    # if the ip is used in 5 seconds, try next ip;
-    # if the ip is fail in 60 seconds, try next ip;
-    # reset pointer to front every 3 seconds
-    def get_ip(self):
-        self.try_sort_ip()
+    def _ip_allowed(self, ip):
+        if "." in ip and self.config.use_ipv6 == "force_ipv6":
+            return False
+        elif ":" in ip and self.config.use_ipv6 == "force_ipv4":
+            return False
 
-        self.ip_lock.acquire()
-        try:
-            ip_num = len(self.ip_list)
-            if ip_num == 0:
-                #self.logger.warning("no ip")
-                time.sleep(1)
-                return None
+        return 'gws' in self.ip_dict[ip]['server']
 
-            for i in range(ip_num):
-                time_now = time.time()
-                if self.ip_pointer >= ip_num:
-                    if time_now - self.ip_pointer_reset_time < 1:
-                        time.sleep(1)
-                        continue
-                    else:
-                        self.ip_pointer = 0
-                        self.ip_pointer_reset_time = time_now
-                elif self.ip_pointer > 0 and time_now - self.ip_pointer_reset_time > 3:
-                    self.ip_pointer = 0
-                    self.ip_pointer_reset_time = time_now
-
-                ip = self.ip_list[self.ip_pointer]
-                if "." in ip and self.config.use_ipv6 == "force_ipv6":
-                    continue
-                elif ":" in ip and self.config.use_ipv6 == "force_ipv4":
-                    continue
+    def _ip_ready_time(self, ip, time_now):
+        ip_info = self.ip_dict[ip]
+        if time_now - ip_info['success_time'] > self.config.long_fail_threshold: # 5 min
+            fail_connect_interval = self.config.long_fail_connect_interval # 180
+        else:
+            fail_connect_interval = self.config.short_fail_connect_interval # 10
 
-                get_time = self.ip_dict[ip]["get_time"]
-                if time_now - get_time < self.ip_connect_interval:
-                    self.ip_pointer += 1
-                    continue
+        return max(ip_info["get_time"] + self.ip_connect_interval,
+                   ip_info["fail_time"] + fail_connect_interval,
+                   ip_info["down_fail_time"] + self.config.down_fail_connect_interval)
 
-                if time_now - self.ip_dict[ip]['success_time'] > self.config.long_fail_threshold: # 5 min
-                    fail_connect_interval = self.config.long_fail_connect_interval # 180
-                else:
-                    fail_connect_interval = self.config.short_fail_connect_interval # 10
-                fail_time = self.ip_dict[ip]["fail_time"]
-                if time_now - fail_time < fail_connect_interval:
-                    self.ip_pointer += 1
-                    continue
+    def _index_ip(self, ip, time_now=None):
+        # update ip position in ip_index after it's status changed.
+        # must hold ip_lock.
+        if ip not in self.ip_dict or not self._ip_allowed(ip):
+            self.ip_index.discard(ip)
+            return
 
-                down_fail_time = self.ip_dict[ip]["down_fail_time"]
-                if time_now - down_fail_time < self.config.down_fail_connect_interval:
-                    self.ip_pointer += 1
-                    continue
+        if self.ip_dict[ip]['links'] >= self.max_links_per_ip:
+            self.ip_index.park(ip)
+            return
+
+        if time_now is None:
+            time_now = time.time()
+
+        ready_time = self._ip_ready_time(ip, time_now)
+        if ready_time > time_now:
+            self.ip_index.push_waiting(ip, ready_time)
+        else:
+            self.ip_index.push_ready(ip, self._ip_rate(self.ip_dict[ip]))
+
+    def _get_ip_rate(self, ip):
+        return self._ip_rate(self.ip_dict[ip])
+
+    # algorithm to get ip:
+    # always use the fastest ready ip.
+    # if the ip is used in 5 seconds, wait in index until interval passed;
+    # if the ip is fail in 60 seconds, wait in index until interval passed;
+    # if the ip reach max links, park it until a link closed.
+    def get_ip(self):
+        self.try_sort_ip()
 
-                if self.ip_dict[ip]['links'] >= self.max_links_per_ip:
-                    self.ip_pointer += 1
+        ip = None
+        self.ip_lock.acquire()
+        try:
+            time_now = time.time()
+            while True:
+                ip = self.ip_index.pop(time_now, self._get_ip_rate)
+                if not ip:
+                    break
+
+                # fail interval depends on success_time, so check again when pop.
+                if self.ip_dict[ip]['links'] >= self.max_links_per_ip or \
+                        self._ip_ready_time(ip, time_now) > time_now:
+                    self._index_ip(ip, time_now)
                     continue
 
-                handshake_time = self.ip_dict[ip]["handshake_time"]
-                # self.logger.debug("get ip:%s t:%d", ip, handshake_time)
+                # self.logger.debug("get ip:%s t:%d", ip, self.ip_dict[ip]["handshake_time"])
                 self.append_ip_history(ip, "get")
                 self.ip_dict[ip]['get_time'] = time_now
                 self.ip_dict[ip]['links'] += 1
-                self.ip_pointer += 1
-                return ip
+                self._index_ip(ip, time_now)
+                break
         except Exception as e:
             self.logger.exception("get_ip fail:%r", e)
+            ip = None
         finally:
             self.ip_lock.release()
 
+        if not ip and not self.ip_list:
+            #self.logger.warning("no ip")
+            time.sleep(1)
+
+        return ip
+
     def add_ip(self, ip, handshake_time=100, domain=None, server='gws', fail_times=0, down_fail=0):
         if not isinstance(ip, basestring):
             self.logger.error("add_ip input")
@@ -403,12 +531,11 @@ class IpManager():
                 self.ip_dict[ip]['fail_times'] = fail_times
                 if self.ip_dict[ip]['fail_time'] > 0:
                     self.ip_dict[ip]['fail_time'] = 0
-                    self._add_ip_num(ip, 1)
                 self.append_ip_history(ip, handshake_time)
+                self._update_ip_order(ip)
                 return False
 
             self.iplist_need_save = True
-            self._add_ip_num(ip, 1)
 
             self.ip_dict[ip] = {'handshake_time':handshake_time, "fail_times":fail_times,
                                     "transfered_data":0, 'data_active':0,
@@ -420,7 +547,7 @@ class IpManager():
             if 'gws' not in server:
                 return
 
-            self.ip_list.append(ip)
+            self._update_ip_order(ip)
         except Exception as e:
             self.logger.exception("add_ip err:%s", e)
         finally:
@@ -428,7 +555,9 @@ class IpManager():
 
         return True
 
-    def update_ip(self, ip, handshake_time):
+    def update_ip(self, ip, handshake_time, resumed=False):
+        # resumed handshake skip key exchange, not comparable with full one,
+        # only mark ip success, keep handshake time for ip rate.
         if not isinstance(ip, basestring):
             self.logger.error("update_ip input error:%s", ip)
             return
@@ -450,18 +579,18 @@ class IpManager():
                 # some times ip package lost cause handshake time become 2000ms
                 # this ip will not return back to good ip front until all become bad
                 # There for, prevent handshake time increase too quickly.
-                org_time = self.ip_dict[ip]['handshake_time']
-                if handshake_time - org_time > 500:
-                    self.ip_dict[ip]['handshake_time'] = org_time + 500
-                else:
-                    self.ip_dict[ip]['handshake_time'] = handshake_time
+                if not resumed:
+                    org_time = self.ip_dict[ip]['handshake_time']
+                    if handshake_time - org_time > 500:
+                        self.ip_dict[ip]['handshake_time'] = org_time + 500
+                    else:
+                        self.ip_dict[ip]['handshake_time'] = handshake_time
+                    self.append_ip_history(ip, handshake_time)
 
                 self.ip_dict[ip]['success_time'] = time_now
-                if self.ip_dict[ip]['fail_times'] > 0:
-                    self._add_ip_num(ip, 1)
                 self.ip_dict[ip]['fail_times'] = 0
-                self.append_ip_history(ip, handshake_time)
                 self.ip_dict[ip]["fail_time"] = 0
+                self._update_ip_order(ip, time_now)
 
                 self.iplist_need_save = True
 
@@ -482,12 +611,8 @@ class IpManager():
                 return
 
             if force_remove:
-                if self.ip_dict[ip]['fail_times'] == 0:
-                    self._add_ip_num(ip, -1)
                 del self.ip_dict[ip]
-
-                if ip in self.ip_list:
-                    self.ip_list.remove(ip)
+                self._update_ip_order(ip)
 
                 self.logger.info("remove ip:%s left amount:%d target_num:%d", ip, len(self.ip_dict), len(self.ip_list))
                 return
@@ -506,11 +631,10 @@ class IpManager():
                 self.logger.debug("fail time too near %s", ip)
                 return
 
-            if self.ip_dict[ip]['fail_times'] == 0:
-                self._add_ip_num(ip, -1)
             self.ip_dict[ip]['fail_times'] += 1
             self.append_ip_history(ip, "fail")
             self.ip_dict[ip]["fail_time"] = time_now
+            self._update_ip_order(ip, time_now)
 
             # self.to_check_ip_queue.put((ip, time_now + 10))
             self.logger.debug("report_connect_fail:%s", ip)
@@ -518,8 +642,14 @@ class IpManager():
         except Exception as e:
             self.logger.exception("report_connect_fail err:%s", e)
         finally:
-            self.iplist_need_save = True
-            self.ip_lock.release()
+            try:
+                # index also on the early returns, links may changed.
+                self._index_ip(ip)
+                self.iplist_need_save = True
+            except Exception as e:
+                self.logger.exception("report_connect_fail index err:%s", e)
+            finally:
+                self.ip_lock.release()
 
         if not self.is_ip_enough():
             self.search_more_ip()
@@ -536,12 +666,10 @@ class IpManager():
             if not ip in self.ip_dict:
                 return
 
-            if self.ip_dict[ip]['down_fail'] == 0:
-                self._add_ip_num(ip, -1)
-
             self.ip_dict[ip]['down_fail'] += 1
             self.append_ip_history(ip, reason)
             self.ip_dict[ip]["down_fail_time"] = time_now
+            self._update_ip_order(ip, time_now)
             # self.logger.debug("ssl_closed %s", ip)
         except Exception as e:
             self.logger.error("ssl_closed %s err:%s", ip, e)
@@ -556,6 +684,7 @@ class IpManager():
                 if self.ip_dict[ip]['links']:
                     self.ip_dict[ip]['links'] -= 1
                     self.append_ip_history(ip, "C[%s]"%reason)
+                    self._index_ip(ip)
                     # self.logger.debug("ssl_closed %s", ip)
         except Exception as e:
             self.logger.error("ssl_closed %s err:%s", ip, e)
@@ -574,12 +703,10 @@ class IpManager():
                 time.sleep(time_wait)
 
             if not self.check_local_network.is_ok(ip):
-                try:
-                    if self.ip_dict[ip]['fail_times']:
+                with self.ip_lock:
+                    if ip in self.ip_dict and self.ip_dict[ip]['fail_times']:
                         self.ip_dict[ip]['fail_times'] = 0
-                        self._add_ip_num(ip, 1)
-                except:
-                    pass
+                        self._update_ip_order(ip)
                 continue
 
             result = self.check_ip(ip)
@@ -594,8 +721,6 @@ class IpManager():
         if len(self.ip_list) <= self.max_good_ip_num:
             return
 
-        self.try_sort_ip(force=True)
-
         self.ip_lock.acquire()
         try:
             ip_num = len(self.ip_list)
@@ -608,9 +733,7 @@ class IpManager():
                 handshake_time = property['handshake_time']
                 self.logger.info("remove_slowest_ip:%s handshake_time:%d, fails:%d", ip, handshake_time, fails)
                 del self.ip_dict[ip]
-
-                if ip in self.ip_list:
-                    self.ip_list.remove(ip)
+                self._update_ip_order(ip)
 
                 ip_num -= 1
 
@@ -739,10 +862,9 @@ class IpManager():
                     if ip not in self.ip_dict:
                         continue
 
-                    if self.ip_dict[ip]['fail_times'] == 0:
-                        self._add_ip_num(ip, -1)
                     self.ip_dict[ip]['fail_times'] += 1
                     self.ip_dict[ip]["fail_time"] = time.time()
+                    self._update_ip_order(ip)
                 finally:
                     self.ip_lock.release()
             elif result.ok:
@@ -758,21 +880,24 @@ class IpManager():
                 to_remove.append(ip)
                 self.logger.debug("ip_manager remove continue fail ip:%s", ip)
 
-        for ip in to_remove:
-            del self.ip_dict[ip]
-
-        self.try_sort_ip(True)
+        with self.ip_lock:
+            for ip in to_remove:
+                del self.ip_dict[ip]
+                self._update_ip_order(ip)
 
     def update_ips(self, ips):
         for ip in ips:
             if ip not in self.ip_dict:
                 self.add_ip(ip)
 
-        for ip in list(self.ip_dict.keys()):
-            if ip not in ips:
-                del self.ip_dict[ip]
-
-        self.try_sort_ip(True)
+        with self.ip_lock:
+            for ip in list(self.ip_dict.keys()):
+                if ip not in ips:
+                    del self.ip_dict[ip]
+                    self._update_ip_order(ip)
 
     def stop(self):
         self.running = False
+        if self.ip_dict:
+            # export text at exit.
+            self.save(force=True)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python2
+# coding:utf-8
+
+# benchmark IpManager.get_ip with 10k and 30k ips and 32 concurrent threads,
+# every got ip is reported connect fail, updated or closed like the connect pool.
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+import threading
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+noarch_lib = os.path.abspath(os.path.join(current_path, os.pardir))
+sys.path.append(noarch_lib)
+
+from front_base.ip_manager import IpManager
+from xlog import getLogger
+xlog = getLogger("ip_manager_test")
+
+
+thread_num = 32
+get_num = 2000
+
+
+class Logger(object):
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class Config(object):
+    max_scan_ip_thread_num = 0
+    max_links_per_ip = 1
+    max_good_ip_num = 100000
+    ip_connect_interval = 5
+    record_ip_history = 0
+    check_exist_ip_on_startup = 0
+    use_ipv6 = "auto"
+    long_fail_threshold = 300
+    long_fail_connect_interval = 180
+    short_fail_connect_interval = 10
+    down_fail_connect_interval = 60
+    auto_adjust_scan_ip_thread_num = 0
+    target_handshake_time = 300
+
+
+class CheckLocalNetwork(object):
+    def report_ok(self, ip):
+        pass
+
+    def report_fail(self, ip):
+        pass
+
+    def is_ok(self, ip):
+        return True
+
+
+def test(ip_num):
+    data_path = tempfile.mkdtemp()
+    try:
+        ip_manager = IpManager(Logger(), Config(), None, CheckLocalNetwork(), None, None,
+                               os.path.join(data_path, "good_ip.txt"))
+        for i in range(ip_num):
+            ip = "10.%d.%d.%d" % (i >> 16, (i >> 8) & 255, i & 255)
+            ip_manager.add_ip(ip, random.randint(100, 2000))
+        ip_manager.try_sort_ip(force=True)
+
+        got_ips = []
+
+        def worker():
+            for _ in range(get_num):
+                ip = ip_manager.get_ip()
+                if not ip:
+                    continue
+
+                got_ips.append(ip)
+                r = random.random()
+                if r < 0.3:
+                    ip_manager.report_connect_fail(ip)
+                elif r < 0.65:
+                    ip_manager.update_ip(ip, random.randint(100, 2000))
+                    ip_manager.ssl_closed(ip)
+                else:
+                    ip_manager.ssl_closed(ip)
+
+        start_time = time.time()
+        threads = [threading.Thread(target=worker) for _ in range(thread_num)]
+        for th in threads:
+            th.start()
+        for th in threads:
+            th.join()
+        time_cost = time.time() - start_time
+
+        xlog.info("ip:%d threads:%d got:%d time:%.2fs per call:%.1fus", ip_num, thread_num,
+                  len(got_ips), time_cost, time_cost / (thread_num * get_num) * 1000000)
+        ip_manager.stop()
+    finally:
+        shutil.rmtree(data_path, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    test(10000)
+    test(30000)
@@ -15,6 +15,8 @@ import select
 import time
 import socket
 import errno
+import threading
+import collections
 
 
 import OpenSSL
@@ -191,7 +193,7 @@ class SSLConnection(object):
             except OpenSSL.SSL.SysCallError as e:
                 if e[0] == 10035 and 'WSAEWOULDBLOCK' in e[1]:
                     sys.exc_clear()
-                    if io_func == self._connection.send:
+                    if io_func in (self._connection.send, self.__write_buffer):
                         _, _, errors = select.select([], [fd], [fd], wait_timeout)
                     else:
                         _, _, errors = select.select([fd], [], [fd], wait_timeout)
@@ -220,8 +222,23 @@ class SSLConnection(object):
     def connect(self, *args, **kwargs):
         return self.__iowait(self._connection.connect, *args, **kwargs)
 
+    def __write_buffer(self, data):
+        # SSL_write from the memory of memoryview/bytearray,
+        # pyOpenSSL Connection.send copy it by tobytes.
+        buf = OpenSSL.SSL._ffi.from_buffer(data)
+        result = OpenSSL.SSL._lib.SSL_write(self._connection._ssl, buf, len(data))
+        self._connection._raise_ssl_error(self._connection._ssl, result)
+        return result
+
     def __send(self, data, flags=0):
         try:
+            if isinstance(data, (memoryview, bytearray)):
+                try:
+                    return self.__iowait(self.__write_buffer, data)
+                except TypeError:
+                    # not contiguous, from_buffer refuse it.
+                    data = data.tobytes() if isinstance(data, memoryview) else str(data)
+
             return self.__iowait(self._connection.send, data, flags)
         except OpenSSL.SSL.SysCallError as e:
             if e[0] == -1 and not data:
@@ -317,6 +334,57 @@ class SSLConnection(object):
         self._makefile_refs += 1
         return socket._fileobject(self, mode, bufsize, close=True)
 
+    def session_reused(self):
+        # pyOpenSSL 16 have no Connection.session_reused
+        try:
+            return bool(OpenSSL.SSL._lib.SSL_session_reused(self._connection._ssl))
+        except Exception:
+            return False
+
+
+class SSLSessionCache(object):
+    # Client session of (ip, sni), set to new connection for abbreviated handshake.
+    # Kept with the domain of the cert checked in the full handshake,
+    # peer cert chain may be not available in abbreviated handshake.
+
+    def __init__(self, max_size=1000, timeout=3600):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        # (ip, sni) => (session, domain, expire_time), oldest first.
+        self.sessions = collections.OrderedDict()
+
+    def get(self, ip, sni):
+        # return (session, domain) or None
+        with self.lock:
+            item = self.sessions.get((ip, sni))
+            if not item:
+                return None
+
+            session, domain, expire_time = item
+            if expire_time < time.time():
+                del self.sessions[(ip, sni)]
+                return None
+
+            return session, domain
+
+    def put(self, ip, sni, session, domain):
+        if not session:
+            return
+
+        with self.lock:
+            self.sessions.pop((ip, sni), None)
+            self.sessions[(ip, sni)] = (session, domain, time.time() + self.timeout)
+            while len(self.sessions) > self.max_size:
+                self.sessions.popitem(last=False)
+
+    def remove(self, ip, sni):
+        with self.lock:
+            self.sessions.pop((ip, sni), None)
+
+    def __len__(self):
+        return len(self.sessions)
+
 
 class SSLContext(object):
     def __init__(self, logger, ca_certs=None, cipher_suites=None, support_http2=True):
@@ -357,6 +425,12 @@ class SSLContext(object):
         if cipher_suites:
             self.context.set_cipher_list(':'.join(cipher_suites))
 
+        # keep client session for resumption, session ticket is on by default.
+        try:
+            self.context.set_session_cache_mode(OpenSSL.SSL.SESS_CACHE_CLIENT)
+        except Exception as e:
+            self.logger.debug("set_session_cache_mode fail:%r", e)
+
         self.support_alpn_npn = None
         if support_http2:
             try:
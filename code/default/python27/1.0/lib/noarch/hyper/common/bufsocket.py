@@ -40,7 +40,7 @@ class WriteBuffer(object):
         if isinstance(s, WriteBuffer):
             self.buffer_list = s.buffer_list + self.buffer_list
             self.string_len += s.string_len
-        elif isinstance(s, str):
+        elif isinstance(s, (str, bytearray, memoryview)):
             self.buffer_list.insert(0, s)
             self.string_len += len(s)
         else:
@@ -50,7 +50,7 @@ class WriteBuffer(object):
         if isinstance(s, WriteBuffer):
             self.buffer_list.extend(s.buffer_list)
             self.string_len += s.string_len
-        elif isinstance(s, str):
+        elif isinstance(s, (str, bytearray, memoryview)):
             self.buffer_list.append(s)
             self.string_len += len(s)
         else:
@@ -60,8 +60,29 @@ class WriteBuffer(object):
         return self.get_string()
 
     def get_string(self):
+        if self.has_view():
+            return self.get_buffer().tobytes()
         return "".join(self.buffer_list)
 
+    def has_view(self):
+        return any(not isinstance(s, str) for s in self.buffer_list)
+
+    def get_buffer(self):
+        # return str if all pieces are str,
+        # else one memoryview, copied once if more than one piece.
+        if not self.has_view():
+            return "".join(self.buffer_list)
+
+        if len(self.buffer_list) == 1:
+            return memoryview(self.buffer_list[0])
+
+        buf = memoryview(bytearray(self.string_len))
+        pos = 0
+        for s in self.buffer_list:
+            buf[pos:pos + len(s)] = s
+            pos += len(s)
+        return buf
+
 
 class BufferedSocket(object):
     """
@@ -111,7 +132,7 @@ class BufferedSocket(object):
 
     def flush(self):
         if len(self.send_buffer):
-            data = self.send_buffer.get_string()
+            data = self.send_buffer.get_buffer()
             # logger.debug("buffer socket flush:%d", len(data))
             self.send_buffer.reset()
 
@@ -93,7 +93,18 @@ class Frame(object):
 
     def serialize(self):
         body = self.serialize_body()
-        self.body_len = len(body)
+        return self.serialize_header(len(body)) + body
+
+    def serialize_list(self):
+        """
+        Serialize the frame to a list of buffers, header and body,
+        for writing to socket without joining them.
+        """
+        body = self.serialize_body()
+        return [self.serialize_header(len(body)), body]
+
+    def serialize_header(self, body_len):
+        self.body_len = body_len
 
         # Build the common frame header.
         # First, get the flags.
@@ -103,7 +114,7 @@ class Frame(object):
             if flag in self.flags:
                 flags |= flag_bit
 
-        header = struct.pack(
+        return struct.pack(
             "!HBBBL",
             (self.body_len & 0xFFFF00) >> 8,  # Length is spread over top 24 bits
             self.body_len & 0x0000FF,
@@ -112,8 +123,6 @@ class Frame(object):
             self.stream_id & 0x7FFFFFFF  # Stream ID is 32 bits.
         )
 
-        return header + body
-
     def serialize_body(self):
         raise NotImplementedError()
 
@@ -209,7 +218,16 @@ class DataFrame(Padding, Frame):
     def serialize_body(self):
         padding_data = self.serialize_padding_data()
         padding = b'\0' * self.total_padding
-        return b''.join([padding_data, self.data, padding])
+        data = self.data
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        return b''.join([padding_data, data, padding])
+
+    def serialize_list(self):
+        # data may be memoryview of the request body, keep it out of join.
+        if 'PADDED' in self.flags:
+            return super(DataFrame, self).serialize_list()
+        return [self.serialize_header(len(self.data)), self.data]
 
     def parse_body(self, data):
         padding_data_length = self.parse_padding_data(data)
@@ -24,8 +24,9 @@ from __future__ import absolute_import, division, print_function, \
     with_statement
 
 import xlog
+import ctypes
 from ctypes import CDLL, c_char_p, c_int, c_long, byref,\
-    create_string_buffer, c_void_p
+    create_string_buffer, c_void_p, c_ssize_t, string_at, POINTER, Structure
 
 __all__ = ['ciphers']
 
@@ -35,8 +36,32 @@ loaded = False
 buf_size = 2048
 
 
+class Py_buffer(Structure):
+    # struct bufferinfo of python 2.7
+    _fields_ = [('buf', c_void_p), ('obj', c_void_p), ('len', c_ssize_t), ('itemsize', c_ssize_t),
+                ('readonly', c_int), ('ndim', c_int), ('format', c_char_p), ('shape', c_void_p),
+                ('strides', c_void_p), ('suboffsets', c_void_p), ('smalltable', c_ssize_t * 2),
+                ('internal', c_void_p)]
+
+PyBUF_SIMPLE = 0
+PyBUF_WRITABLE = 1
+
+PyObject_GetBuffer = ctypes.pythonapi.PyObject_GetBuffer
+PyObject_GetBuffer.argtypes = (ctypes.py_object, POINTER(Py_buffer), c_int)
+PyBuffer_Release = ctypes.pythonapi.PyBuffer_Release
+PyBuffer_Release.argtypes = (POINTER(Py_buffer),)
+
+
+def get_buffer(data, flags=PyBUF_SIMPLE):
+    # get pointer of str, bytearray or memoryview without copy,
+    # must release by PyBuffer_Release.
+    view = Py_buffer()
+    PyObject_GetBuffer(data, byref(view), flags)
+    return view
+
+
 def load_openssl():
-    global loaded, libcrypto, buf
+    global loaded, libcrypto, cipher_ctx_cleanup
 
     from ctypes.util import find_library
     for p in ('crypto', 'eay32', 'libeay32'):
@@ -54,14 +79,18 @@ def load_openssl():
                                             c_char_p, c_char_p, c_int)
 
     libcrypto.EVP_CipherUpdate.argtypes = (c_void_p, c_void_p, c_void_p,
-                                           c_char_p, c_int)
+                                           c_void_p, c_int)
 
-    libcrypto.EVP_CIPHER_CTX_cleanup.argtypes = (c_void_p,)
+    # EVP_CIPHER_CTX_cleanup is renamed to EVP_CIPHER_CTX_reset since OpenSSL 1.1
+    if hasattr(libcrypto, 'EVP_CIPHER_CTX_cleanup'):
+        cipher_ctx_cleanup = libcrypto.EVP_CIPHER_CTX_cleanup
+    else:
+        cipher_ctx_cleanup = libcrypto.EVP_CIPHER_CTX_reset
+    cipher_ctx_cleanup.argtypes = (c_void_p,)
     libcrypto.EVP_CIPHER_CTX_free.argtypes = (c_void_p,)
     if hasattr(libcrypto, 'OpenSSL_add_all_ciphers'):
         libcrypto.OpenSSL_add_all_ciphers()
 
-    buf = create_string_buffer(buf_size)
     loaded = True
 
 
@@ -86,6 +115,10 @@ class CtypesCrypto(object):
             cipher = load_cipher(cipher_name)
         if not cipher:
             raise Exception('cipher %s not found in libcrypto' % cipher_name)
+        self._key = key
+        # output buffer of this context, not shared with other threads.
+        self._buf = None
+        self._buf_size = 0
         key_ptr = c_char_p(key)
         iv_ptr = c_char_p(iv)
         self._ctx = libcrypto.EVP_CIPHER_CTX_new()
@@ -97,25 +130,50 @@ class CtypesCrypto(object):
             self.clean()
             raise Exception('can not initialize cipher context')
 
+    def reset(self, iv):
+        # restart with new iv, keep cipher, key and op of the context.
+        r = libcrypto.EVP_CipherInit_ex(self._ctx, None, None,
+                                        c_char_p(self._key), c_char_p(iv), c_int(-1))
+        if not r:
+            raise Exception('can not reset cipher context')
+
     def update(self, data):
-        global buf_size, buf
-        cipher_out_len = c_long(0)
         l = len(data)
-        if buf_size < l:
-            buf_size = l * 2
-            buf = create_string_buffer(buf_size)
-        libcrypto.EVP_CipherUpdate(self._ctx, byref(buf),
-                                   byref(cipher_out_len), c_char_p(data), l)
-        # buf is copied to a str object when we access buf.raw
-        return buf.raw[:cipher_out_len.value]
+        if self._buf_size < l:
+            self._buf_size = max(l, buf_size)
+            self._buf = create_string_buffer(self._buf_size)
+        out_len = self._update(data, self._buf)
+        return string_at(self._buf, out_len)
+
+    def update_into(self, data, out):
+        # data: str, bytearray or memoryview
+        # out:  writable buffer, bytearray or memoryview of it, size >= len(data)
+        out_view = get_buffer(out, PyBUF_WRITABLE)
+        try:
+            if out_view.len < len(data):
+                raise ValueError('output buffer too small')
+            return self._update(data, out_view.buf)
+        finally:
+            PyBuffer_Release(byref(out_view))
+
+    def _update(self, data, out_ptr):
+        cipher_out_len = c_long(0)
+        in_view = get_buffer(data)
+        try:
+            libcrypto.EVP_CipherUpdate(self._ctx, out_ptr,
+                                       byref(cipher_out_len), in_view.buf, in_view.len)
+        finally:
+            PyBuffer_Release(byref(in_view))
+        return cipher_out_len.value
 
     def __del__(self):
         self.clean()
 
     def clean(self):
         if self._ctx:
-            libcrypto.EVP_CIPHER_CTX_cleanup(self._ctx)
+            cipher_ctx_cleanup(self._ctx)
             libcrypto.EVP_CIPHER_CTX_free(self._ctx)
+            self._ctx = None
 
 
 ciphers = {
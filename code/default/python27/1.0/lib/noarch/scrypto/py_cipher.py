@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Pure python fallback for hosts without PyCrypto, M2Crypto or libcrypto.
+
+xor_str: xor of two equal length buffers,
+    by numpy if available, else by one long integer xor, not byte by byte.
+
+RC4Cipher: RC4 with keystream generated in blocks.
+    Keystream prefix of a key is shared, so ciphers created again and again
+    with the same key, like RC4Cipher(password) for every request,
+    only xor the data.
+"""
+
+from __future__ import absolute_import, division, print_function, \
+    with_statement
+
+import threading
+from binascii import hexlify, unhexlify
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+__all__ = ['xor_str', 'RC4Cipher']
+
+BLOCK_SIZE = 65536
+# keystream length shared by ciphers of the same key, must be multiple of BLOCK_SIZE.
+SHARED_STREAM_SIZE = 16 * BLOCK_SIZE
+MAX_SHARED_STREAMS = 16
+
+shared_streams = {}
+shared_streams_lock = threading.Lock()
+
+
+def xor_str(a, b):
+    # a, b: str, bytearray or memoryview of the same length
+    if not len(a):
+        return b''
+
+    if numpy:
+        ab = numpy.frombuffer(a, dtype=numpy.uint8)
+        bb = numpy.frombuffer(b, dtype=numpy.uint8)
+        return numpy.bitwise_xor(ab, bb).tostring()
+
+    # parsing and formatting of hex string are linear for long,
+    # the xor itself run on machine words.
+    r = int(hexlify(a), 16) ^ int(hexlify(b), 16)
+    return unhexlify('%0*x' % (len(a) * 2, r))
+
+
+class KeyStream(object):
+    def __init__(self, key=None):
+        self.box = box = list(range(256))
+        self.x = 0
+        self.y = 0
+        if key is None:
+            return
+
+        key = bytearray(key)
+        key_len = len(key)
+        j = 0
+        for i in range(256):
+            j = (j + box[i] + key[i % key_len]) & 0xff
+            box[i], box[j] = box[j], box[i]
+
+    def copy(self):
+        stream = KeyStream()
+        stream.box = list(self.box)
+        stream.x = self.x
+        stream.y = self.y
+        return stream
+
+    def generate(self, size):
+        box = self.box
+        x = self.x
+        y = self.y
+        out = bytearray(size)
+        for i in range(size):
+            x = (x + 1) & 0xff
+            a = box[x]
+            y = (y + a) & 0xff
+            b = box[y]
+            box[x] = b
+            box[y] = a
+            out[i] = box[(a + b) & 0xff]
+        self.x = x
+        self.y = y
+        return bytes(out)
+
+
+class SharedKeyStream(object):
+    # the first SHARED_STREAM_SIZE bytes of keystream of a key.
+    def __init__(self, key):
+        self.lock = threading.Lock()
+        self.generator = KeyStream(key)
+        self.data = b''
+
+    def get(self, end):
+        end = min(end, SHARED_STREAM_SIZE)
+        data = self.data
+        if len(data) >= end:
+            return data
+
+        with self.lock:
+            blocks = [self.data]
+            size = len(self.data)
+            while size < end:
+                blocks.append(self.generator.generate(BLOCK_SIZE))
+                size += BLOCK_SIZE
+            self.data = b''.join(blocks)
+            return self.data
+
+    def copy_end(self):
+        # generator continue after the shared part.
+        self.get(SHARED_STREAM_SIZE)
+        with self.lock:
+            return self.generator.copy()
+
+
+def get_shared_stream(key):
+    with shared_streams_lock:
+        stream = shared_streams.get(key)
+        if stream is None:
+            if len(shared_streams) >= MAX_SHARED_STREAMS:
+                shared_streams.clear()
+            stream = shared_streams[key] = SharedKeyStream(key)
+        return stream
+
+
+class RC4Cipher(object):
+    def __init__(self, key, share_stream=True):
+        # share_stream=False for one time keys, like rc4-md5.
+        self._pos = 0
+        if share_stream:
+            self._shared = get_shared_stream(bytes(key))
+            self._stream = None
+        else:
+            self._shared = None
+            self._stream = KeyStream(key)
+
+    def encrypt(self, data):
+        size = len(data)
+        start = self._pos
+        end = start + size
+        self._pos = end
+
+        if self._shared is None:
+            keystream = self._stream.generate(size)
+        elif end <= SHARED_STREAM_SIZE:
+            keystream = self._shared.get(end)[start:end]
+        else:
+            parts = []
+            if start < SHARED_STREAM_SIZE:
+                parts.append(self._shared.get(SHARED_STREAM_SIZE)[start:])
+            if self._stream is None:
+                self._stream = self._shared.copy_end()
+            parts.append(self._stream.generate(end - max(start, SHARED_STREAM_SIZE)))
+            keystream = b''.join(parts)
+
+        return xor_str(data, keystream)
+
+    decrypt = encrypt
+    update = encrypt
+
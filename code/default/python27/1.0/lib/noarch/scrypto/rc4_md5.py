@@ -37,13 +37,19 @@ def create_cipher(alg, key, iv, op, key_as_bytes=0, d=None, salt=None,
     rc4_key = md5.digest()
 
     try:
-        from crypto import ctypes_openssl
+        from scrypto import ctypes_openssl
         return ctypes_openssl.CtypesCrypto(b'rc4', rc4_key, b'', op)
     except:
+        pass
+
+    try:
         import M2Crypto.EVP
         return M2Crypto.EVP.Cipher(b'rc4', rc4_key, b'', op,
                                    key_as_bytes=0, d='md5', salt=None, i=1,
                                    padding=1)
+    except ImportError:
+        from scrypto import py_cipher
+        return py_cipher.RC4Cipher(rc4_key, share_stream=False)
 
 
 ciphers = {
@@ -27,6 +27,8 @@ import struct
 import xlog
 import sys
 
+from scrypto import py_cipher
+
 slow_xor = False
 imported = False
 
@@ -55,7 +57,7 @@ def run_imports():
 
 def numpy_xor(a, b):
     if slow_xor:
-        return py_xor_str(a, b)
+        return py_cipher.xor_str(a, b)
     dtype = numpy.byte
     if len(a) % 4 == 0:
         dtype = numpy.uint32
@@ -69,18 +71,6 @@ def numpy_xor(a, b):
     return r
 
 
-def py_xor_str(a, b):
-    c = []
-    if bytes == str:
-        for i in range(0, len(a)):
-            c.append(chr(ord(a[i]) ^ ord(b[i])))
-        return ''.join(c)
-    else:
-        for i in range(0, len(a)):
-            c.append(a[i] ^ b[i])
-        return bytes(c)
-
-
 class Salsa20Cipher(object):
     """a salsa20 CTR implemetation, provides m2crypto like cipher API"""
 
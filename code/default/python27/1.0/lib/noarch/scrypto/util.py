@@ -49,3 +49,66 @@ def run_cipher(cipher, decipher):
     end = time.time()
     print('speed: %d bytes/s' % (BLOCK_SIZE * rounds / (end - start)))
     assert b''.join(results) == plain
+
+
+def bench_methods(methods, size=1024 * 1024):
+    # speed of every method in encrypt.method_supported,
+    # methods not usable on this host are reported and skipped.
+    from os import urandom
+    import time
+
+    plain = urandom(size)
+    for method in sorted(methods):
+        key_len, iv_len, create_cipher = methods[method]
+        key = b'k' * (key_len or 16)
+        iv = b'i' * iv_len
+        try:
+            cipher = create_cipher(method, key, iv, 1)
+            decipher = create_cipher(method, key, iv, 0)
+        except (Exception, SystemExit) as e:
+            print('%-20s not available: %r' % (method, e))
+            continue
+
+        start = time.time()
+        c = cipher.update(plain)
+        p = decipher.update(c)
+        cost = time.time() - start
+        assert p == plain
+        print('%-20s %8.2f MB/s' % (method, 2 * size / cost / 1024 / 1024))
+
+
+def bench_message_cipher(cipher_class, methods, message_sizes=(1024, 64 * 1024), total_size=8 * 1024 * 1024):
+    # speed of encrypt.MessageCipher, the path of x_tunnel messages:
+    # encrypt_buffers of 16KB pieces and decrypt_into a reused buffer, context reused per thread.
+    from os import urandom
+    import time
+
+    for method in sorted(methods):
+        try:
+            message_cipher = cipher_class(b'password', method)
+            message_cipher.encrypt_buffers([b'test'])
+        except (Exception, SystemExit) as e:
+            print('%-20s not available: %r' % (method, e))
+            continue
+
+        for message_size in message_sizes:
+            plain = urandom(message_size)
+            pieces = [plain[i:i + 16384] for i in range(0, message_size, 16384)]
+            out = bytearray(message_size)
+            message_num = max(1, total_size // message_size)
+
+            start = time.time()
+            for _ in range(message_num):
+                data = message_cipher.encrypt_buffers(pieces)
+            encrypt_cost = time.time() - start
+
+            data = memoryview(data)
+            start = time.time()
+            for _ in range(message_num):
+                message_cipher.decrypt_into(data, out)
+            decrypt_cost = time.time() - start
+            assert bytes(out) == plain
+
+            size = message_num * message_size / 1024 / 1024
+            print('%-20s %6dB encrypt %8.2f MB/s decrypt %8.2f MB/s' % (
+                method, message_size, size / encrypt_cost, size / decrypt_cost))
@@ -1,74 +1,119 @@
-import time
+import bisect
+import heapq
+import itertools
+import select
+import socket
 import threading
-import sys
+import time
 
 
 # This simple Queue fix the performance problem in the system build-in Queue.
 # Every get with time out will run in thread sleep check sleep check...
 # cost too many CPU and delay queue response.
 
-# This solution will run a thread to check timeout, default is 0.1 second.
+# This solution keep time out of all waiters in one heap,
+# a thread sleep by select until the nearest one, then wake the waiter.
 # And message send queue with no delay, use thread lock/release.
 
 
-list_lock = threading.Lock()
-th_lock = threading.Lock()
-queue_list = []
+timer_lock = threading.Lock()
+# (end_time, seq, queue, waiter), waiter notified before time out is left in heap,
+# it's seq is put in cancelled_seqs and the entry dropped when popped.
+timer_heap = []
+cancelled_seqs = set()
 timer_th = None
+wake_socks = None
+
+waiter_seq = itertools.count()
 
-timeout_interval = 0.1
-# User can change  timeout_interval to bigger to reduce CPU load.
+
+def socketpair():
+    if hasattr(socket, "socketpair"):
+        return socket.socketpair()
+
+    # python 2 on windows has no socketpair.
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    sock_w = socket.create_connection(listener.getsockname())
+    sock_r, _ = listener.accept()
+    listener.close()
+    return sock_r, sock_w
 
 
 def timer_thread():
     global timer_th
+    sock_r = wake_socks[0]
     while True:
-        with list_lock:
-            to_del = []
-            wait_count = 0
-            for q in queue_list:
-                wait_count += q.check()
-
-                c = sys.getrefcount(q)
-                # print(c, id(q))
-                if c <= 3:
-                    # reference of object, less then 3 means no out side use.
-                    to_del.append(q)
-
-            for q in to_del:
-                # print("del queue")
-                queue_list.remove(q)
-
-            if wait_count == 0:
+        time_now = time.time()
+        timeout_list = []
+        with timer_lock:
+            while timer_heap and timer_heap[0][0] <= time_now:
+                item = heapq.heappop(timer_heap)
+                if item[1] in cancelled_seqs:
+                    cancelled_seqs.remove(item[1])
+                    continue
+                timeout_list.append(item)
+
+            if not timer_heap and not timeout_list:
+                timer_th = None
                 break
 
-        time.sleep(timeout_interval)
+            if timer_heap:
+                sleep_time = timer_heap[0][0] - time_now
+            else:
+                sleep_time = 0
+
+        for end_time, seq, q, waiter in timeout_list:
+            q.timeout(waiter)
 
-    with th_lock:
-        timer_th = None
+        if sleep_time:
+            r, w, e = select.select([sock_r], [], [], sleep_time)
+            if r:
+                sock_r.recv(4096)
     # print("simple queue timer exit")
 
 
-def _add_queue(qq):
-    with list_lock:
-        queue_list.append(qq)
-
+def _add_timer(q, waiter):
+    global timer_th, wake_socks
+    with timer_lock:
+        heapq.heappush(timer_heap, (waiter[0], waiter[1], q, waiter))
 
-def _add_wait():
-    global timer_th
-    with th_lock:
         if not timer_th:
+            if not wake_socks:
+                wake_socks = socketpair()
+                wake_socks[0].setblocking(0)
+                wake_socks[1].setblocking(0)
             timer_th = threading.Thread(target=timer_thread)
+            timer_th.daemon = True
             timer_th.start()
+        elif timer_heap[0][3] is waiter:
+            # wake timer thread to sleep less.
+            try:
+                wake_socks[1].send(b"w")
+            except socket.error:
+                # buffer full, timer thread will wake anyway.
+                pass
+
+
+def _cancel_timer(waiter):
+    with timer_lock:
+        cancelled_seqs.add(waiter[1])
+
+        # rebuild heap if most of it is cancelled, keep it small.
+        if len(cancelled_seqs) > 64 and len(cancelled_seqs) * 2 > len(timer_heap):
+            timer_heap[:] = [item for item in timer_heap if item[1] not in cancelled_seqs]
+            heapq.heapify(timer_heap)
+            cancelled_seqs.clear()
 
 
 class Queue(object):
     def __init__(self):
         self.lock = threading.Lock()
         self.queue = []
+        # (end_time, seq, lock), sorted by end_time.
         self.waiters = []
         self.running = True
-        _add_queue(self)
 
     def __sizeof__(self):
         return len(self.queue)
@@ -79,18 +124,6 @@ class Queue(object):
         self.notify_all()
         self.running = True
 
-    def check(self):
-        if not self.waiters:
-            return 0
-
-        try:
-            if time.time() > self.waiters[0][0]:
-                self.notify()
-        except:
-            pass
-
-        return 1
-
     def put(self, item):
         with self.lock:
             self.queue.append(item)
@@ -124,38 +157,34 @@ class Queue(object):
             return
 
         try:
-            end_time, lock = self.waiters.pop(0)
-            lock.release()
+            waiter = self.waiters.pop(0)
+            waiter[2].release()
+            if waiter[0] is not None:
+                _cancel_timer(waiter)
         except:
             pass
 
+    def timeout(self, waiter):
+        # called by timer thread.
+        with self.lock:
+            try:
+                self.waiters.remove(waiter)
+            except ValueError:
+                # notified before time out.
+                return
+
+        waiter[2].release()
+
     def wait(self, end_time):
         with self.lock:
             lock = threading.Lock()
             lock.acquire()
 
-            if len(self.waiters) == 0:
-                self.waiters.append((end_time, lock))
-            else:
-                is_max = True
-                for i in range(0, len(self.waiters)):
-                    try:
-                        iend_time, ilock = self.waiters[i]
-                        if iend_time > end_time:
-                            is_max = False
-                            break
-                    except Exception as e:
-                        if i >= len(self.waiters):
-                            break
-                        #xlog.warn("get %d from size:%d fail.", i, len(self.waiters))
-                        continue
-
-                if is_max:
-                    self.waiters.append((end_time, lock))
-                else:
-                    self.waiters.insert(i, (end_time, lock))
+            waiter = (end_time, next(waiter_seq), lock)
+            bisect.insort(self.waiters, waiter)
 
-            _add_wait()
+        if end_time is not None:
+            _add_timer(self, waiter)
 
         lock.acquire()
 
@@ -0,0 +1,102 @@
+#!/usr/bin/env python2
+# coding:utf-8
+
+# benchmark simple_queue wake latency and cpu with 10k queues alive.
+
+import os
+import sys
+import time
+import random
+import threading
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(current_path)
+
+import simple_queue
+from xlog import getLogger
+xlog = getLogger("simple_queue_test")
+
+
+queue_num = 10000
+waiter_num = 2000
+
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def percentile(values, n):
+    values = sorted(values)
+    return values[len(values) * n / 100] * 1000
+
+
+def test_timeout(queues):
+    # time out later than asked, waiters spread over all queues.
+    lateness = []
+    lock = threading.Lock()
+
+    def waiter(q, timeout):
+        start_time = time.time()
+        q.get(timeout)
+        late = time.time() - start_time - timeout
+        with lock:
+            lateness.append(late)
+
+    start_cpu = cpu_time()
+    start_time = time.time()
+    threads = []
+    for i in range(waiter_num):
+        th = threading.Thread(target=waiter, args=(random.choice(queues), random.uniform(0.05, 1.0)))
+        th.start()
+        threads.append(th)
+    for th in threads:
+        th.join()
+
+    xlog.info("timeout queues:%d waiters:%d late p50:%.1fms p99:%.1fms cpu:%.2fs time:%.2fs",
+              queue_num, waiter_num, percentile(lateness, 50), percentile(lateness, 99),
+              cpu_time() - start_cpu, time.time() - start_time)
+
+
+def test_put(queues):
+    # time from put to the waiting get return.
+    latency = []
+    lock = threading.Lock()
+
+    def waiter(q):
+        item = q.get(10)
+        with lock:
+            latency.append(time.time() - item)
+
+    start_cpu = cpu_time()
+    start_time = time.time()
+    chosen = random.sample(queues, waiter_num)
+    threads = []
+    for q in chosen:
+        th = threading.Thread(target=waiter, args=(q,))
+        th.start()
+        threads.append(th)
+    time.sleep(0.5)
+    for q in chosen:
+        q.put(time.time())
+    for th in threads:
+        th.join()
+
+    xlog.info("put queues:%d waiters:%d wake p50:%.1fms p99:%.1fms cpu:%.2fs time:%.2fs",
+              queue_num, waiter_num, percentile(latency, 50), percentile(latency, 99),
+              cpu_time() - start_cpu, time.time() - start_time)
+
+
+def test_idle(queues, timeout=5):
+    # cpu used in timeout with only one waiter.
+    start_cpu = cpu_time()
+    queues[0].get(timeout)
+    xlog.info("idle queues:%d one waiter %ds cpu:%.3fs", queue_num, timeout, cpu_time() - start_cpu)
+
+
+if __name__ == '__main__':
+    random.seed(1)
+    queues = [simple_queue.Queue() for _ in range(queue_num)]
+    test_timeout(queues)
+    test_put(queues)
+    test_idle(queues)
@@ -3,6 +3,7 @@
 
 import re
 import os
+import sys
 import threading
 
 g_ip_check = re.compile(r'^(\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})$')
@@ -218,5 +219,24 @@ def is_private_ip(ip):
         return False
 
 
+def replace_file(src_path, dst_path):
+    # replace dst by src in one step, a crash leave the old or the new file.
+    if sys.platform != "win32":
+        os.rename(src_path, dst_path)
+        return
+
+    # os.rename can't overwrite on windows, remove then rename is not atomic.
+    import ctypes
+    MOVEFILE_REPLACE_EXISTING = 0x1
+    MOVEFILE_WRITE_THROUGH = 0x8
+    if isinstance(src_path, str):
+        src_path = src_path.decode(sys.getfilesystemencoding())
+    if isinstance(dst_path, str):
+        dst_path = dst_path.decode(sys.getfilesystemencoding())
+    if not ctypes.windll.kernel32.MoveFileExW(src_path, dst_path,
+                                              MOVEFILE_REPLACE_EXISTING | MOVEFILE_WRITE_THROUGH):
+        raise ctypes.WinError()
+
+
 if __name__ == '__main__':
     print(is_private_ip("fa00::1"))
\ No newline at end of file
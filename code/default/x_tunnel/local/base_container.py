@@ -1,10 +1,13 @@
 import threading
 import time
 import socket
+import errno
+import collections
 import xstruct as struct
 import select
 
 import utils
+import simple_queue
 
 from xlog import getLogger
 xlog = getLogger("x_tunnel")
@@ -276,7 +279,8 @@ class BlockReceivePool():
     def reset(self):
         # xlog.info("recv_pool reset")
         self.next_sn = 1
-        self.block_list = []
+        # sn received out of order, set for O(1) lookup and remove.
+        self.block_list = set()
 
     def put(self, sn, data):
         self.lock.acquire()
@@ -290,7 +294,7 @@ class BlockReceivePool():
                     # xlog.warn("recv_pool put sn:%d exist", sn)
                     return False
                 else:
-                    self.block_list.append(sn)
+                    self.block_list.add(sn)
                     self.process_callback(data)
                     return True
             else:
@@ -309,6 +313,11 @@ class BlockReceivePool():
         finally:
             self.lock.release()
 
+    def get_ack(self):
+        # return continue received sn and sn list received out of order.
+        with self.lock:
+            return self.next_sn - 1, list(self.block_list)
+
     def status(self):
         out_string = "Block_receive_pool:<br>\r\n"
         out_string += " next_sn:%d<br>\r\n" % self.next_sn
@@ -318,6 +327,224 @@ class BlockReceivePool():
         return out_string
 
 
+class RttEstimator(object):
+    # smoothed rtt and retransmission timeout like RFC 6298, in seconds.
+    def __init__(self, min_rto, max_rto, extra_delay=0):
+        self.min_rto = min_rto
+        self.max_rto = max_rto
+        # delay of ack not counted in rtt sample, like ack_delay of the peer.
+        self.extra_delay = extra_delay
+        self.srtt = 0
+        self.rttvar = 0
+        self.rto = max_rto
+        self.last_update = 0
+
+    def update(self, rtt):
+        if not self.last_update:
+            self.srtt = rtt
+            self.rttvar = rtt / 2.0
+        else:
+            self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+            self.srtt = 0.875 * self.srtt + 0.125 * rtt
+
+        rto = self.srtt + 4 * self.rttvar + self.extra_delay
+        self.rto = max(self.min_rto, min(self.max_rto, rto))
+        self.last_update = time.time()
+
+
+class ConnLoop(object):
+    # One thread serves sockets of many Conn:
+    # read when readable, write buffered data when writable.
+    # Other threads only change the wanted events and wake the loop.
+    # select on windows is limited to 512 sockets, use more loops for more sockets.
+    max_socks = 0 if hasattr(select, "poll") else 500
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # sock => [conn, want_read, want_write]
+        self.socks = {}
+        # sock changed since last poll
+        self.changed = set()
+        # sock removed, closed by loop thread after unregister.
+        self.closing = []
+        self.wake_r, self.wake_w = simple_queue.socketpair()
+        self.wake_r.setblocking(0)
+        self.wake_w.setblocking(0)
+
+        self.th = threading.Thread(target=self.run)
+        self.th.daemon = True
+        self.th.start()
+
+    def is_full(self):
+        return self.max_socks and len(self.socks) >= self.max_socks
+
+    def add(self, conn, sock):
+        with self.lock:
+            self.socks[sock] = [conn, True, False]
+            self.changed.add(sock)
+        self.wake()
+
+    def remove(self, sock):
+        with self.lock:
+            if sock in self.socks:
+                del self.socks[sock]
+                self.changed.add(sock)
+            self.closing.append(sock)
+        self.wake()
+
+    def close_removed(self):
+        # called with lock
+        for sock in self.closing:
+            sock.close()
+        self.closing = []
+
+    def set_events(self, sock, read=None, write=None):
+        with self.lock:
+            info = self.socks.get(sock)
+            if not info:
+                return
+            if read is not None:
+                info[1] = read
+            if write is not None:
+                info[2] = write
+            self.changed.add(sock)
+        self.wake()
+
+    def wake(self):
+        if threading.current_thread() is self.th:
+            return
+        try:
+            self.wake_w.send(b"w")
+        except socket.error:
+            # buffer full, loop will wake anyway.
+            pass
+
+    def run(self):
+        if self.max_socks:
+            poll = self.select
+        else:
+            poll = self.poll_loop().next
+
+        while True:
+            try:
+                events = poll()
+            except Exception as e:
+                xlog.exception("ConnLoop poll:%r", e)
+                self.remove_bad_socks()
+                if not self.max_socks:
+                    # generator is finished by the exception, register all again.
+                    poll = self.poll_loop().next
+                continue
+
+            for sock, readable, writable in events:
+                if sock is self.wake_r:
+                    try:
+                        while self.wake_r.recv(4096):
+                            pass
+                    except socket.error:
+                        pass
+                    continue
+
+                info = self.socks.get(sock)
+                if not info:
+                    continue
+                conn = info[0]
+                try:
+                    if writable:
+                        conn.on_writable()
+                    if readable:
+                        conn.on_readable()
+                except Exception as e:
+                    xlog.exception("ConnLoop conn:%d event:%r", conn.conn_id, e)
+
+    def select(self):
+        with self.lock:
+            self.changed.clear()
+            self.close_removed()
+            rlist = [self.wake_r]
+            wlist = []
+            for sock, (conn, want_read, want_write) in self.socks.items():
+                if want_read:
+                    rlist.append(sock)
+                if want_write:
+                    wlist.append(sock)
+
+        r, w, _ = select.select(rlist, wlist, [], 60)
+        events = [(sock, True, sock in w) for sock in r]
+        events.extend((sock, False, True) for sock in w if sock not in r)
+        return events
+
+    def poll_loop(self):
+        poller = select.poll()
+        poller.register(self.wake_r.fileno(), select.POLLIN)
+        registered = {}  # fileno => sock
+        fd_of_sock = {}
+        while True:
+            with self.lock:
+                # unregister all before register, fileno of a closed sock may be reused.
+                for sock in self.changed:
+                    fd = fd_of_sock.pop(sock, None)
+                    if fd is not None and registered.get(fd) is sock:
+                        poller.unregister(fd)
+                        del registered[fd]
+                self.close_removed()
+
+                for sock in self.changed:
+                    info = self.socks.get(sock)
+                    if not info:
+                        continue
+
+                    fd = sock.fileno()
+                    mask = (select.POLLIN if info[1] else 0) | (select.POLLOUT if info[2] else 0)
+                    poller.register(fd, mask)
+                    registered[fd] = sock
+                    fd_of_sock[sock] = fd
+                self.changed.clear()
+
+            events = []
+            for fd, event in poller.poll(60 * 1000):
+                if fd == self.wake_r.fileno():
+                    events.append((self.wake_r, True, False))
+                    continue
+                sock = registered.get(fd)
+                if sock is None:
+                    continue
+                # error and hangup are handled by recv/send of conn.
+                readable = bool(event & (select.POLLIN | select.POLLERR | select.POLLHUP | select.POLLNVAL))
+                writable = bool(event & select.POLLOUT)
+                events.append((sock, readable, writable))
+            yield events
+
+    def remove_bad_socks(self):
+        with self.lock:
+            for sock in self.socks.keys():
+                try:
+                    # closed socket raise EBADF
+                    sock.fileno()
+                except Exception:
+                    del self.socks[sock]
+            self.changed = set(self.socks)
+        time.sleep(0.1)
+
+
+conn_loops = []
+conn_loops_lock = threading.Lock()
+
+# seconds to send buffered data to the sock after Conn stopped.
+conn_drain_timeout = 30
+
+
+def get_conn_loop():
+    with conn_loops_lock:
+        for loop in conn_loops:
+            if not loop.is_full():
+                return loop
+
+        loop = ConnLoop()
+        conn_loops.append(loop)
+        return loop
+
+
 class Conn(object):
     def __init__(self, session, conn_id, sock, host, port, windows_size, windows_ack, is_client, xlog):
         # xlog.info("session:%s Conn:%d host:%s port:%d", session.session_id, conn_id, host, port)
@@ -338,10 +565,21 @@ class Conn(object):
         self.remote_acked_position = 0
         self.sended_position = 0
         self.sended_window_position = 0
-        self.recv_thread = None
-        self.cmd_thread = None
         self.xlog = xlog
 
+        # sock is served by ConnLoop, no thread for every Conn.
+        self.loop = None
+        self.started = False
+        # a thread is running commands of this conn.
+        self.cmd_running = False
+        self.recv_paused = False
+        self.send_buffer = collections.deque()
+        self.send_lock = threading.Lock()
+        self.send_waiting = False
+        self.stop_reason = None
+        self.stopped = threading.Event()
+        self.drain_timer = None
+
         self.transfered_close_to_peer = False
         if sock:
             self.next_cmd_seq = 1
@@ -351,18 +589,22 @@ class Conn(object):
         self.next_recv_seq = 1
 
     def start(self, block):
+        # block: wait until the conn stopped.
         if self.sock:
-            self.recv_thread = threading.Thread(target=self.recv_worker)
-            self.recv_thread.start()
-        else:
-            self.recv_thread = None
+            self.attach_sock(self.sock)
+
+        with self.cmd_notice:
+            self.started = True
+        self.run_cmds()
 
         if block:
-            self.cmd_thread = None
-            self.cmd_processor()
-        else:
-            self.cmd_thread = threading.Thread(target=self.cmd_processor)
-            self.cmd_thread.start()
+            while not self.stopped.is_set():
+                self.stopped.wait(10)
+
+    def attach_sock(self, sock):
+        sock.setblocking(0)
+        self.loop = get_conn_loop()
+        self.loop.add(self, sock)
 
     def status(self):
         out_string = "Conn[%d]: %s:%d<br>\r\n" % (self.conn_id, self.host, self.port)
@@ -373,6 +615,7 @@ class Conn(object):
         out_string += " status: running:%r<br>\n" % self.running
         out_string += " transfered_close_to_peer:%r<br>\n" % self.transfered_close_to_peer
         out_string += " sock:%r<br>\n" % (self.sock is not None)
+        out_string += " recv_paused:%r send_buffer:%d<br>\n" % (self.recv_paused, len(self.send_buffer))
         out_string += " cmd_queue.len:%d " % len(self.cmd_queue)
         for seq in self.cmd_queue:
             out_string += "[%d]," % seq
@@ -381,37 +624,57 @@ class Conn(object):
         return out_string
 
     def stop(self, reason=""):
-        self.stop_thread = threading.Thread(target=self.do_stop, args=(reason,))
-        self.stop_thread.start()
+        self.do_stop(reason)
 
     def do_stop(self, reason="unknown"):
+        with self.cmd_notice:
+            if self.stop_reason is not None:
+                return
+            self.stop_reason = reason
+            self.running = False
+            self.cmd_notice.notify()
+
         self.xlog.debug("Conn session:%s conn:%d stop:%s", self.session.session_id, self.conn_id, reason)
-        self.running = False
 
-        self.cmd_notice.acquire()
-        self.cmd_notice.notify()
-        self.cmd_notice.release()
+        # data from peer is sent to sock before close.
+        with self.send_lock:
+            if self.send_buffer and self.sock:
+                # local peer may never be writable again.
+                self.drain_timer = threading.Timer(conn_drain_timeout, self.finish_stop)
+                self.drain_timer.daemon = True
+                self.drain_timer.start()
+                return
 
-        self.recv_notice.acquire()
-        self.recv_notice.notify()
-        self.recv_notice.release()
+        self.finish_stop()
 
-        if self.recv_thread:
-            self.recv_thread.join()
-            self.recv_thread = None
-        if self.cmd_thread:
-            self.cmd_thread.join()
-            self.cmd_thread = None
+    def finish_stop(self):
+        with self.cmd_notice:
+            if self.stopped.is_set():
+                return
+            self.stopped.set()
 
+        if self.drain_timer:
+            self.drain_timer.cancel()
         self.cmd_queue = {}
-
-        if self.sock is not None:
-            self.sock.close()
-            self.sock = None
+        self.close_sock()
 
         # xlog.debug("Conn session:%s conn:%d stopped", self.session.session_id, self.conn_id)
         self.session.remove_conn(self.conn_id)
 
+    def close_sock(self):
+        with self.send_lock:
+            sock = self.sock
+            self.sock = None
+            self.send_buffer.clear()
+        if sock is None:
+            return
+
+        if self.loop:
+            # closed by the loop after it stop watching the sock.
+            self.loop.remove(sock)
+        else:
+            sock.close()
+
     def do_connect(self, host, port):
         self.xlog.info("session_id:%s create_conn %d %s:%d", self.session.session_id, self.conn_id, host, port)
         connect_timeout = 30
@@ -464,108 +727,204 @@ class Conn(object):
 
             self.cmd_queue[seq] = data.get_buf()
 
-            if seq == self.next_cmd_seq:
-                self.cmd_notice.notify()
+            if seq != self.next_cmd_seq:
+                return
+
+        self.run_cmds()
 
     def get_cmd_data(self):
-        self.cmd_notice.acquire()
-        try:
-            while self.running:
-                if self.next_cmd_seq in self.cmd_queue:
-                    payload = self.cmd_queue[self.next_cmd_seq]
-                    del self.cmd_queue[self.next_cmd_seq]
-                    self.next_cmd_seq += 1
-                    #self.xlog.debug("Conn session:%s conn:%d get data len:%d ", self.session.session_id, self.conn_id, len(payload))
-                    return payload
-                else:
-                    self.cmd_notice.wait()
-        finally:
-            self.cmd_notice.release()
-        return False
+        # next command in order, or None and leave cmd_running.
+        with self.cmd_notice:
+            if self.running and self.started and self.next_cmd_seq in self.cmd_queue:
+                payload = self.cmd_queue.pop(self.next_cmd_seq)
+                self.next_cmd_seq += 1
+                #self.xlog.debug("Conn session:%s conn:%d get data len:%d ", self.session.session_id, self.conn_id, len(payload))
+                return payload
+
+            self.cmd_running = False
+            return None
+
+    def run_cmds(self):
+        # run commands in the caller thread, only one thread at a time for a conn.
+        with self.cmd_notice:
+            if self.cmd_running:
+                return
+            self.cmd_running = True
 
-    def cmd_processor(self):
-        while self.running:
+        while True:
             data = self.get_cmd_data()
-            if not data:
-                break
+            if data is None:
+                return
 
-            cmd_id = struct.unpack("<B", data.get(1))[0]
-            if cmd_id == 1:  # data
-                self.send_to_sock(data)
+            try:
+                if self.process_cmd(data) is False:
+                    # cmd_running is left to the thread of process_cmd.
+                    return
+            except Exception as e:
+                self.xlog.exception("Conn session:%s conn:%d process cmd:%r", self.session.session_id, self.conn_id, e)
+                with self.cmd_notice:
+                    self.cmd_running = False
+                self.stop("cmd error")
+                return
+
+    def process_cmd(self, data):
+        cmd_id = struct.unpack("<B", data.get(1))[0]
+        if cmd_id == 1:  # data
+            self.send_to_sock(data)
 
-            elif cmd_id == 3:  # ack:
-                position = struct.unpack("<Q", data.get(8))[0]
-                self.xlog.debug("Conn session:%s conn:%d ACK:%d", self.session.session_id, self.conn_id, position)
-                if position > self.remote_acked_position:
+        elif cmd_id == 3:  # ack:
+            position = struct.unpack("<Q", data.get(8))[0]
+            self.xlog.debug("Conn session:%s conn:%d ACK:%d", self.session.session_id, self.conn_id, position)
+            if position > self.remote_acked_position:
+                with self.recv_notice:
                     self.remote_acked_position = position
-                    self.recv_notice.acquire()
-                    self.recv_notice.notify()
-                    self.recv_notice.release()
-
-            elif cmd_id == 2:  # Closed
-                dat = data.get()
-                if isinstance(dat, memoryview):
-                    dat = dat.tobytes()
-                self.xlog.debug("Conn session:%s conn:%d Peer Close:%s", self.session.session_id, self.conn_id, dat)
-                if self.is_client:
-                    self.transfer_peer_close("finish")
-                self.stop("peer close")
-
-            elif cmd_id == 0:  # Create connect
-                if self.port or len(self.host) or self.next_cmd_seq != 1 or self.sock:
-                    raise Exception("put_send_data %s conn:%d Create but host:%s port:%d next seq:%d" % (
-                        self.session.session_id, self.conn_id,
-                        self.host, self.port, self.next_cmd_seq))
-
-                self.sock_type = struct.unpack("<B", data.get(1))[0]
-                host_len = struct.unpack("<H", data.get(2))[0]
-                self.host = data.get(host_len)
-                self.port = struct.unpack("<H", data.get(2))[0]
-
-                sock, res = self.do_connect(self.host, self.port)
-                if res is False:
-                    self.xlog.debug("Conn session:%s conn:%d %s:%d Create fail", self.session.session_id, self.conn_id,
-                               self.host, self.port)
-                    self.transfer_peer_close("connect fail")
-                else:
-                    self.xlog.info("Conn session:%s conn:%d %s:%d", self.session.session_id, self.conn_id, self.host,
-                              self.port)
-                    self.sock = sock
-                    self.recv_thread = threading.Thread(target=self.recv_worker)
-                    self.recv_thread.start()
-            else:
-                self.xlog.error("Conn session:%s conn:%d unknown cmd_id:%d",
-                                self.session.session_id, self.conn_id, cmd_id)
-                raise Exception("put_send_data unknown cmd_id:%d" % cmd_id)
+                    sock = self.sock
+                    if self.recv_paused and sock and \
+                            self.received_position <= self.remote_acked_position + self.windows_size:
+                        self.recv_paused = False
+                        self.loop.set_events(sock, read=True)
+
+        elif cmd_id == 2:  # Closed
+            dat = data.get()
+            if isinstance(dat, memoryview):
+                dat = dat.tobytes()
+            self.xlog.debug("Conn session:%s conn:%d Peer Close:%s", self.session.session_id, self.conn_id, dat)
+            if self.is_client:
+                self.transfer_peer_close("finish")
+            self.stop("peer close")
+
+        elif cmd_id == 0:  # Create connect
+            if self.port or len(self.host) or self.next_cmd_seq != 1 or self.sock:
+                raise Exception("put_send_data %s conn:%d Create but host:%s port:%d next seq:%d" % (
+                    self.session.session_id, self.conn_id,
+                    self.host, self.port, self.next_cmd_seq))
+
+            self.sock_type = struct.unpack("<B", data.get(1))[0]
+            host_len = struct.unpack("<H", data.get(2))[0]
+            self.host = data.get(host_len)
+            if isinstance(self.host, memoryview):
+                self.host = self.host.tobytes()
+            self.port = struct.unpack("<H", data.get(2))[0]
+
+            # connect blocks, commands after it wait in cmd_queue until connected.
+            threading.Thread(target=self.create_connect).start()
+            return False
+
+        else:
+            self.xlog.error("Conn session:%s conn:%d unknown cmd_id:%d",
+                            self.session.session_id, self.conn_id, cmd_id)
+            raise Exception("put_send_data unknown cmd_id:%d" % cmd_id)
+
+    def create_connect(self):
+        sock, res = self.do_connect(self.host, self.port)
+        if res is False:
+            self.xlog.debug("Conn session:%s conn:%d %s:%d Create fail", self.session.session_id, self.conn_id,
+                            self.host, self.port)
+            self.transfer_peer_close("connect fail")
+        else:
+            self.xlog.info("Conn session:%s conn:%d %s:%d", self.session.session_id, self.conn_id, self.host,
+                           self.port)
+            self.sock = sock
+            self.attach_sock(sock)
+
+        with self.cmd_notice:
+            self.cmd_running = False
+        self.run_cmds()
 
     def send_to_sock(self, data):
+        with self.send_lock:
+            if not self.sock:
+                return
+            self.send_buffer.append(data.buf[data.begin:data.begin + len(data)])
+        self.flush_send()
+
+    def flush_send(self):
+        # send buffered data without block, wait writable in ConnLoop if sock is busy.
+        # called by ConnLoop and roundtrip threads.
+        sended_len = 0
+        ack_position = None
+        with self.send_lock:
+            sock = self.sock
+            if not sock:
+                return
+
+            try:
+                while self.send_buffer:
+                    buf = self.send_buffer[0]
+                    sended = sock.send(buf[:65535])
+                    sended_len += sended
+                    if sended < len(buf):
+                        self.send_buffer[0] = buf[sended:]
+                    else:
+                        self.send_buffer.popleft()
+            except socket.error as e:
+                if e.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    self.xlog.info("%s conn_id:%d send closed", self.session.session_id, self.conn_id)
+                    self.send_buffer.clear()
+                    sock = None
+
+            send_waiting = bool(self.send_buffer)
+            if sock and send_waiting != self.send_waiting:
+                self.send_waiting = send_waiting
+                self.loop.set_events(sock, write=send_waiting)
+
+            if sended_len:
+                self.sended_position += sended_len
+                if self.sended_position - self.sended_window_position > self.windows_ack:
+                    self.sended_window_position = self.sended_position
+                    ack_position = self.sended_position
+
+        if ack_position is not None:
+            # peer ignore ack older than received, order of threads doesn't matter.
+            self.transfer_ack(ack_position)
+            # xlog.debug("Conn:%d ack:%d", self.conn_id, ack_position)
+
+        if sock is None:
+            # send fail
+            self.close_sock()
+            if self.stop_reason is not None:
+                # stopped and waiting for the send buffer.
+                self.finish_stop()
+            elif self.is_client:
+                self.do_stop(reason="send fail.")
+            else:
+                self.transfer_peer_close("send fail")
+                self.do_stop(reason="send fail.")
+        elif self.stop_reason is not None and not send_waiting:
+            self.finish_stop()
+
+    def on_writable(self):
+        self.flush_send()
+
+    def on_readable(self):
         sock = self.sock
         if not sock:
             return
 
-        payload_len = len(data)
-        buf = data.buf
-        start = data.begin
-        end = data.begin + payload_len
-        while start < end:
-            send_size = min(end - start, 65535)
-            try:
-                sended = sock.send(buf[start:start + send_size])
-            except Exception as e:
-                self.xlog.info("%s conn_id:%d send closed", self.session.session_id, self.conn_id)
-                sock.close()
-                self.sock = None
-                if self.is_client:
-                    self.do_stop(reason="send fail.")
+        try:
+            data = sock.recv(65535)
+        except socket.error as e:
+            if e.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
                 return
+            data = ""
 
-            start += sended
+        if len(data) == 0:
+            # xlog.debug("Conn session:%s conn:%d recv socket closed", self.session.session_id, self.conn_id)
+            self.transfer_peer_close("recv closed")
+            if self.is_client:
+                self.do_stop(reason="recv fail.")
+            else:
+                self.close_sock()
+            return
+
+        self.transfer_received_data(data)
+        # xlog.debug("Conn session:%s conn:%d Recv len:%d id:%d", self.session.session_id, self.conn_id, data_len, self.recv_id)
 
-        self.sended_position += payload_len
-        if self.sended_position - self.sended_window_position > self.windows_ack:
-            self.sended_window_position = self.sended_position
-            self.transfer_ack(self.sended_position)
-            # xlog.debug("Conn:%d ack:%d", self.conn_id, self.sended_window_position)
+        with self.recv_notice:
+            if self.received_position > self.remote_acked_position + self.windows_size:
+                # xlog.debug("Conn session:%s conn:%d recv blocked, rcv:%d, ack:%d", self.session.session_id, self.conn_id, self.received_position, self.remote_acked_position)
+                self.recv_paused = True
+                self.loop.set_events(sock, read=False)
 
     def transfer_peer_close(self, reason=""):
         with self.recv_notice:
@@ -603,43 +962,3 @@ class Conn(object):
             cmd_position = struct.pack("<IBQ", self.next_recv_seq, 3, position)
             self.session.send_conn_data(self.conn_id, cmd_position)
             self.next_recv_seq += 1
-
-    def recv_worker(self):
-        sock = self.sock
-        fdset = [sock, ]
-        while self.running:
-
-            self.recv_notice.acquire()
-            try:
-                if self.received_position > self.remote_acked_position + self.windows_size:
-                    # xlog.debug("Conn session:%s conn:%d recv blocked, rcv:%d, ack:%d", self.session.session_id, self.conn_id, self.received_position, self.remote_acked_position)
-                    self.recv_notice.wait()
-                    continue
-            finally:
-                self.recv_notice.release()
-
-            r, w, e = select.select(fdset, [], [], 1)
-            if sock in r:
-                try:
-                    data = sock.recv(65535)
-                except:
-                    data = ""
-
-                data_len = len(data)
-                if data_len == 0:
-                    # xlog.debug("Conn session:%s conn:%d recv socket closed", self.session.session_id, self.conn_id)
-                    self.transfer_peer_close("recv closed")
-
-                    sock.close()
-                    self.sock = None
-
-                    self.recv_thread = None
-                    if self.is_client:
-                        self.do_stop(reason="recv fail.")
-
-                    return
-
-                self.transfer_received_data(data)
-                # xlog.debug("Conn session:%s conn:%d Recv len:%d id:%d", self.session.session_id, self.conn_id, data_len, self.recv_id)
-
-                # xlog.debug("Conn session:%s conn:%d Recv worker stopped", self.session.session_id, self.conn_id)
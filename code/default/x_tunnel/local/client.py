@@ -98,8 +98,12 @@ def load_config():
     config.set_var("send_delay", 30)
 
     # range 1 - 20000, ms
+    # max resend timeout, the real one is estimated by rtt of fronts.
     config.set_var("resend_timeout", 5000)
 
+    # range 1 - resend_timeout, ms
+    config.set_var("min_resend_timeout", 500)
+
     # range 1 - resend_timeout, ms
     config.set_var("ack_delay", 300)
 
@@ -9,15 +9,12 @@ class ConnectCreator(ConnectCreatorBase):
         if not cert_chain:
             raise socket.error(' certificate is none, sni:%s' % ssl_sock.sni)
 
-        self.get_ssl_cert_domain(ssl_sock)
-        issuer_commonname = next((v for k, v in cert_chain[0].get_issuer().get_components() if k == 'CN'), '')
+        info = self.cert_cache.get_info(cert_chain, False, self.config.check_sni)
+        ssl_sock.domain = info.domain
+        issuer_commonname = info.issuer_commonname
         if self.debug:
-            for cert in cert_chain:
-                for k, v in cert.get_issuer().get_components():
-                    if k != "CN":
-                        continue
-                    cn = v
-                    self.logger.debug("cn:%s", cn)
+            for cn in info.issuers:
+                self.logger.debug("cn:%s", cn)
 
             self.logger.debug("issued by:%s", issuer_commonname)
             self.logger.debug("Common Name:%s", ssl_sock.domain)
@@ -28,17 +25,7 @@ class ConnectCreator(ConnectCreatorBase):
         if not self.config.check_sni:
             return True
 
-        cert = ssl_sock.get_peer_certificate()
-        if not cert:
-            raise socket.error('certficate is none')
-
-        # get_subj_alt_name cost near 100ms. be careful.
-        try:
-            alt_names = ConnectCreator.get_subj_alt_name(cert)
-        except Exception as e:
-            # self.logger.warn("get_subj_alt_name fail:%r", e)
-            alt_names = [""]
-
+        alt_names = info.alt_names
         if self.debug:
             self.logger.debug('alt names: "%s"', '", "'.join(alt_names))
 
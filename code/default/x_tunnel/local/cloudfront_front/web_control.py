@@ -63,7 +63,9 @@ class ControlHandler(simple_http_server.HttpServerHandler):
     def req_ip_list_handler(self):
         time_now = time.time()
         data = "<html><body><div  style='float: left; white-space:nowrap;font-family: monospace;'>"
-        data += "time:%d  pointer:%d<br>\r\n" % (time_now, front.ip_manager.ip_pointer)
+        data += "time:%d  ready:%d<br>\r\n" % (time_now, front.ip_manager.ip_index.ready_num())
+        data += "handshake %s<br>\r\n" % front.connect_creator.get_handshake_stat()
+        data += "cert_cache %s<br>\r\n" % front.connect_creator.cert_cache.get_stat()
         data += "<table><tr><th>N</th><th>IP</th><th>HS</th><th>Fails</th>"
         data += "<th>down_fail</th><th>links</th>"
         data += "<th>get_time</th><th>success_time</th><th>fail_time</th><th>down_fail_time</th>"
@@ -0,0 +1,235 @@
+#!/usr/bin/env python2
+# coding:utf-8
+
+# benchmark Conn and ConnLoop with 1000 concurrent tunneled connections:
+# client sock <-> Conn <-> local session <-> Conn <-> local echo server.
+# every client echo 16KB, report time, cpu and peak thread num.
+
+import os
+import sys
+import time
+import socket
+import select
+import threading
+import Queue
+
+current_path = os.path.dirname(os.path.abspath(__file__))
+root_path = os.path.abspath(os.path.join(current_path, os.pardir, os.pardir))
+python_path = os.path.abspath(os.path.join(root_path, 'python27', '1.0'))
+
+sys.path.append(root_path)
+
+noarch_lib = os.path.abspath(os.path.join(python_path, 'lib', 'noarch'))
+sys.path.append(noarch_lib)
+
+if sys.platform == "win32":
+    win32_lib = os.path.abspath(os.path.join(python_path, 'lib', 'win32'))
+    sys.path.append(win32_lib)
+elif sys.platform.startswith("linux"):
+    linux_lib = os.path.abspath(os.path.join(python_path, 'lib', 'linux'))
+    sys.path.append(linux_lib)
+elif sys.platform == "darwin":
+    darwin_lib = os.path.abspath(os.path.join(python_path, 'lib', 'darwin'))
+    sys.path.append(darwin_lib)
+    extra_lib = "/System/Library/Frameworks/Python.framework/Versions/2.7/Extras/lib/python"
+    sys.path.append(extra_lib)
+
+
+import xstruct as struct
+import base_container
+from base_container import ReadBuffer
+from xlog import getLogger
+xlog = getLogger("x_tunnel")
+
+
+conn_num = 1000
+data_size = 16 * 1024
+windows_size = 16 * 1024 * 1024
+time_limit = 120
+
+
+class Logger(object):
+    # Conn log every connection, keep the output for the result.
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+class Session(object):
+    # deliver data to the Conn of peer session, like the roundtrip threads.
+    session_id = "test"
+
+    def __init__(self, thread_num=8):
+        self.queue = Queue.Queue()
+        self.peer = None
+        self.conn_list = {}
+        for i in range(thread_num):
+            th = threading.Thread(target=self.deliver)
+            th.daemon = True
+            th.start()
+
+    def send_conn_data(self, conn_id, data, no_delay=False):
+        self.queue.put((conn_id, str(data)))
+
+    def deliver(self):
+        while True:
+            conn_id, data = self.queue.get()
+            conn = self.peer.conn_list.get(conn_id)
+            if conn:
+                conn.put_cmd_data(ReadBuffer(data))
+
+    def remove_conn(self, conn_id):
+        self.conn_list.pop(conn_id, None)
+
+
+def echo_server(listener):
+    poller = select.poll()
+    poller.register(listener.fileno(), select.POLLIN)
+    socks = {}
+    while True:
+        for fd, event in poller.poll(1000):
+            if fd == listener.fileno():
+                sock, _ = listener.accept()
+                socks[sock.fileno()] = sock
+                poller.register(sock.fileno(), select.POLLIN)
+                continue
+
+            sock = socks[fd]
+            data = sock.recv(65536)
+            if not data:
+                poller.unregister(fd)
+                sock.close()
+                del socks[fd]
+                continue
+            sock.sendall(data)
+
+
+class ThreadCounter(object):
+    def __init__(self):
+        self.peak = 0
+        th = threading.Thread(target=self.run)
+        th.daemon = True
+        th.start()
+
+    def run(self):
+        while True:
+            self.peak = max(self.peak, threading.active_count())
+            time.sleep(0.05)
+
+
+def cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def start_daemon(target, *args):
+    th = threading.Thread(target=target, args=args)
+    th.daemon = True
+    th.start()
+
+
+def test():
+    if not hasattr(select, "poll"):
+        xlog.warn("test need select.poll")
+        return
+
+    log = Logger()
+    echo_listener = socket.socket()
+    echo_listener.bind(("127.0.0.1", 0))
+    echo_listener.listen(2048)
+    start_daemon(echo_server, echo_listener)
+    echo_port = echo_listener.getsockname()[1]
+
+    front_listener = socket.socket()
+    front_listener.bind(("127.0.0.1", 0))
+    front_listener.listen(2048)
+
+    thread_counter = ThreadCounter()
+    local = Session()
+    remote = Session()
+    local.peer = remote
+    remote.peer = local
+
+    start_time = time.time()
+    start_cpu = cpu_time()
+    clients = []
+    host = "127.0.0.1"
+    for conn_id in range(1, conn_num + 1):
+        client = socket.create_connection(front_listener.getsockname())
+        sock, _ = front_listener.accept()
+        clients.append(client)
+
+        remote_conn = base_container.Conn(remote, conn_id, None, "", 0,
+                                          windows_size, windows_size / 4, False, log)
+        remote.conn_list[conn_id] = remote_conn
+        remote_conn.start(block=False)
+
+        local_conn = base_container.Conn(local, conn_id, sock, host, echo_port,
+                                         windows_size, windows_size / 4, True, log)
+        local.conn_list[conn_id] = local_conn
+        # create connect command, seq 0
+        local.send_conn_data(conn_id, struct.pack("<IBBH", 0, 0, 0, len(host)) + host +
+                             struct.pack("<H", echo_port))
+        local_conn.start(block=False)
+    setup_time = time.time() - start_time
+
+    payload = os.urandom(data_size)
+    # fd => [sock, sent, received]
+    status = {}
+    poller = select.poll()
+    for client in clients:
+        client.setblocking(0)
+        status[client.fileno()] = [client, 0, 0]
+        poller.register(client.fileno(), select.POLLIN | select.POLLOUT)
+
+    done = 0
+    end_time = time.time() + time_limit
+    while done < conn_num and time.time() < end_time:
+        for fd, event in poller.poll(1000):
+            st = status[fd]
+            client = st[0]
+            if event & select.POLLOUT and st[1] < data_size:
+                try:
+                    st[1] += client.send(payload[st[1]:])
+                except socket.error:
+                    pass
+                if st[1] >= data_size:
+                    poller.modify(fd, select.POLLIN)
+
+            if event & select.POLLIN:
+                try:
+                    data = client.recv(65536)
+                except socket.error:
+                    continue
+
+                if not data:
+                    poller.unregister(fd)
+                    continue
+
+                st[2] += len(data)
+                if st[2] >= data_size:
+                    done += 1
+                    poller.unregister(fd)
+
+    time_cost = time.time() - start_time
+    xlog.info("conn:%d echo:%d size:%d setup:%.2fs time:%.2fs cpu:%.2fs peak threads:%d",
+              conn_num, done, data_size, setup_time, time_cost, cpu_time() - start_cpu,
+              thread_counter.peak)
+
+    for client in clients:
+        client.close()
+    time.sleep(2)
+    xlog.info("after close, local conn:%d remote conn:%d threads:%d",
+              len(local.conn_list), len(remote.conn_list), threading.active_count())
+
+
+if __name__ == '__main__':
+    import traceback
+
+    try:
+        test()
+    except Exception:
+        traceback.print_exc(file=sys.stdout)
+    except KeyboardInterrupt:
+        pass
+    # Conn loops and session threads are not stopped.
+    os._exit(0)
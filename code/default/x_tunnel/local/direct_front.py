@@ -43,11 +43,13 @@ class FakeDispatcher(object):
         #self.second_stats = Queue.deque()
         self.second_stat = {
             "rtt": 0,
+            "queue_wait": 0,
             "sent": 0,
             "received": 0
         }
         self.minute_stat = {
             "rtt": 0,
+            "queue_wait": 0,
             "sent": 0,
             "received": 0
         }
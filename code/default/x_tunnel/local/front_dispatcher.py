@@ -115,6 +115,8 @@ def request(method, host, path="/", headers={}, data="", timeout=100):
             time.sleep(1)
             continue
 
+        # for statistic per front, like rtt estimator of proxy_session.
+        response.front_name = front.name
         return content, status, response
 
     return content, status, response
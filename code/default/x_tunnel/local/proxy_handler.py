@@ -212,7 +212,7 @@ class Socks5Server():
         if len(self.read_buffer) - self.buffer_start:
             g.session.conn_list[conn_id].transfer_received_data(self.read_buffer[self.buffer_start:])
 
-        g.session.conn_list[conn_id].start(block=True)
+        g.session.conn_list[conn_id].start(block=False)
 
     def socks5_handler(self):
         sock = self.connection
@@ -273,7 +273,7 @@ class Socks5Server():
         if len(self.read_buffer) - self.buffer_start:
             g.session.conn_list[conn_id].transfer_received_data(self.read_buffer[self.buffer_start:])
 
-        g.session.conn_list[conn_id].start(block=True)
+        g.session.conn_list[conn_id].start(block=False)
 
     def https_handler(self):
         line = self.read_crlf_line()
@@ -314,7 +314,7 @@ class Socks5Server():
         if (len(self.read_buffer) - self.buffer_start) > 0:
             g.session.conn_list[conn_id].transfer_received_data(self.read_buffer[self.buffer_start:])
 
-        g.session.conn_list[conn_id].start(block=True)
+        g.session.conn_list[conn_id].start(block=False)
 
     def http_handler(self, first_char):
         req_line = self.read_crlf_line()
@@ -369,5 +369,5 @@ class Socks5Server():
         left_buf = new_req_line + self.read_buffer[(len(req_line) + 1):]
         g.session.conn_list[conn_id].transfer_received_data(left_buf)
 
-        g.session.conn_list[conn_id].start(block=True)
+        g.session.conn_list[conn_id].start(block=False)
 
@@ -1,6 +1,7 @@
 import time
 import json
 import threading
+import heapq
 import xstruct as struct
 
 from xlog import getLogger
@@ -13,21 +14,46 @@ import global_var as g
 from gae_proxy.local import check_local_network
 
 
+message_cipher = None
+
+
+def get_message_cipher():
+    # key is derived once, create again only if password or method changed.
+    global message_cipher
+    cipher = message_cipher
+    if cipher is None or cipher.password != g.config.encrypt_password or \
+            cipher.method != g.config.encrypt_method.lower():
+        cipher = encrypt.MessageCipher(g.config.encrypt_password, g.config.encrypt_method)
+        message_cipher = cipher
+    return cipher
+
+
 def encrypt_data(data):
+    # data: str or WriteBuffer, WriteBuffer is encrypted piece by piece without join.
+    if isinstance(data, base_container.WriteBuffer):
+        if g.config.encrypt_data:
+            return get_message_cipher().encrypt_buffers(data.buffer_list)
+        else:
+            return data.get_string()
+
     if g.config.encrypt_data:
-        return encrypt.Encryptor(g.config.encrypt_password, g.config.encrypt_method).encrypt(data)
+        return get_message_cipher().encrypt(data)
     else:
         return data
 
 
 def decrypt_data(data):
-    if g.config.encrypt_data:
-        if isinstance(data, memoryview):
-            data = data.tobytes()
-        return encrypt.Encryptor(g.config.encrypt_password, g.config.encrypt_method).decrypt(data)
-    else:
+    if not g.config.encrypt_data:
         return data
 
+    cipher = get_message_cipher()
+    if isinstance(data, memoryview) and not data.readonly and len(data) > cipher.iv_len:
+        # body read to bytearray, decrypt in place, stream cipher only.
+        data_len = cipher.decrypt_into(data, data[cipher.iv_len:])
+        return data[cipher.iv_len:cipher.iv_len + data_len]
+
+    return cipher.decrypt(data)
+
 
 def sleep(t):
     end_time = time.time() + t
@@ -49,6 +75,9 @@ class ProxySession():
         self.send_delay = g.config.send_delay / 1000.0
         self.ack_delay = g.config.ack_delay / 1000.0
         self.resend_timeout = g.config.resend_timeout / 1000.0
+        self.min_resend_timeout = g.config.min_resend_timeout / 1000.0
+        # front name => RttEstimator
+        self.rtt_estimators = {}
 
         self.running = False
         self.roundtrip_thread = {}
@@ -86,9 +115,11 @@ class ProxySession():
             self.last_receive_time = 0
             self.traffic = 0
 
-            # sn => (payload, send_time)
-            # sn => acked
+            # sn => (payload, resend_time, resend_num)
             self.unacked_send_list = {}
+            # heap of (resend_time, sn), acked or resent sn is skipped when popped
+            self.resend_timer = []
+            # all sn <= acked_send_continue_sn are acked
             self.acked_send_continue_sn = 0
 
             self.received_sn = []
@@ -227,9 +258,12 @@ class ProxySession():
             recent_received += stat["received"]
             total_sent += dispatcher.total_sent
             total_received += dispatcher.total_received
+            estimator = self.rtt_estimators.get(name)
             res[name] = {
                 "score": score,
                 "rtt": stat["rtt"],
+                "rto": int(estimator.rto * 1000) if estimator else 0,
+                "queue_wait": stat["queue_wait"],
                 "success_num": dispatcher.success_num,
                 "fail_num": dispatcher.fail_num,
                 "worker_num": dispatcher.worker_num(),
@@ -406,26 +440,26 @@ class ProxySession():
         buf = base_container.WriteBuffer()
 
         with self.lock:
-            for sn in self.unacked_send_list:
-                pk = self.unacked_send_list[sn]
-                if isinstance(pk, str):
+            while self.resend_timer and self.resend_timer[0][0] <= time_now:
+                resend_time, sn = heapq.heappop(self.resend_timer)
+                pk = self.unacked_send_list.get(sn)
+                if not pk or pk[1] != resend_time:
                     continue
 
-                payload, send_time = pk
-                if time_now - send_time > self.resend_timeout:
-                    g.stat["resend"] += 1
-                    buf.append(self.sn_payload_head(sn, payload))
-                    buf.append(payload)
-                    self.unacked_send_list[sn] = (payload, time_now)
-                    if len(buf) > g.config.max_payload:
-                        return buf
+                payload, _, resend_num = pk
+                g.stat["resend"] += 1
+                buf.append(self.sn_payload_head(sn, payload))
+                buf.append(payload)
+                self.add_resend_timer(sn, payload, time_now, resend_num + 1)
+                if len(buf) > g.config.max_payload:
+                    return buf
 
             if self.send_buffer.pool_size > g.config.max_payload or \
                     (self.send_buffer.pool_size > 0 and (
                         (self.send_buffer.last_put_time - self.last_send_time > self.send_delay) or
                         (time.time() - self.send_buffer.last_put_time > self.send_delay))):
                 payload, sn = self.send_buffer.get()
-                self.unacked_send_list[sn] = (payload, time_now)
+                self.add_resend_timer(sn, payload, time_now, 0)
                 buf.append(self.sn_payload_head(sn, payload))
                 buf.append(payload)
 
@@ -434,16 +468,39 @@ class ProxySession():
 
         return buf
 
+    def add_resend_timer(self, sn, payload, time_now, resend_num):
+        # exponential backoff for resend, but not longer than the fixed resend_timeout.
+        timeout = min(self.get_rto() * (2 ** min(resend_num, 10)), self.resend_timeout)
+        resend_time = time_now + timeout
+        self.unacked_send_list[sn] = (payload, resend_time, resend_num)
+        heapq.heappush(self.resend_timer, (resend_time, sn))
+
+    def get_rto(self):
+        # front of next roundtrip is unknown, use the max rto of fronts used recently.
+        time_now = time.time()
+        rto = 0
+        for estimator in self.rtt_estimators.values():
+            if time_now - estimator.last_update < 60:
+                rto = max(rto, estimator.rto)
+        return rto or self.resend_timeout
+
+    def update_rtt(self, front_name, rtt):
+        with self.lock:
+            estimator = self.rtt_estimators.get(front_name)
+            if not estimator:
+                estimator = self.rtt_estimators[front_name] = base_container.RttEstimator(
+                    self.min_resend_timeout, self.resend_timeout, self.ack_delay)
+            estimator.update(rtt)
+
     def get_ack(self, force=False):
         time_now = time.time()
         if force or \
                 (self.last_receive_time < self.last_send_time and
                                  time_now - self.last_send_time > self.ack_delay):
 
+            last_ack, block_list = self.receive_process.get_ack()
             buf = base_container.WriteBuffer()
-            buf.append(struct.pack("<I", self.receive_process.next_sn-1))
-            for sn in self.receive_process.block_list:
-                buf.append(struct.pack("<I", sn))
+            buf.append(struct.pack("<%dI" % (len(block_list) + 1), last_ack, *block_list))
             return buf
 
         return ""
@@ -480,25 +537,22 @@ class ProxySession():
         try:
             last_ack = struct.unpack("<I", ack.get(4))[0]
 
-            while len(ack):
-                sn = struct.unpack("<I", ack.get(4))[0]
+            # sn received out of order by remote
+            sack_num = len(ack) // 4
+            for sn in struct.unpack("<%dI" % sack_num, ack.get(sack_num * 4)):
                 # xlog.debug("ack: %d", sn)
-                if sn in self.unacked_send_list:
-                    self.unacked_send_list[sn] = "acked"
+                self.unacked_send_list.pop(sn, None)
 
-            for sn in self.unacked_send_list:
-                if sn > last_ack:
-                    continue
-                if self.unacked_send_list[sn] == "acked":
-                    continue
-
-                # xlog.debug("last_ack:%d sn:%d", last_ack, sn)
-                self.unacked_send_list[sn] = "acked"
+            if last_ack > self.acked_send_continue_sn:
+                # only remove sn newly acked, not scan all unacked.
+                if last_ack - self.acked_send_continue_sn < len(self.unacked_send_list):
+                    for sn in xrange(self.acked_send_continue_sn + 1, last_ack + 1):
+                        self.unacked_send_list.pop(sn, None)
+                else:
+                    for sn in [sn for sn in self.unacked_send_list if sn <= last_ack]:
+                        del self.unacked_send_list[sn]
 
-            while (self.acked_send_continue_sn + 1) in self.unacked_send_list and \
-                            self.unacked_send_list[self.acked_send_continue_sn + 1] == "acked":
-                self.acked_send_continue_sn += 1
-                del self.unacked_send_list[self.acked_send_continue_sn]
+                self.acked_send_continue_sn = last_ack
 
         except Exception as e:
             xlog.exception("ack_process:%r", e)
@@ -575,8 +629,7 @@ class ProxySession():
             upload_post_buf = base_container.WriteBuffer(upload_data_head)
             upload_post_buf.append(data)
             upload_post_buf.append(ack)
-            upload_post_data = str(upload_post_buf)
-            upload_post_data = encrypt_data(upload_post_data)
+            upload_post_data = encrypt_data(upload_post_buf)
             self.last_send_time = time.time()
 
             sleep_time = 1
@@ -688,6 +741,7 @@ class ProxySession():
             rtt = max(100, rtt)
             speed = (send_data_len + len(content) + 400) / rtt
             response.worker.update_debug_data(rtt, send_data_len, len(content), speed)
+            self.update_rtt(response.front_name, rtt / 1000.0)
             if rtt > 8000:
                 xlog.debug("rtt:%d speed:%d trace:%s", rtt, speed, response.worker.get_trace())
                 xlog.debug("task trace:%s", response.task.get_trace())